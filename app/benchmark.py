@@ -0,0 +1,483 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark per le fasi della pipeline del Redmine Password Visual Packer.
+
+Di default esegue la suite per fase (warm-up + iterazioni misurate, percentili
+p50/p95/p99 e picco di memoria); `--json` salva i risultati, `--compare`
+confronta con un file salvato in precedenza e termina con codice 1 se una fase
+è peggiorata oltre la soglia. `--implementations` esegue invece i confronti
+tra implementazioni (legacy vs attuale, backend di archiviazione).
+
+Le fasi `startup_help` e `startup_noop_run` misurano l'avvio a freddo di un
+nuovo interprete (`main.py --help` e un run senza ticket, `main.py
+--ticket-id`): tengono traccia del costo degli import e del caricamento della
+configurazione.
+
+Esempi:
+    python app/benchmark.py --iterations 50 --json bench.json
+    python app/benchmark.py --compare bench.json --threshold 0.2
+    python app/benchmark.py --implementations --iterations 5
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import namedtuple
+
+from PIL import Image, ImageDraw, ImageFont
+
+import password_utils
+import config
+from password_utils import genera_password, crea_immagine, render_password_image
+from crypto_utils import run_visual_crypto
+from visual_crypto import SHARE_FORMATS, split_image, save_share, write_shares
+from mkdocx import build_docx, add_body_background_anchor, _load_template
+from docx_splice import SpliceTemplate, UnsupportedTemplate
+from zipper import ARCHIVE_BACKENDS, get_archive_backend, crea_7z_cifrato
+from main import _cleanup_sensitive_artifacts, _ensure_secure_tree
+
+# Una fase della suite: `prepare(work_dir)` restituisce (setup, fn); `setup()`
+# gira fuori dalla misura prima di ogni chiamata e il suo valore è passato a `fn`.
+Stage = namedtuple("Stage", ["name", "prepare"])
+
+
+def _time_call(fn, iterations):
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return timings
+
+
+def _cpu_seconds():
+    """Tempo CPU (user+sys) del processo corrente e dei figli terminati."""
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+def _legacy_render_password_image(password):
+    """Rendering precedente: scansione da 80 in giù con un caricamento font per dimensione."""
+    img = Image.new('1', (400, 100), color=1)
+    draw = ImageDraw.Draw(img)
+    for size in range(80, 10, -1):
+        font = ImageFont.truetype(config.FONT_PATH, size)
+        bbox = draw.textbbox((0, 0), password, font=font)
+        w, h = bbox[2] - bbox[0], bbox[3] - bbox[1]
+        if w < 390 and h < 90:
+            break
+    draw.text(((400 - w) // 2, (100 - h) // 2), password, font=font, fill=0)
+    return img
+
+
+def bench_password_image(iterations):
+    """Confronta il rendering con font/tabelle in cache con la scansione legacy."""
+    passwords = [genera_password() for _ in range(iterations)]
+    for password in passwords:
+        if render_password_image(password).tobytes() != _legacy_render_password_image(password).tobytes():
+            raise AssertionError(f"Output diverso dal rendering legacy per {password!r}")
+
+    def run_all(fn):
+        return lambda: [fn(password) for password in passwords]
+
+    def cold():
+        password_utils._FONT_CACHE.clear()
+        password_utils._ADVANCE_CACHE.clear()
+        run_all(render_password_image)()
+
+    return {
+        "legacy": _time_call(run_all(_legacy_render_password_image), 1),
+        "cold": _time_call(cold, 1),
+        "cached": _time_call(run_all(render_password_image), 1),
+    }
+
+
+def bench_visual_crypto(work_dir, iterations):
+    """Confronta il motore in-process con lo script legacy su un'immagine base reale."""
+    base_img = crea_immagine(genera_password(), 0, work_dir)
+    results = {}
+    for engine in ("inprocess", "script"):
+        results[engine] = _time_call(lambda: run_visual_crypto(base_img, engine=engine), iterations)
+    return results
+
+
+def bench_archive(work_dir, iterations):
+    """Confronta i backend di archiviazione su un set di artefatti reali di un ticket.
+
+    Per ogni backend riporta latenza per archivio e CPU totale (inclusi i
+    processi figli, cioè il costo del fork/exec di `7z`).
+    """
+    base_img = crea_immagine(genera_password(), 0, work_dir)
+    a_path, b_path = run_visual_crypto(base_img)
+    members = {}
+    for path in (base_img, a_path, b_path):
+        with open(path, 'rb') as f:
+            members[os.path.basename(path)] = f.read()
+    members["ticket_0_password.txt"] = b"password"
+
+    results = {}
+    cpu = {}
+    for name in ARCHIVE_BACKENDS:
+        if name == "7z" and shutil.which("7z") is None:
+            print("    [!] 7z non trovato nel PATH: backend '7z' saltato")
+            continue
+        try:
+            backend = get_archive_backend(name)
+        except RuntimeError as e:
+            print(f"    [!] {e}: backend '{name}' saltato")
+            continue
+        start_cpu = _cpu_seconds()
+        results[name] = _time_call(lambda: backend.write(io.BytesIO(), members, "password"), iterations)
+        cpu[name] = (_cpu_seconds() - start_cpu) / iterations
+    return results, cpu
+
+
+def bench_share_formats(work_dir, iterations):
+    """Confronta i formati delle share sul percorso crea_immagine -> share -> DOCX -> archivio.
+
+    Per ogni formato riporta il tempo di generazione delle due share, il tempo
+    di encoding PNG di una share, la memoria della share decodificata e le
+    dimensioni di share, DOCX e archivio cifrato (backend `archive.backend`).
+    """
+    password = genera_password()
+    base_img = crea_immagine(password, 0, work_dir)
+    with Image.open(base_img) as img:
+        share_a, _ = split_image(img)
+    backend = get_archive_backend()
+    results = {}
+    sizes = {}
+    for fmt in SHARE_FORMATS:
+        fmt_dir = os.path.join(work_dir, fmt)
+        os.makedirs(fmt_dir)
+        results[fmt] = _time_call(lambda: write_shares(base_img, fmt_dir, fmt=fmt), iterations)
+        results[f"{fmt}:png"] = _time_call(lambda: save_share(share_a, io.BytesIO(), fmt), iterations)
+        a_path, b_path = write_shares(base_img, fmt_dir, fmt=fmt)
+        with Image.open(a_path) as share_img:
+            # Memoria dell'immagine in Pillow (1 byte per banda per pixel)
+            image_bytes = share_img.width * share_img.height * len(share_img.getbands())
+        docx_buf = io.BytesIO()
+        build_docx(config.TEMPLATE_DOCX, a_path, docx_buf)
+        members = {"ticket_0_password.txt": password.encode(), "ticket_0.docx": docx_buf.getvalue()}
+        for path in (base_img, a_path, b_path):
+            with open(path, 'rb') as f:
+                members[os.path.basename(path)] = f.read()
+        archive_buf = io.BytesIO()
+        backend.write(archive_buf, members, "password")
+        sizes[fmt] = {
+            "image_bytes": image_bytes,
+            "png_bytes": os.path.getsize(a_path) + os.path.getsize(b_path),
+            "docx_bytes": len(docx_buf.getvalue()),
+            "archive_bytes": len(archive_buf.getvalue()),
+        }
+    return results, sizes
+
+
+def bench_docx_engines(work_dir, iterations, extra_templates=()):
+    """Confronta python-docx (`add_body_background_anchor` + save) e lo splice per template.
+
+    Usa il template di default, quelli dei progetti configurati e
+    `extra_templates`, dal più grande; per ogni template riporta la
+    dimensione, il costo dell'indicizzazione splice (una volta per template)
+    e i tempi per DOCX.
+    """
+    a_img, _ = run_visual_crypto(crea_immagine(genera_password(), 0, work_dir))
+    with open(a_img, 'rb') as f:
+        a_png = f.read()
+    templates = {os.path.realpath(config.TEMPLATE_DOCX)}
+    templates.update(os.path.realpath(r.docx_template) for r in config.PROJECTS if r.docx_template)
+    templates.update(os.path.realpath(t) for t in extra_templates)
+    templates = sorted((t for t in templates if os.path.isfile(t)), key=os.path.getsize, reverse=True)
+
+    def python_docx(template):
+        doc, docpr_id = _load_template(template)
+        add_body_background_anchor(doc.paragraphs[0], io.BytesIO(a_png), docpr_id)
+        doc.save(io.BytesIO())
+
+    results = {}
+    info = {}
+    for template in templates:
+        name = os.path.basename(template)
+        python_docx(template)   # parse del template fuori dalla misura, come in produzione
+        results[f"{name}:python-docx"] = _time_call(lambda: python_docx(template), iterations)
+        start = time.perf_counter()
+        try:
+            spliced = SpliceTemplate(template)
+        except UnsupportedTemplate as e:
+            info[name] = f"{os.path.getsize(template)} byte, non supportato dallo splice ({e})"
+            continue
+        index_ms = (time.perf_counter() - start) * 1000
+        results[f"{name}:splice"] = _time_call(lambda: spliced.write(a_png, io.BytesIO()), iterations)
+        info[name] = f"{os.path.getsize(template)} byte, indicizzazione splice {index_ms:.1f} ms"
+    return results, info
+
+
+def _percentile(sorted_values, pct):
+    """Percentile nearest-rank su valori già ordinati."""
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def _ticket_fixture(work_dir, name):
+    """Directory di ticket completa (password, immagini, DOCX) come in `main`."""
+    ticket_dir = os.path.join(work_dir, name)
+    os.makedirs(ticket_dir, exist_ok=True)
+    password = genera_password()
+    with open(os.path.join(ticket_dir, "ticket_0_password.txt"), "w") as f:
+        f.write(password)
+    base_img = crea_immagine(password, 0, ticket_dir)
+    a_img, _ = run_visual_crypto(base_img)
+    build_docx(config.TEMPLATE_DOCX, a_img, os.path.join(ticket_dir, "ticket_0.docx"))
+    return ticket_dir
+
+
+def _prepare_password(work_dir):
+    return None, lambda _: genera_password()
+
+
+def _prepare_image(work_dir):
+    return None, lambda _: crea_immagine(genera_password(), 0, work_dir)
+
+
+def _prepare_visual(work_dir):
+    base_img = crea_immagine(genera_password(), 0, work_dir)
+    return None, lambda _: run_visual_crypto(base_img)
+
+
+def _prepare_docx_anchor(work_dir):
+    a_img, _ = run_visual_crypto(crea_immagine(genera_password(), 0, work_dir))
+    with open(a_img, 'rb') as f:
+        a_png = f.read()
+
+    def setup():
+        doc, docpr_id = _load_template(config.TEMPLATE_DOCX)
+        return doc.paragraphs[0], docpr_id
+
+    return setup, lambda args: add_body_background_anchor(args[0], io.BytesIO(a_png), args[1])
+
+
+def _prepare_build_docx(work_dir):
+    a_img, _ = run_visual_crypto(crea_immagine(genera_password(), 0, work_dir))
+    return None, lambda _: build_docx(config.TEMPLATE_DOCX, a_img, io.BytesIO())
+
+
+def _prepare_archive(work_dir):
+    ticket_dir = _ticket_fixture(work_dir, "ticket_0")
+    archive = os.path.join(work_dir, "ticket_0.7z")
+
+    def setup():
+        # `7z a` aggiunge a un archivio esistente: si riparte ogni volta da zero
+        if os.path.exists(archive):
+            os.remove(archive)
+
+    return setup, lambda _: crea_7z_cifrato(ticket_dir, 0, "password")
+
+
+def _prepare_cleanup(work_dir):
+    template_dir = _ticket_fixture(work_dir, "template")
+    counter = iter(range(sys.maxsize))
+
+    def setup():
+        ticket_dir = os.path.join(work_dir, f"ticket_{next(counter)}")
+        shutil.copytree(template_dir, ticket_dir)
+        archive = ticket_dir + ".7z"
+        shutil.copyfile(os.path.join(template_dir, "ticket_0.docx"), archive)
+        return ticket_dir, archive
+
+    def cleanup(args):
+        _ensure_secure_tree(args[0])
+        _cleanup_sensitive_artifacts(*args)
+
+    return setup, cleanup
+
+
+def _prepare_startup(*argv):
+    def prepare(work_dir):
+        # Nuovo interprete a ogni iterazione; cwd temporanea per gli output relativi
+        cmd = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py"), *argv]
+        return None, lambda _: subprocess.run(cmd, cwd=work_dir, capture_output=True, check=True)
+    return prepare
+
+
+STAGES = (
+    Stage("genera_password", _prepare_password),
+    Stage("crea_immagine", _prepare_image),
+    Stage("run_visual_crypto", _prepare_visual),
+    Stage("docx_anchor", _prepare_docx_anchor),
+    Stage("build_docx", _prepare_build_docx),
+    Stage("crea_7z_cifrato", _prepare_archive),
+    Stage("cleanup", _prepare_cleanup),
+    Stage("startup_help", _prepare_startup("--help")),
+    Stage("startup_noop_run", _prepare_startup("--ticket-id")),
+)
+
+
+def _measure(setup, fn, iterations, warmup):
+    """Esegue warm-up e iterazioni misurate; il picco di memoria Python
+    (tracemalloc) è misurato su un'esecuzione separata per non falsare i tempi."""
+    setup = setup or (lambda: None)
+    for _ in range(warmup):
+        fn(setup())
+    timings = []
+    for _ in range(iterations):
+        args = setup()
+        start = time.perf_counter()
+        fn(args)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+
+    args = setup()
+    tracemalloc.start()
+    try:
+        fn(args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    ms = [t * 1000 for t in timings]
+    return {
+        "warmup": warmup,
+        "iterations": iterations,
+        "min_ms": ms[0],
+        "mean_ms": sum(ms) / len(ms),
+        "p50_ms": _percentile(ms, 50),
+        "p95_ms": _percentile(ms, 95),
+        "p99_ms": _percentile(ms, 99),
+        "max_ms": ms[-1],
+        "peak_kib": peak / 1024,
+    }
+
+
+def run_suite(iterations, warmup, stages=None):
+    """Misura ogni fase in una directory temporanea; restituisce {fase: metriche}."""
+    selected = [s for s in STAGES if not stages or s.name in stages]
+    results = {}
+    work_dir = tempfile.mkdtemp(prefix="packer-bench-")
+    try:
+        for stage in selected:
+            stage_dir = os.path.join(work_dir, stage.name)
+            os.makedirs(stage_dir)
+            setup, fn = stage.prepare(stage_dir)
+            results[stage.name] = _measure(setup, fn, iterations, warmup)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def compare(baseline, current, threshold, metric="p50_ms", min_delta_ms=0.5):
+    """Confronta due esecuzioni; restituisce l'elenco delle regressioni.
+
+    Una fase regredisce se `metric` supera il baseline di oltre `threshold`
+    (frazione, es. 0.2 = +20%) e di almeno `min_delta_ms` in assoluto, così
+    che il rumore sulle fasi da pochi microsecondi non faccia fallire il confronto.
+    """
+    regressions = []
+    for name, metrics in current.items():
+        base = baseline.get(name)
+        if not base or metric not in base:
+            continue
+        before, after = base[metric], metrics[metric]
+        if after > before * (1 + threshold) and after - before >= min_delta_ms:
+            regressions.append((name, before, after))
+    return regressions
+
+
+def _print_suite(results):
+    print(f"{'fase':<20}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'picco KiB':>12}")
+    for name, m in results.items():
+        print(f"{name:<20}{m['p50_ms']:>10.2f}{m['p95_ms']:>10.2f}{m['p99_ms']:>10.2f}{m['peak_kib']:>12.1f}")
+
+
+def _print_results(stage, results):
+    print(f"[*] {stage}")
+    for name, timings in results.items():
+        median = timings[len(timings) // 2]
+        print(f"    {name:<12} min={timings[0] * 1000:8.2f} ms  median={median * 1000:8.2f} ms")
+
+
+def run_implementations(iterations, docx_templates=()):
+    """Confronti tra implementazioni (legacy vs attuale, motori DOCX, backend di archiviazione)."""
+    work_dir = tempfile.mkdtemp(prefix="packer-bench-")
+    try:
+        _print_results(f"crea_immagine ({iterations} password)", bench_password_image(iterations))
+        _print_results("run_visual_crypto", bench_visual_crypto(work_dir, iterations))
+        share_results, share_sizes = bench_share_formats(work_dir, iterations)
+        _print_results("formato share (2 share / encoding PNG di una share)", share_results)
+        for fmt, sizes in share_sizes.items():
+            print(f"    {fmt:<12} " + "  ".join(f"{name}={value}" for name, value in sizes.items()))
+        docx_results, docx_info = bench_docx_engines(work_dir, iterations, docx_templates)
+        _print_results("DOCX (python-docx / splice)", docx_results)
+        for name, text in docx_info.items():
+            print(f"    {name}: {text}")
+        archive_results, archive_cpu = bench_archive(work_dir, iterations)
+        _print_results("archivio 7z cifrato", archive_results)
+        for name, seconds in archive_cpu.items():
+            print(f"    {name:<12} cpu/archivio={seconds * 1000:8.1f} ms")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Redmine Password Visual Packer")
+    parser.add_argument('--iterations', type=int, default=20,
+                        help="Iterazioni misurate per fase (default: 20)")
+    parser.add_argument('--warmup', type=int, default=3,
+                        help="Iterazioni di warm-up non misurate (default: 3)")
+    parser.add_argument('--stage', action='append', choices=[s.name for s in STAGES],
+                        help="Misura solo le fasi indicate (ripetibile)")
+    parser.add_argument('--json', metavar='PATH', help="Salva i risultati in formato JSON")
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help="Confronta con un JSON precedente; exit 1 in caso di regressione")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="Peggioramento massimo tollerato (frazione, default: 0.2 = +20%%)")
+    parser.add_argument('--metric', choices=['p50_ms', 'p95_ms', 'p99_ms', 'mean_ms'], default='p50_ms',
+                        help="Metrica usata dal confronto (default: p50_ms)")
+    parser.add_argument('--min-delta-ms', type=float, default=0.5,
+                        help="Differenza assoluta minima per segnalare una regressione (default: 0.5 ms)")
+    parser.add_argument('--implementations', action='store_true',
+                        help="Esegue i confronti tra implementazioni invece della suite per fase")
+    parser.add_argument('--docx-template', action='append', default=[], metavar='PATH',
+                        help="Template DOCX aggiuntivo per il confronto python-docx/splice (ripetibile)")
+    args = parser.parse_args()
+
+    if args.implementations:
+        run_implementations(args.iterations, args.docx_template)
+        return 0
+
+    results = run_suite(args.iterations, args.warmup, args.stage)
+    _print_suite(results)
+
+    if args.json:
+        payload = {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "stages": results,
+        }
+        with open(args.json, "w") as f:
+            json.dump(payload, f, indent=2)
+        print(f"[✓] Risultati salvati in {args.json}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f).get("stages", {})
+        regressions = compare(baseline, results, args.threshold, args.metric, args.min_delta_ms)
+        for name, before, after in regressions:
+            print(f"[✗] {name}: {args.metric} {before:.2f} -> {after:.2f} ms (+{(after / before - 1) * 100:.0f}%)")
+        if regressions:
+            return 1
+        print(f"[✓] Nessuna regressione oltre il {args.threshold * 100:.0f}% rispetto a {args.compare}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
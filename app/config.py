@@ -1,7 +1,25 @@
+"""
+Configurazione del packer (config.yml, projects.yml, variabili d'ambiente).
+
+I valori sono esposti come variabili di modulo (`config.OUTPUT_DIR`, ...) ma i
+file YAML vengono letti solo al primo accesso a uno di essi, non all'import:
+`import config` non costa nulla a chi non usa la configurazione. I moduli
+dell'applicazione leggono `config.NOME` nel punto d'uso; `from config import
+NOME` accede al valore subito e quindi carica la configurazione all'import.
+
+Con la variabile d'ambiente `CONFIG_CACHE_DIR` il contenuto parsato di ogni
+file YAML è salvato in una cache locale indicizzata per percorso, mtime,
+dimensione e inode del file: finché il file non cambia, i run successivi non
+lo riparsano. La cache contiene anche password dei progetti e chiave API,
+quindi è disattivata per default.
+"""
+
+import hashlib
 import os
+import pickle
+import threading
 
 from dotenv import load_dotenv
-import yaml
 
 load_dotenv()
 
@@ -11,6 +29,9 @@ PROJECT_ROOT = os.path.dirname(APP_DIR)
 # Paths to configuration files
 CONFIG_YAML = os.getenv("CONFIG_YAML", "config.yml")
 PROJECTS_YAML = os.getenv("PROJECTS_YAML", "projects.yml")
+CACHE_HOME = os.path.join(os.getenv("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "redmine-password-packer")
+# Cache della configurazione parsata (contiene segreti): solo se richiesta
+CONFIG_CACHE_DIR = os.getenv("CONFIG_CACHE_DIR", "")
 
 
 # Default/fallback values
@@ -22,18 +43,64 @@ FONT_PATH = "/usr/share/fonts/truetype/dejavu/DejaVuSerif.ttf"
 TEMPLATE_HTML = "/app/static/template.html"
 TEMPLATE_MD = "/app/static/template.md"
 SCRIPT_VISUAL = "/app/visual_cryptography_py3__versione2 1 1.py"
+VISUAL_ENGINE = "inprocess"
+VISUAL_SHARE_FORMAT = "palette"
+VISUAL_PNG_COMPRESS_LEVEL = 6
 OUTPUT_DIR = "output"
+OUTPUT_DIR_CONFIGURED = False
+OUTPUT_MODE = "disk"
+MEMORY_STAGING_DIR = None
 ZIP_PWD = "Open@ctIPTS11"
+ARCHIVE_BACKEND = "7z"
 TEMPLATE_DOCX = "/app/static/template.docx"
+DOCX_ENGINE = "splice"
 
 ASSIGN_TO_ID = os.getenv("ASSIGN_TO_ID")
 RESOLVED_STATUS_ID = os.getenv("RESOLVED_STATUS_ID", "3")
+REDMINE_PAGE_SIZE = 100
+REDMINE_HTTP = {}
+REDMINE_IO_CONCURRENCY = 4
+METRICS_FORMAT = "prometheus"
+METRICS_FILE = None
+METRICS_SLOWEST = 10
+DAEMON_INTERVAL = 60
+DAEMON_FULL_SCAN_INTERVAL = 900
+DAEMON_STATE_FILE = None
+WEBHOOK_LISTEN = None
+WEBHOOK_TOKEN = os.getenv("WEBHOOK_TOKEN")
+WEBHOOK_DEBOUNCE = 0.2
+WEBHOOK_DEDUPE_WINDOW = 30.0
+WEBHOOK_RECONCILE_INTERVAL = 600
+KIT_POOL_ENABLED = False
+KIT_POOL_DIR = None
+KIT_POOL_KEY_FILE = None
+KIT_POOL_LOW_WATERMARK = 5
+KIT_POOL_HIGH_WATERMARK = 20
+KIT_POOL_REFILL_INTERVAL = 30.0
+JOURNAL_ENABLED = False
+JOURNAL_FILE = None
+JOURNAL_SPOOL_DIR = None
+JOURNAL_RETENTION_DAYS = 7.0
+METADATA_DIR = os.path.join(CACHE_HOME, "metadata")
+METADATA_TTL = 3600.0
+METADATA_CONCURRENCY = 8
+LEASE_ENABLED = False
+LEASE_MODE = "status"
+LEASE_STATUS_ID = None
+LEASE_CUSTOM_FIELD_ID = None
+LEASE_TTL = 900.0
+LEASE_SETTLE = 1.0
+LEASE_OWNER = os.getenv("PACKER_REPLICA_NAME")
+SHARD_COUNT = 1
+SHARD_INDEX = int(os.getenv("PACKER_SHARD_INDEX", "0"))
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
 
 PROJECT_DEFINITIONS = {}
 PROJECT_PASSWORDS = {}
 PROJECT_TICKET_PARAMS = {}
 PROJECT_DOCX_TEMPLATES = {}
+PROJECT_PASSWORD_POLICIES = {}
+PASSWORD_POLICY = {}
 REPORT_CONFIG = {}
 _CFG = {}
 
@@ -58,15 +125,63 @@ def _resolve_path(path: str):
     return os.path.join(PROJECT_ROOT, path)
 
 
+def _cache_path(path):
+    digest = hashlib.sha256(os.path.realpath(path).encode()).hexdigest()[:24]
+    return os.path.join(CONFIG_CACHE_DIR, f"{digest}.pickle")
+
+
+def _read_cache(path, key):
+    try:
+        with open(_cache_path(path), "rb") as f:
+            st = os.fstat(f.fileno())
+            # La cache contiene le password dei progetti: solo se privata e dell'utente
+            if st.st_uid != os.getuid() or st.st_mode & 0o077:
+                return None
+            cached_key, data = pickle.load(f)
+    except Exception:
+        return None
+    return data if cached_key == key else None
+
+
+def _write_cache(path, key, data):
+    try:
+        os.makedirs(CONFIG_CACHE_DIR, mode=0o700, exist_ok=True)
+        cache_path = _cache_path(path)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump((key, data), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except Exception:
+        # La cache è solo un'ottimizzazione (es. HOME non scrivibile nel container)
+        pass
+
+
+def _parse_yaml(f):
+    import yaml
+
+    # Loader in C (libyaml) se disponibile: molto più veloce su projects.yml grandi
+    return yaml.load(f, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader)) or {}
+
+
 def _load_yaml(path: str):
     for candidate in [path, _resolve_path(path)]:
         if not candidate:
             continue
         try:
             with open(candidate, "r") as f:
-                return yaml.safe_load(f) or {}
+                st = os.fstat(f.fileno())
+                key = (os.path.realpath(candidate), st.st_mtime_ns, st.st_size, st.st_ino)
+                if CONFIG_CACHE_DIR:
+                    data = _read_cache(candidate, key)
+                    if data is not None:
+                        return data
+                data = _parse_yaml(f)
         except FileNotFoundError:
             continue
+        if CONFIG_CACHE_DIR:
+            _write_cache(candidate, key, data)
+        return data
     return {}
 
 
@@ -78,69 +193,232 @@ def _extract_projects_section(data):
     return data
 
 
-def _normalize_projects(projects_map):
-    """Normalize project config into:
-    - passwords: project_key -> archive password
-    - ticket_params: project_key -> params for redmine.issue.create
-    - docx_templates: project_key -> custom docx template path
+# Chiavi di un blocco progetto che non sono parametri "flat" del ticket
+_PROJECT_FIELDS = {
+    "password",
+    "docx_template",
+    "templates",
+    "ticket",
+    "password_policy",
+    "identifier",
+    "name",
+    "id",
+    "parent",
+    "subprojects",
+}
 
-    Supported format:
-    projects:
-      my-project:
-        password: "password"
-        docx_template: "/path/template_project.docx"
-        ticket:
-          project_id: 12
-          category_id: 5
-          assigned_to_id: 3
+
+class ProjectRecord:
+    """Configurazione di un progetto, con i valori ereditati dal `parent` già applicati.
+
+    `password` è None per i progetti presenti in configurazione solo per
+    personalizzare il ticket di segnalazione (non vengono elaborati).
     """
-    passwords = {}
-    ticket_params = {}
-    docx_templates = {}
 
-    if not isinstance(projects_map, dict):
-        return passwords, ticket_params, docx_templates
-
-    for project_key, value in projects_map.items():
-        key = str(project_key)
-
-        if not isinstance(value, dict):
-            raise ValueError(
-                f"Invalid configuration for project '{key}': expected a mapping "
-                f"(e.g. {{password: '...', ticket: {{...}}}}), got {type(value).__name__}"
-            )
-
-        archive_pw = value.get("password")
-        if archive_pw is not None:
-            passwords[key] = str(archive_pw)
-
-        docx_tpl = value.get("docx_template")
-        if docx_tpl is None and isinstance(value.get("templates"), dict):
-            docx_tpl = value.get("templates", {}).get("docx")
-        if docx_tpl:
-            docx_templates[key] = str(docx_tpl)
-
-        ticket_cfg = value.get("ticket")
-        if isinstance(ticket_cfg, dict) and ticket_cfg:
-            ticket_params[key] = dict(ticket_cfg)
-            continue
+    __slots__ = ("key", "identifier", "name", "id", "parent", "password", "docx_template",
+                 "password_policy", "ticket_params", "subprojects")
+
+    def __init__(self, key, identifier=None, name=None, id=None, parent=None, password=None,
+                 docx_template=None, password_policy=None, ticket_params=None, subprojects=True):
+        self.key = key
+        self.identifier = identifier
+        self.name = name
+        self.id = id
+        self.parent = parent
+        self.password = password
+        self.docx_template = docx_template
+        self.password_policy = password_policy or {}
+        self.ticket_params = ticket_params or {}
+        self.subprojects = subprojects
+
+    @property
+    def configured(self):
+        return self.password is not None
+
+    def __repr__(self):
+        return f"ProjectRecord(key={self.key!r}, identifier={self.identifier!r}, name={self.name!r}, id={self.id!r})"
+
+
+class ProjectRegistry:
+    """Progetti configurati, indicizzati per chiave, identificatore, nome e id numerico.
+
+    Un ticket Redmine porta con sé nome e id del progetto (non sempre
+    l'identificatore): `resolve` prova tutti gli alias con un accesso O(1)
+    ciascuno e, se il progetto non è in configurazione, risale la gerarchia
+    dei progetti Redmine fino al primo antenato configurato che ammette i
+    sotto-progetti (`subprojects: true`, default).
+    """
 
+    __slots__ = ("_records", "_index")
+
+    def __init__(self, records=()):
+        self._records = list(records)
+        self._index = {}
+        for record in self._records:
+            for alias in (record.key, record.identifier, record.name, record.id):
+                if alias is None:
+                    continue
+                other = self._index.setdefault(str(alias), record)
+                if other is not record:
+                    raise ValueError(
+                        f"Invalid projects configuration: '{alias}' refers to both '{other.key}' and '{record.key}'"
+                    )
+
+    def __iter__(self):
+        return iter(self._records)
+
+    def __len__(self):
+        return len(self._records)
+
+    def __contains__(self, key):
+        return key is not None and str(key) in self._index
+
+    def get(self, key):
+        """Record per chiave o alias (identificatore, nome, id); None se assente."""
+        if key is None:
+            return None
+        return self._index.get(str(key))
+
+    def lookup(self, identifier=None, name=None, project_id=None):
+        for key in (identifier, name, project_id):
+            record = self.get(key)
+            if record is not None:
+                return record
+        return None
+
+    def resolve(self, identifier=None, name=None, project_id=None, lineage=None):
+        """Record del progetto di un ticket, anche per ereditarietà dai progetti padre.
+
+        `lineage(project_id)`, se fornito, restituisce (identificatore, nome, id)
+        del progetto stesso e poi dei suoi antenati fino alla radice; viene
+        chiamato solo se il progetto non è trovato direttamente.
+        """
+        record = self.lookup(identifier, name, project_id)
+        if record is not None or lineage is None or project_id is None or not self._records:
+            return record
+        for depth, (a_identifier, a_name, a_id) in enumerate(lineage(project_id)):
+            record = self.lookup(a_identifier, a_name, a_id)
+            if record is not None:
+                return record if depth == 0 or record.subprojects else None
+        return None
+
+
+# Registro unico dei progetti configurati (vedi `_build_project_registry`)
+PROJECTS = ProjectRegistry()
+
+
+def _parse_project(key, value):
+    if not isinstance(value, dict):
+        raise ValueError(
+            f"Invalid configuration for project '{key}': expected a mapping "
+            f"(e.g. {{password: '...', ticket: {{...}}}}), got {type(value).__name__}"
+        )
+    fields = {}
+    if value.get("password") is not None:
+        fields["password"] = str(value["password"])
+    docx_tpl = value.get("docx_template")
+    if docx_tpl is None and isinstance(value.get("templates"), dict):
+        docx_tpl = value.get("templates", {}).get("docx")
+    if docx_tpl:
+        fields["docx_template"] = str(docx_tpl)
+    if value.get("password_policy") is not None:
+        fields["password_policy"] = _validate_password_policy(value["password_policy"], f"project '{key}'")
+    ticket_cfg = value.get("ticket")
+    if isinstance(ticket_cfg, dict) and ticket_cfg:
+        fields["ticket_params"] = dict(ticket_cfg)
+    else:
         # Optional flat ticket params in the same project block
-        flat_ticket = {
-            k: v
-            for k, v in value.items()
-            if k
-            not in {
-                "password",
-                "docx_template",
-                "templates",
-                "ticket",
-            }
-        }
+        flat_ticket = {k: v for k, v in value.items() if k not in _PROJECT_FIELDS}
         if flat_ticket:
-            ticket_params[key] = flat_ticket
+            fields["ticket_params"] = flat_ticket
+    for alias in ("identifier", "name", "id", "parent"):
+        if value.get(alias) not in (None, ""):
+            fields[alias] = str(value[alias])
+    if "subprojects" in value:
+        fields["subprojects"] = bool(value["subprojects"])
+    return fields
+
+
+def _build_project_registry(projects_map):
+    """Costruisce il `ProjectRegistry` applicando l'ereditarietà da `parent`.
 
-    return passwords, ticket_params, docx_templates
+    Un progetto con `parent: <chiave o alias>` eredita password, template,
+    policy (unite, prevalgono le chiavi del figlio), parametri del ticket
+    (uniti) e `subprojects` che non definisce. Formato supportato:
+
+    projects:
+      my-project:
+        password: "password"
+        docx_template: "/path/template_project.docx"
+        password_policy: {length: 16, exclude: "0O1lI"}
+        ticket: {project_id: 12, category_id: 5, assigned_to_id: 3}
+      my-subproject:
+        parent: my-project
+        ticket: {category_id: 6}
+    """
+    if not isinstance(projects_map, dict):
+        return ProjectRegistry()
+    parsed = {str(key): _parse_project(str(key), value) for key, value in projects_map.items()}
+    aliases = {}
+    for key, fields in parsed.items():
+        for alias in (key, fields.get("identifier"), fields.get("name"), fields.get("id")):
+            if alias is not None:
+                aliases.setdefault(alias, key)
+
+    resolved = {}
+
+    def inherit(key, chain):
+        if key in resolved:
+            return resolved[key]
+        fields = dict(parsed[key])
+        parent = fields.get("parent")
+        if parent is not None:
+            parent_key = aliases.get(parent)
+            if parent_key is None:
+                raise ValueError(f"Invalid configuration for project '{key}': unknown parent '{parent}'")
+            if parent_key in chain:
+                raise ValueError(f"Invalid configuration for project '{key}': circular parent chain "
+                                 f"{' -> '.join(chain + [parent_key])}")
+            base = inherit(parent_key, chain + [parent_key])
+            for name in ("password", "docx_template", "subprojects"):
+                if name not in fields and name in base:
+                    fields[name] = base[name]
+            for name in ("password_policy", "ticket_params"):
+                if name in base:
+                    fields[name] = {**base[name], **fields.get(name, {})}
+        resolved[key] = fields
+        return fields
+
+    records = []
+    for key in parsed:
+        fields = inherit(key, [key])
+        records.append(ProjectRecord(
+            key,
+            identifier=fields.get("identifier"),
+            name=fields.get("name"),
+            id=fields.get("id"),
+            parent=fields.get("parent"),
+            password=fields.get("password"),
+            docx_template=_resolve_path(fields["docx_template"]) if fields.get("docx_template") else None,
+            password_policy=fields.get("password_policy"),
+            ticket_params=fields.get("ticket_params"),
+            subprojects=fields.get("subprojects", True),
+        ))
+    return ProjectRegistry(records)
+
+
+def _validate_password_policy(policy, where):
+    if not isinstance(policy, dict):
+        raise ValueError(
+            f"Invalid password_policy for {where}: expected a mapping "
+            f"(e.g. {{length: 16, exclude: '...'}}), got {type(policy).__name__}"
+        )
+    unknown = set(policy) - {"length", "charset", "exclude", "min_per_class"}
+    if unknown:
+        raise ValueError(f"Invalid password_policy for {where}: unknown keys {sorted(unknown)}")
+    if "min_per_class" in policy and not isinstance(policy["min_per_class"], dict):
+        raise ValueError(f"Invalid password_policy for {where}: min_per_class must be a mapping")
+    return dict(policy)
 
 
 def _load_project_definitions(main_cfg):
@@ -172,47 +450,145 @@ def load_project_passwords(path: str = None):
     if path:
         payload = _load_yaml(path)
         projects = _extract_projects_section(payload)
-        passwords, _, _ = _normalize_projects(projects)
-        return passwords
+        return {record.key: record.password for record in _build_project_registry(projects) if record.configured}
+    _ensure_loaded()
     return dict(PROJECT_PASSWORDS)
 
 
 def _apply_config_values(cfg):
-    global REDMINE_URL, API_KEY, OUTPUT_DIR, TEMPLATE_DOCX, SCRIPT_VISUAL, FONT_PATH
+    global REDMINE_URL, API_KEY, OUTPUT_DIR, OUTPUT_DIR_CONFIGURED, TEMPLATE_DOCX, SCRIPT_VISUAL, FONT_PATH
+    global VISUAL_ENGINE, OUTPUT_MODE, MEMORY_STAGING_DIR, ARCHIVE_BACKEND, DOCX_ENGINE
+    global VISUAL_SHARE_FORMAT, VISUAL_PNG_COMPRESS_LEVEL
     global ARCHIVE_PASSWORD, PROJECT_DEFINITIONS, PROJECT_PASSWORDS, PROJECT_TICKET_PARAMS, PROJECT_DOCX_TEMPLATES
-    global REPORT_CONFIG, ASSIGN_TO_ID, RESOLVED_STATUS_ID, LOG_LEVEL
+    global PROJECT_PASSWORD_POLICIES, PROJECTS, PASSWORD_POLICY
+    global REPORT_CONFIG, ASSIGN_TO_ID, RESOLVED_STATUS_ID, LOG_LEVEL, REDMINE_PAGE_SIZE, REDMINE_HTTP
+    global REDMINE_IO_CONCURRENCY, METRICS_FORMAT, METRICS_FILE, METRICS_SLOWEST
+    global DAEMON_INTERVAL, DAEMON_FULL_SCAN_INTERVAL, DAEMON_STATE_FILE
+    global WEBHOOK_LISTEN, WEBHOOK_TOKEN, WEBHOOK_DEBOUNCE, WEBHOOK_DEDUPE_WINDOW, WEBHOOK_RECONCILE_INTERVAL
+    global KIT_POOL_ENABLED, KIT_POOL_DIR, KIT_POOL_KEY_FILE, KIT_POOL_LOW_WATERMARK, KIT_POOL_HIGH_WATERMARK
+    global KIT_POOL_REFILL_INTERVAL
+    global JOURNAL_ENABLED, JOURNAL_FILE, JOURNAL_SPOOL_DIR, JOURNAL_RETENTION_DAYS
+    global METADATA_DIR, METADATA_TTL, METADATA_CONCURRENCY
+    global LEASE_ENABLED, LEASE_MODE, LEASE_STATUS_ID, LEASE_CUSTOM_FIELD_ID, LEASE_TTL, LEASE_SETTLE, LEASE_OWNER
+    global SHARD_COUNT, SHARD_INDEX
 
     REDMINE_URL = cfg.get("redmine", {}).get("url", REDMINE_URL)
     API_KEY = cfg.get("redmine", {}).get("api_key", API_KEY)
 
     OUTPUT_DIR = cfg.get("output", {}).get("dir", OUTPUT_DIR)
+    OUTPUT_DIR_CONFIGURED = bool(cfg.get("output", {}).get("dir"))
+    OUTPUT_MODE = str(cfg.get("output", {}).get("mode", OUTPUT_MODE)).lower()
+    MEMORY_STAGING_DIR = cfg.get("output", {}).get("memory_staging_dir", MEMORY_STAGING_DIR)
     TEMPLATE_DOCX = _resolve_path(cfg.get("templates", {}).get("docx", TEMPLATE_DOCX))
+    DOCX_ENGINE = str(cfg.get("templates", {}).get("docx_engine", DOCX_ENGINE)).lower()
 
     SCRIPT_VISUAL = _resolve_path(cfg.get("visual", {}).get("script", SCRIPT_VISUAL))
     FONT_PATH = _resolve_path(cfg.get("visual", {}).get("font", FONT_PATH))
+    VISUAL_ENGINE = str(cfg.get("visual", {}).get("engine", VISUAL_ENGINE)).lower()
+    VISUAL_SHARE_FORMAT = str(cfg.get("visual", {}).get("share_format", VISUAL_SHARE_FORMAT)).lower()
+    VISUAL_PNG_COMPRESS_LEVEL = int(cfg.get("visual", {}).get("png_compress_level", VISUAL_PNG_COMPRESS_LEVEL))
 
     ARCHIVE_PASSWORD = cfg.get("archive", {}).get("default_password", ARCHIVE_PASSWORD)
+    ARCHIVE_BACKEND = str(cfg.get("archive", {}).get("backend", ARCHIVE_BACKEND)).lower()
 
     project_defs = _load_project_definitions(cfg)
-    project_pw, project_ticket, project_docx_templates = _normalize_projects(project_defs)
     PROJECT_DEFINITIONS = project_defs
-    PROJECT_PASSWORDS = project_pw
-    PROJECT_TICKET_PARAMS = project_ticket
-    PROJECT_DOCX_TEMPLATES = {k: _resolve_path(v) for k, v in project_docx_templates.items()}
+    PROJECTS = _build_project_registry(project_defs)
+    # Dizionari separati per chiave di progetto, mantenuti per compatibilità
+    PROJECT_PASSWORDS = {r.key: r.password for r in PROJECTS if r.configured}
+    PROJECT_TICKET_PARAMS = {r.key: r.ticket_params for r in PROJECTS if r.ticket_params}
+    PROJECT_DOCX_TEMPLATES = {r.key: r.docx_template for r in PROJECTS if r.docx_template}
+    PROJECT_PASSWORD_POLICIES = {r.key: r.password_policy for r in PROJECTS if r.password_policy}
+    PASSWORD_POLICY = _validate_password_policy(cfg.get("password_policy") or {}, "password_policy")
 
     REPORT_CONFIG = cfg.get("report_missing_project", {}) or {}
 
     ASSIGN_TO_ID = cfg.get("redmine", {}).get("assign_to_id", ASSIGN_TO_ID)
     RESOLVED_STATUS_ID = cfg.get("redmine", {}).get("resolved_status_id", RESOLVED_STATUS_ID)
+    REDMINE_PAGE_SIZE = int(cfg.get("redmine", {}).get("page_size", REDMINE_PAGE_SIZE))
+    REDMINE_HTTP = dict(cfg.get("redmine", {}).get("http", {}) or {})
+    REDMINE_IO_CONCURRENCY = max(1, int(cfg.get("redmine", {}).get("io_concurrency", REDMINE_IO_CONCURRENCY)))
     LOG_LEVEL = str(cfg.get("logging", {}).get("level", LOG_LEVEL)).upper()
 
+    METRICS_FORMAT = str(cfg.get("metrics", {}).get("format", METRICS_FORMAT)).lower()
+    METRICS_FILE = cfg.get("metrics", {}).get("file", METRICS_FILE)
+    METRICS_SLOWEST = int(cfg.get("metrics", {}).get("slowest", METRICS_SLOWEST))
+
+    DAEMON_INTERVAL = float(cfg.get("daemon", {}).get("interval", DAEMON_INTERVAL))
+    DAEMON_FULL_SCAN_INTERVAL = float(cfg.get("daemon", {}).get("full_scan_interval", DAEMON_FULL_SCAN_INTERVAL))
+    DAEMON_STATE_FILE = cfg.get("daemon", {}).get("state_file", DAEMON_STATE_FILE)
+
+    WEBHOOK_LISTEN = cfg.get("webhook", {}).get("listen", WEBHOOK_LISTEN)
+    WEBHOOK_TOKEN = cfg.get("webhook", {}).get("token", WEBHOOK_TOKEN)
+    WEBHOOK_DEBOUNCE = float(cfg.get("webhook", {}).get("debounce", WEBHOOK_DEBOUNCE))
+    WEBHOOK_DEDUPE_WINDOW = float(cfg.get("webhook", {}).get("dedupe_window", WEBHOOK_DEDUPE_WINDOW))
+    WEBHOOK_RECONCILE_INTERVAL = float(cfg.get("webhook", {}).get("reconcile_interval", WEBHOOK_RECONCILE_INTERVAL))
+
+    kit_cfg = cfg.get("kit_pool", {}) or {}
+    KIT_POOL_ENABLED = bool(kit_cfg.get("enabled", KIT_POOL_ENABLED))
+    KIT_POOL_DIR = kit_cfg.get("dir", KIT_POOL_DIR)
+    KIT_POOL_KEY_FILE = kit_cfg.get("key_file", KIT_POOL_KEY_FILE)
+    KIT_POOL_LOW_WATERMARK = int(kit_cfg.get("low_watermark", KIT_POOL_LOW_WATERMARK))
+    KIT_POOL_HIGH_WATERMARK = int(kit_cfg.get("high_watermark", KIT_POOL_HIGH_WATERMARK))
+    KIT_POOL_REFILL_INTERVAL = float(kit_cfg.get("refill_interval", KIT_POOL_REFILL_INTERVAL))
+
+    journal_cfg = cfg.get("journal", {}) or {}
+    JOURNAL_ENABLED = bool(journal_cfg.get("enabled", JOURNAL_ENABLED))
+    JOURNAL_FILE = journal_cfg.get("file", JOURNAL_FILE)
+    JOURNAL_SPOOL_DIR = journal_cfg.get("spool_dir", JOURNAL_SPOOL_DIR)
+    JOURNAL_RETENTION_DAYS = float(journal_cfg.get("retention_days", JOURNAL_RETENTION_DAYS))
+
+    metadata_cfg = cfg.get("metadata", {}) or {}
+    METADATA_DIR = metadata_cfg.get("dir", METADATA_DIR) or None
+    METADATA_TTL = float(metadata_cfg.get("ttl", METADATA_TTL))
+    METADATA_CONCURRENCY = int(metadata_cfg.get("concurrency", METADATA_CONCURRENCY))
+
+    lease_cfg = cfg.get("lease", {}) or {}
+    LEASE_ENABLED = bool(lease_cfg.get("enabled", LEASE_ENABLED))
+    LEASE_MODE = str(lease_cfg.get("mode", LEASE_MODE)).lower()
+    LEASE_STATUS_ID = lease_cfg.get("status_id", LEASE_STATUS_ID)
+    LEASE_CUSTOM_FIELD_ID = lease_cfg.get("custom_field_id", LEASE_CUSTOM_FIELD_ID)
+    LEASE_TTL = float(lease_cfg.get("ttl", LEASE_TTL))
+    LEASE_SETTLE = float(lease_cfg.get("settle", LEASE_SETTLE))
+    LEASE_OWNER = lease_cfg.get("owner", LEASE_OWNER)
+
+    sharding_cfg = cfg.get("sharding", {}) or {}
+    SHARD_COUNT = int(sharding_cfg.get("replicas", SHARD_COUNT))
+    SHARD_INDEX = int(sharding_cfg.get("index", SHARD_INDEX))
+    # Con una sola replica l'indice è ignorato (PACKER_SHARD_INDEX può restare impostato)
+    if SHARD_COUNT < 1 or (SHARD_COUNT > 1 and not 0 <= SHARD_INDEX < SHARD_COUNT):
+        raise ValueError(
+            f"Invalid sharding configuration: index {SHARD_INDEX} must be in 0..{SHARD_COUNT - 1} "
+            f"(sharding.replicas={SHARD_COUNT})"
+        )
+
 
 def reload_config(path: str = None):
     """Ricarica la configurazione da YAML e aggiorna le variabili in questo modulo."""
-    global _CFG
-    _CFG = _load_config(path)
-    _apply_config_values(_CFG)
+    global _CFG, _LOADED
+    with _LOAD_LOCK:
+        globals().update(_DEFAULTS)
+        _CFG = _load_config(path)
+        _apply_config_values(_CFG)
+        _LOADED = True
+
+
+# Caricamento pigro: i valori configurabili vengono tolti dal modulo e
+# `__getattr__` (PEP 562) legge i file YAML al primo accesso a uno di essi.
+_EAGER = {"APP_DIR", "PROJECT_ROOT", "CONFIG_YAML", "PROJECTS_YAML", "CACHE_HOME", "CONFIG_CACHE_DIR", "_PROJECT_FIELDS"}
+_DEFAULTS = {name: globals().pop(name) for name in list(globals()) if name.isupper() and name not in _EAGER}
+_LOAD_LOCK = threading.RLock()
+_LOADED = False
+
+
+def _ensure_loaded():
+    with _LOAD_LOCK:
+        if not _LOADED:
+            reload_config()
 
 
-# Load configuration at import time
-reload_config()
+def __getattr__(name):
+    if name in _DEFAULTS:
+        _ensure_loaded()
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -3,7 +3,8 @@ import os
 import shutil
 import sys
 
-from config import SCRIPT_VISUAL
+import config
+from visual_crypto import write_shares, shares_png_bytes
 
 
 def _validate_visual_script(path):
@@ -21,9 +22,31 @@ def _validate_visual_script(path):
     return script_path
 
 
-def run_visual_crypto(base_img_path):
+def run_visual_crypto(base_img_path, engine=None):
+    """Genera Password_A.png e Password_B.png accanto a `base_img_path`.
+
+    Di default usa il motore in-process (`visual_crypto`), con le share nel
+    formato `visual.share_format`; con `visual.engine: script` esegue lo
+    script legacy in un sottoprocesso (share sempre RGBA).
+    """
+    engine = (engine or config.VISUAL_ENGINE or "inprocess").lower()
+    if engine != "script":
+        return write_shares(base_img_path, fmt=config.VISUAL_SHARE_FORMAT,
+                            compress_level=config.VISUAL_PNG_COMPRESS_LEVEL)
+    return _run_visual_script(base_img_path)
+
+
+def run_visual_crypto_in_memory(base_img):
+    """Restituisce i PNG (Password_A, Password_B) come bytes a partire da un'immagine PIL.
+
+    Usa sempre il motore in-process: lo script legacy lavora solo su file.
+    """
+    return shares_png_bytes(base_img, fmt=config.VISUAL_SHARE_FORMAT, compress_level=config.VISUAL_PNG_COMPRESS_LEVEL)
+
+
+def _run_visual_script(base_img_path):
     ticket_dir = os.path.dirname(base_img_path)
-    script_visual = _validate_visual_script(SCRIPT_VISUAL)
+    script_visual = _validate_visual_script(config.SCRIPT_VISUAL)
     img_name = os.path.basename(base_img_path)
     
     # Copia immagine nella sottodirectory di lavoro
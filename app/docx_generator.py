@@ -2,7 +2,7 @@ import os
 import os.path
 # import shutil
 import subprocess
-from config import TEMPLATE_MD
+import config
 
 def generate_md(ticket_dir, image_path):
     print(f"generate_md({ticket_dir}, {image_path})")
@@ -13,7 +13,7 @@ def generate_md(ticket_dir, image_path):
     
     # Legge e personalizza il template
     # with open(TEMPLATE_HTML, 'r') as f:
-    with open(TEMPLATE_MD, 'r') as f:
+    with open(config.TEMPLATE_MD, 'r') as f:
         md = f.read()
     #html = html.replace("Password_A.png", os.path.basename(image_path))
     
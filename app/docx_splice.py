@@ -0,0 +1,367 @@
+"""
+Motore DOCX "a innesto" (splice) per l'output dei ticket.
+
+python-docx, anche con il template in cache, serializza l'albero lxml di
+ogni parte e ricomprime tutti i membri dello ZIP a ogni `doc.save` solo per
+aggiungere il run di ancoraggio (`mkdocx._anchor_xml`). Il run però è lo
+stesso per ogni ticket (stesso rId, stesso id del docPr, stessa posizione):
+cambia solo il PNG della share.
+
+`SpliceTemplate` indicizza il template una volta sola:
+
+- i membri invariati sono copiati byte per byte (dati compressi originali,
+  nessuna decompressione/ricompressione);
+- `word/document.xml` (run inserito nel paragrafo scelto), il suo `.rels`
+  (relationship dell'immagine) e `[Content_Types].xml` (default `png`) sono
+  modificati come testo, ricompressi e verificati una volta;
+- per ogni ticket si scrivono solo l'immagine in `word/media` (non
+  compressa: il PNG lo è già) e la central directory.
+
+I template con una struttura non gestita (ZIP64 o cifrati, parte principale
+senza relationship, WordprocessingML senza prefisso, nessun paragrafo nel
+body, ...) sollevano `UnsupportedTemplate`: `splice_docx` restituisce False
+e `mkdocx.build_docx` usa python-docx.
+"""
+
+import logging
+import os
+import posixpath
+import re
+import struct
+import zipfile
+import zlib
+import xml.etree.ElementTree as ET
+
+from mkdocx import NAMESPACES, _anchor_xml
+
+logger = logging.getLogger(__name__)
+
+_W = NAMESPACES["w"]
+_PKG_RELS = "http://schemas.openxmlformats.org/package/2006/relationships"
+_CONTENT_TYPES = "http://schemas.openxmlformats.org/package/2006/content-types"
+_REL_OFFICE_DOCUMENT = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"
+_REL_IMAGE = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/image"
+_PNG_MAGIC = b"\x89PNG\r\n\x1a\n"
+
+# Tag XML (gruppi: "/" di chiusura, nome, attributi, "/" di elemento vuoto);
+# commenti e processing instruction sono riconosciuti e ignorati
+_TOKEN = re.compile(
+    r"<!--.*?-->|<\?.*?\?>"
+    r"|<(/?)([^\s/>!?]+)((?:[^>\"']|\"[^\"]*\"|'[^']*')*?)(/?)>",
+    re.S,
+)
+_XMLNS = re.compile(r"""\sxmlns:([\w.-]+)\s*=\s*["']([^"']*)["']""")
+_IMAGE_NAME = re.compile(r"(?:.*/)?[A-Za-z]+([1-9][0-9]*)\.(?:png|jpe?g|gif|bmp|tiff?|emf|wmf|svg)", re.I)
+_ID_ATTR = re.compile(r"""\sid\s*=\s*["'](\d+)["']""")
+
+_LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+_CENTRAL_HEADER = struct.Struct("<4s6H3L5H2L")
+_END_RECORD = struct.Struct("<4s4H2LH")
+_ZIP_LIMIT = 0xFFFFFFFF
+
+# Template indicizzati: (percorso risolto, paragrafo) -> (mtime_ns, SpliceTemplate o None)
+_TEMPLATES = {}
+
+
+class UnsupportedTemplate(Exception):
+    """Il template ha una struttura che il motore splice non gestisce."""
+
+
+def _dos_datetime(date_time):
+    year, month, day, hour, minute, second = date_time
+    return (hour << 11) | (minute << 5) | (second // 2), ((year - 1980) << 9) | (month << 5) | day
+
+
+class _Member:
+    """Membro dello ZIP di output: dati già compressi e metadati per gli header."""
+
+    __slots__ = ("name", "data", "method", "crc", "size", "flags", "date_time", "external_attr")
+
+    def __init__(self, name, data, method, crc, size, flags, date_time, external_attr):
+        self.name = name.encode("utf-8")
+        # bit 11: nome UTF-8; bit 1-2: opzioni deflate (il bit 3, data descriptor, non serve più)
+        self.flags = (flags & 0x06) | (0x800 if not name.isascii() else 0)
+        self.data = data
+        self.method = method
+        self.crc = crc
+        self.size = size
+        self.date_time = date_time
+        self.external_attr = external_attr
+
+    @classmethod
+    def deflated(cls, info, payload):
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+        data = compressor.compress(payload) + compressor.flush()
+        return cls(info.filename, data, zipfile.ZIP_DEFLATED, zlib.crc32(payload), len(payload), 0,
+                   info.date_time, info.external_attr)
+
+    def local_header(self):
+        dos_time, dos_date = _dos_datetime(self.date_time)
+        return _LOCAL_HEADER.pack(b"PK\x03\x04", 20, self.flags, self.method, dos_time, dos_date,
+                                  self.crc, len(self.data), self.size, len(self.name), 0) + self.name
+
+    def central_header(self, offset):
+        dos_time, dos_date = _dos_datetime(self.date_time)
+        return _CENTRAL_HEADER.pack(b"PK\x01\x02", 20, 20, self.flags, self.method, dos_time, dos_date,
+                                    self.crc, len(self.data), self.size, len(self.name), 0, 0, 0, 0,
+                                    self.external_attr, offset) + self.name
+
+
+class SpliceTemplate:
+    """Template DOCX indicizzato per `paragraph_index`; solleva `UnsupportedTemplate`."""
+
+    def __init__(self, path, paragraph_index=0):
+        self.path = path
+        with open(path, "rb") as f:
+            raw = f.read()
+        try:
+            with zipfile.ZipFile(path) as zf:
+                infos = zf.infolist()
+                self._check_zip(infos)
+                parts = {info.filename: info for info in infos}
+                # Legge (e verifica il CRC di) tutti i membri una volta sola
+                payloads = {info.filename: zf.read(info) for info in infos}
+        except zipfile.BadZipFile as e:
+            raise UnsupportedTemplate(f"ZIP non valido: {e}") from None
+
+        document_name = self._main_part(payloads)
+        rels_name = posixpath.join(posixpath.dirname(document_name), "_rels",
+                                   posixpath.basename(document_name) + ".rels")
+        if document_name not in payloads or rels_name not in payloads:
+            raise UnsupportedTemplate(f"parte principale {document_name} o {rels_name} mancante")
+
+        # Primo numero non usato da un'altra immagine (come python-docx)
+        used = {int(m.group(1)) for m in map(_IMAGE_NAME.fullmatch, payloads) if m}
+        n = 1
+        while n in used or f"word/media/image{n}.png" in payloads:
+            n += 1
+        self.media_name = f"word/media/image{n}.png"
+        r_id, rels = self._add_relationship(payloads[rels_name],
+                                            posixpath.relpath(self.media_name, posixpath.dirname(document_name)))
+        modified = {
+            document_name: self._splice_document(payloads[document_name], paragraph_index, r_id),
+            rels_name: rels,
+            "[Content_Types].xml": self._add_png_default(payloads.get("[Content_Types].xml")),
+        }
+
+        members = []
+        for info in infos:
+            if info.filename in modified:
+                members.append(_Member.deflated(info, modified[info.filename]))
+            else:
+                members.append(self._raw_member(raw, info))
+        document_info = parts[document_name]
+        self._image_template = (document_info.date_time, 0o600 << 16)
+
+        head, central, offset = [], [], 0
+        for member in members:
+            central.append(member.central_header(offset))
+            chunk = member.local_header() + member.data
+            head.append(chunk)
+            offset += len(chunk)
+        self._head = b"".join(head)
+        self._central = b"".join(central)
+        self._count = len(members) + 1
+
+    # --- indicizzazione -----------------------------------------------------
+
+    @staticmethod
+    def _check_zip(infos):
+        if len(infos) >= 0xFFFF:
+            raise UnsupportedTemplate("troppi membri (ZIP64)")
+        names = set()
+        for info in infos:
+            if info.flag_bits & 0x1:
+                raise UnsupportedTemplate(f"membro cifrato: {info.filename}")
+            if info.compress_type not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+                raise UnsupportedTemplate(f"compressione {info.compress_type} non supportata: {info.filename}")
+            if max(info.file_size, info.compress_size, info.header_offset) >= _ZIP_LIMIT:
+                raise UnsupportedTemplate(f"membro ZIP64: {info.filename}")
+            if info.filename in names:
+                raise UnsupportedTemplate(f"membro duplicato: {info.filename}")
+            names.add(info.filename)
+
+    @staticmethod
+    def _raw_member(raw, info):
+        """Membro invariato: i dati compressi sono copiati dal template così come sono."""
+        signature, *_, name_len, extra_len = _LOCAL_HEADER.unpack_from(raw, info.header_offset)
+        if signature != b"PK\x03\x04":
+            raise UnsupportedTemplate(f"header locale non valido: {info.filename}")
+        start = info.header_offset + _LOCAL_HEADER.size + name_len + extra_len
+        return _Member(info.filename, raw[start:start + info.compress_size], info.compress_type, info.CRC,
+                       info.file_size, info.flag_bits, info.date_time, info.external_attr)
+
+    @staticmethod
+    def _main_part(payloads):
+        try:
+            rels = ET.fromstring(payloads["_rels/.rels"])
+        except (KeyError, ET.ParseError) as e:
+            raise UnsupportedTemplate(f"_rels/.rels non leggibile: {e}") from None
+        for rel in rels.iter(f"{{{_PKG_RELS}}}Relationship"):
+            if rel.get("Type") == _REL_OFFICE_DOCUMENT and rel.get("TargetMode") != "External":
+                return rel.get("Target", "").lstrip("/")
+        raise UnsupportedTemplate("relationship officeDocument mancante")
+
+    @staticmethod
+    def _insert_before_close(xml, tag, fragment):
+        """Inserisce `fragment` prima del tag di chiusura `tag` dell'elemento radice."""
+        pos = xml.rfind(f"</{tag}>")
+        if pos < 0:
+            raise UnsupportedTemplate(f"chiusura </{tag}> non trovata")
+        return xml[:pos] + fragment + xml[pos:]
+
+    def _add_relationship(self, payload, target):
+        """Relationship dell'immagine con il primo rId libero (come python-docx)."""
+        try:
+            root = ET.fromstring(payload)
+        except ET.ParseError as e:
+            raise UnsupportedTemplate(f"relationship non leggibili: {e}") from None
+        ids = {rel.get("Id") for rel in root.iter(f"{{{_PKG_RELS}}}Relationship")}
+        n = 1
+        while f"rId{n}" in ids:
+            n += 1
+        r_id = f"rId{n}"
+        xml = self._insert_before_close(
+            payload.decode("utf-8"), "Relationships",
+            f'<Relationship Id="{r_id}" Type="{_REL_IMAGE}" Target="{target}"/>')
+        return r_id, xml.encode("utf-8")
+
+    def _add_png_default(self, payload):
+        if payload is None:
+            raise UnsupportedTemplate("[Content_Types].xml mancante")
+        try:
+            root = ET.fromstring(payload)
+        except ET.ParseError as e:
+            raise UnsupportedTemplate(f"[Content_Types].xml non leggibile: {e}") from None
+        extensions = {(d.get("Extension") or "").lower() for d in root.iter(f"{{{_CONTENT_TYPES}}}Default")}
+        if "png" in extensions:
+            return payload
+        xml = self._insert_before_close(payload.decode("utf-8"), "Types",
+                                        '<Default Extension="png" ContentType="image/png"/>')
+        return xml.encode("utf-8")
+
+    def _splice_document(self, payload, paragraph_index, r_id):
+        """Inserisce il run di ancoraggio in fondo al paragrafo `paragraph_index` del body."""
+        try:
+            xml = payload.decode("utf-8")
+        except UnicodeDecodeError:
+            raise UnsupportedTemplate("document.xml non è UTF-8") from None
+        if "<!DOCTYPE" in xml or "<![CDATA[" in xml:
+            raise UnsupportedTemplate("DOCTYPE o CDATA in document.xml")
+
+        root_ns = None
+        w = None
+        depth = 0
+        body_depth = None
+        paragraphs = []     # (inizio, fine, prima del run, dopo il run)
+        docpr_ids = set()
+        for m in _TOKEN.finditer(xml):
+            closing, name, attrs, empty = m.groups()
+            if name is None:
+                continue
+            if root_ns is None:
+                root_ns = dict(_XMLNS.findall(attrs))
+                w = next((prefix for prefix, uri in root_ns.items() if uri == _W), None)
+                if w is None:
+                    raise UnsupportedTemplate("namespace WordprocessingML senza prefisso sulla radice")
+            if closing:
+                depth -= 1
+                if body_depth is not None and depth == body_depth + 1 and name == f"{w}:p":
+                    paragraphs.append((m.start(), m.start(), "", ""))
+                continue
+            if name == f"{w}:body" and body_depth is None:
+                body_depth = depth
+            elif name == f"{w}:p" and empty and body_depth is not None and depth == body_depth + 1:
+                paragraphs.append((m.start(), m.end(), f"<{name}{attrs}>", f"</{name}>"))
+            elif name.endswith(":docPr"):
+                found = _ID_ATTR.search(attrs)
+                if found:
+                    docpr_ids.add(int(found.group(1)))
+            if not empty:
+                depth += 1
+        if not paragraphs:
+            raise UnsupportedTemplate("nessun paragrafo nel body")
+
+        docpr_id = 1
+        while docpr_id in docpr_ids:
+            docpr_id += 1
+        prefixes = [prefix for prefix, uri in NAMESPACES.items() if root_ns.get(prefix) != uri]
+        run = re.sub(r">\s+<", "><", _anchor_xml(r_id, docpr_id, prefixes).strip())
+        start, end, before, after = paragraphs[max(0, min(paragraph_index, len(paragraphs) - 1))]
+        spliced = (xml[:start] + before + run + after + xml[end:]).encode("utf-8")
+        self._verify(spliced, paragraph_index, len(paragraphs), r_id)
+        return spliced
+
+    @staticmethod
+    def _verify(document, paragraph_index, count, r_id):
+        """Controllo (una volta per template) che il run sia finito dove previsto."""
+        try:
+            body = ET.fromstring(document).find(f"{{{_W}}}body")
+        except ET.ParseError as e:
+            raise UnsupportedTemplate(f"document.xml risultante non valido: {e}") from None
+        paragraphs = body.findall(f"{{{_W}}}p") if body is not None else []
+        if len(paragraphs) != count:
+            raise UnsupportedTemplate("struttura del body non riconosciuta")
+        run = paragraphs[max(0, min(paragraph_index, count - 1))][-1]
+        blip = run.find(f".//{{{NAMESPACES['a']}}}blip")
+        if run.tag != f"{{{_W}}}r" or blip is None or blip.get(f"{{{NAMESPACES['r']}}}embed") != r_id:
+            raise UnsupportedTemplate("run di ancoraggio non riconosciuto dopo l'inserimento")
+
+    # --- scrittura ----------------------------------------------------------
+
+    def write(self, image, out):
+        """Scrive il DOCX con `image` (bytes PNG) in `out` (percorso o file-like)."""
+        date_time, external_attr = self._image_template
+        member = _Member(self.media_name, image, zipfile.ZIP_STORED, zlib.crc32(image), len(image), 0,
+                         date_time, external_attr)
+        local = member.local_header()
+        central_offset = len(self._head) + len(local) + len(image)
+        central = self._central + member.central_header(len(self._head))
+        end = _END_RECORD.pack(b"PK\x05\x06", 0, 0, self._count, self._count, len(central), central_offset, 0)
+        chunks = (self._head, local, image, central, end)
+        if hasattr(out, "write"):
+            for chunk in chunks:
+                out.write(chunk)
+        else:
+            with open(out, "wb") as f:
+                f.writelines(chunks)
+
+
+def get_template(template_path, paragraph_index=0):
+    """`SpliceTemplate` in cache per il template (None se non supportato).
+
+    L'indice è rifatto quando cambia l'mtime del file; un template non
+    supportato viene segnalato una sola volta.
+    """
+    path = os.path.realpath(template_path)
+    mtime = os.stat(path).st_mtime_ns
+    key = (path, paragraph_index)
+    cached = _TEMPLATES.get(key)
+    if cached is None or cached[0] != mtime:
+        try:
+            template = SpliceTemplate(path, paragraph_index)
+        except UnsupportedTemplate as e:
+            logger.warning("DOCX template %s not supported by the splice engine (%s): using python-docx", path, e)
+            template = None
+        cached = (mtime, template)
+        _TEMPLATES[key] = cached
+    return cached[1]
+
+
+def clear_template_cache():
+    _TEMPLATES.clear()
+
+
+def splice_docx(template_path, image, out, paragraph_index=0):
+    """Genera il DOCX con il motore splice; False se serve python-docx.
+
+    `image` sono i bytes dell'immagine: solo i PNG sono innestati
+    direttamente, gli altri formati passano da python-docx.
+    """
+    if not image.startswith(_PNG_MAGIC):
+        return False
+    template = get_template(template_path, paragraph_index)
+    if template is None:
+        return False
+    template.write(image, out)
+    return True
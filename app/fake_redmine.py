@@ -0,0 +1,474 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Server REST locale che simula Redmine per i test di carico.
+
+Implementa solo gli endpoint usati dal progetto:
+
+- GET  /issues.json                  (filtri assigned_to_id=me, status_id,
+                                      issue_id=>=N o elenco, updated_on=>=T o <=T,
+                                      sort=id; limit/offset)
+- POST /issues.json, /projects/<id>/issues.json  (ticket di segnalazione)
+- GET  /issues/<id>.json             (con include=attachments,journals)
+- PUT  /issues/<id>.json             (note, stato, assegnatario, categoria, allegati,
+                                      campi personalizzati)
+- POST /uploads.json
+- GET  /users/current.json
+- GET  /users/current.json?include=memberships
+- GET  /projects.json                (limit/offset)
+- GET  /projects/<id>/memberships.json
+- GET  /roles/<id>.json
+- GET  /projects/<id>/issue_categories.json
+
+Latenza (`latency` + `jitter` casuale, in secondi) ed errori (`error_rate`:
+frazione di richieste che ricevono 503 prima di essere elaborate) sono
+configurabili. Assegnatario e categoria di un update sono validati contro
+membri con ruolo assegnabile e categorie del progetto come fa Redmine (422),
+così da esercitare
+`UpdatePlanner` e il fallback di `attach_and_update`.
+
+Esempio:
+    python app/fake_redmine.py --tickets 500 --project cfgd --latency 0.02
+"""
+
+import argparse
+import hashlib
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from collections import defaultdict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+CURRENT_USER_ID = 1
+STATUS_NEW = 1
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+ROLE_MANAGER = {"id": 3, "name": "Manager"}
+ROLE_OBSERVER = {"id": 4, "name": "Osservatore"}
+# Ruoli noti: solo i membri con un ruolo assegnabile possono ricevere ticket
+ROLES = {3: dict(ROLE_MANAGER, assignable=True), 4: dict(ROLE_OBSERVER, assignable=False)}
+
+_ISSUE_PATH = re.compile(r"^/issues/(\d+)\.json$")
+_MEMBERSHIPS_PATH = re.compile(r"^/projects/([^/]+)/memberships\.json$")
+_ROLE_PATH = re.compile(r"^/roles/(\d+)\.json$")
+_CATEGORIES_PATH = re.compile(r"^/projects/([^/]+)/issue_categories\.json$")
+_PROJECT_ISSUES_PATH = re.compile(r"^/projects/([^/]+)/issues\.json$")
+
+
+class FakeRedmine:
+    """Stato del server finto e relativo `ThreadingHTTPServer`.
+
+        with FakeRedmine(latency=0.01) as fake:
+            fake.add_project("cfgd")
+            fake.seed_tickets(100, ["cfgd"])
+            ...  # Redmine(fake.url, key="x")
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, jitter=0.0, error_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._tokens = itertools.count(1)
+        self._journal_ids = itertools.count(1)
+        self.projects = {}      # id -> {"id", "name", "identifier", "updated_on", "members", "observers",
+                                #        "categories"}
+        self.issues = {}        # id -> dict in formato API
+        self.uploads = {}       # token -> (byte caricati, sha256)
+        self.timings = defaultdict(list)
+        self.counters = defaultdict(int)
+        self.server = ThreadingHTTPServer((host, port), _make_handler(self))
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    # --- dati -------------------------------------------------------------
+
+    def add_project(self, name, identifier=None, members=(), parent=None, categories=(), observers=()):
+        """Crea un progetto; `parent` (id, identificatore o nome) lo rende un sotto-progetto.
+
+        `categories` sono i nomi delle categorie, con id `project_id * 100 + n` (n da 1).
+        `members` hanno il ruolo Manager, `observers` solo Osservatore (non assegnabile).
+        """
+        parent_project = self._find_project(parent) if parent is not None else None
+        with self._lock:
+            project_id = len(self.projects) + 1
+            self.projects[project_id] = {
+                "id": project_id,
+                "name": name,
+                "identifier": identifier or re.sub(r"[^a-z0-9_-]", "-", name.lower()),
+                "updated_on": _now(),
+                "members": {CURRENT_USER_ID, *[int(m) for m in members]},
+                "observers": {int(o) for o in observers},
+                "categories": {project_id * 100 + n: name for n, name in enumerate(categories, 1)},
+            }
+            if parent_project is not None:
+                self.projects[project_id]["parent"] = {"id": parent_project["id"], "name": parent_project["name"]}
+            return project_id
+
+    def _find_project(self, key):
+        for project in self.projects.values():
+            if str(key) in (str(project["id"]), project["identifier"], project["name"]):
+                return project
+        return None
+
+    def seed_tickets(self, count, project_names):
+        """Crea `count` ticket "Nuovo" assegnati all'utente corrente, distribuiti
+        a rotazione sui progetti indicati (creati se mancanti)."""
+        projects = [self._find_project(name) or self.projects[self.add_project(name)] for name in project_names]
+        with self._lock:
+            created = []
+            for i in range(count):
+                project = projects[i % len(projects)]
+                issue_id = next(self._ids)
+                self.issues[issue_id] = {
+                    "id": issue_id,
+                    "project": {"id": project["id"], "name": project["name"]},
+                    "subject": f"Richiesta credenziali #{issue_id}",
+                    "status": {"id": STATUS_NEW, "name": "Nuovo"},
+                    "assigned_to": {"id": CURRENT_USER_ID, "name": "packer"},
+                    "updated_on": _now(),
+                    "journals": [],
+                    "attachments": [],
+                }
+                created.append(issue_id)
+            return created
+
+    # --- ciclo di vita ----------------------------------------------------
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name="fake-redmine", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
+
+    def stats(self):
+        """Per endpoint: numero di richieste e latenza p50/p95 lato server (ms)."""
+        with self._lock:
+            timings = {k: sorted(v) for k, v in self.timings.items()}
+            counters = dict(self.counters)
+        out = {}
+        for endpoint, values in timings.items():
+            out[endpoint] = {
+                "requests": len(values),
+                "p50_ms": values[len(values) // 2] * 1000,
+                "p95_ms": values[min(len(values) - 1, int(len(values) * 0.95))] * 1000,
+            }
+        out["counters"] = counters
+        return out
+
+    # --- endpoint -----------------------------------------------------------
+
+    def list_issues(self, query):
+        assigned = query.get("assigned_to_id")
+        status = query.get("status_id")
+        min_id = 0
+        only_ids = None
+        if query.get("issue_id", "").startswith(">="):
+            min_id = int(query["issue_id"][2:])
+        elif query.get("issue_id"):
+            only_ids = {int(i) for i in query["issue_id"].split(",")}
+        updated_since, updated_until = "", "~"
+        if query.get("updated_on", "").startswith(">="):
+            # Stesso formato a larghezza fissa: il confronto tra stringhe basta
+            updated_since = query["updated_on"][2:]
+        elif query.get("updated_on", "").startswith("<="):
+            updated_until = query["updated_on"][2:]
+        limit = min(int(query.get("limit", 25)), 100)
+        offset = int(query.get("offset", 0))
+        with self._lock:
+            issues = [
+                issue for issue_id, issue in sorted(self.issues.items())
+                if issue_id >= min_id
+                and (only_ids is None or issue_id in only_ids)
+                and updated_since <= issue["updated_on"] <= updated_until
+                and (assigned != "me" or (issue["assigned_to"] or {}).get("id") == CURRENT_USER_ID)
+                and (status in (None, "*") or str(issue["status"]["id"]) == str(status))
+            ]
+            page = [_public_issue(issue) for issue in issues[offset:offset + limit]]
+        return 200, {"issues": page, "total_count": len(issues), "offset": offset, "limit": limit}
+
+    def upload(self, body):
+        with self._lock:
+            token = f"{next(self._tokens)}.fake"
+            self.uploads[token] = (len(body), hashlib.sha256(body).hexdigest())
+            self.counters["bytes_uploaded"] += len(body)
+        return 201, {"upload": {"id": int(token.split(".")[0]), "token": token}}
+
+    def get_issue(self, issue_id, query):
+        includes = set(query.get("include", "").split(","))
+        with self._lock:
+            issue = self.issues.get(issue_id)
+            if issue is None:
+                return 404, None
+            payload = _public_issue(issue)
+            if "attachments" not in includes:
+                payload.pop("attachments", None)
+            if "journals" in includes:
+                payload["journals"] = issue["journals"]
+            return 200, {"issue": json.loads(json.dumps(payload))}
+
+    def update_issue(self, issue_id, payload):
+        fields = payload.get("issue", {})
+        with self._lock:
+            issue = self.issues.get(issue_id)
+            if issue is None:
+                return 404, None
+            project = self.projects.get(issue["project"]["id"])
+            assignee = fields.get("assigned_to_id")
+            if assignee not in (None, "") and int(assignee) not in project["members"]:
+                self.counters["rejected_assignee"] += 1
+                return 422, {"errors": ["Assegnato a non è valido"]}
+            category = fields.get("category_id")
+            if category not in (None, "") and int(category) not in project["categories"]:
+                self.counters["rejected_category"] += 1
+                return 422, {"errors": ["Categoria non è valida"]}
+            for upload in fields.get("uploads", []):
+                if upload.get("token") not in self.uploads:
+                    return 422, {"errors": ["Allegato non valido"]}
+                filesize, digest = self.uploads[upload["token"]]
+                issue["attachments"].append({
+                    "id": int(upload["token"].split(".")[0]),
+                    "filename": upload.get("filename"),
+                    "filesize": filesize,
+                    "digest": digest,
+                    "content_type": upload.get("content_type"),
+                })
+            details = []
+            if fields.get("status_id") not in (None, "") and int(fields["status_id"]) != issue["status"]["id"]:
+                # Come Redmine: il journal registra il cambio di stato solo se lo stato cambia davvero
+                details.append({"property": "attr", "name": "status_id",
+                                "old_value": str(issue["status"]["id"]), "new_value": str(fields["status_id"])})
+                issue["status"] = {"id": int(fields["status_id"]), "name": "Risolto"}
+            if fields.get("custom_fields"):
+                values = {f["id"]: f["value"] for f in issue.get("custom_fields", [])}
+                values.update((int(f["id"]), f.get("value", "")) for f in fields["custom_fields"])
+                issue["custom_fields"] = [{"id": k, "name": f"campo {k}", "value": v} for k, v in sorted(values.items())]
+            if assignee not in (None, ""):
+                issue["assigned_to"] = {"id": int(assignee), "name": f"user {assignee}"}
+            if fields.get("category_id") not in (None, ""):
+                issue["category"] = {"id": int(fields["category_id"])}
+            if fields.get("notes") or details:
+                issue["journals"].append({"id": next(self._journal_ids), "notes": fields.get("notes") or "",
+                                          "created_on": _now(), "details": details})
+            issue["updated_on"] = _now()
+            self.counters["issues_updated"] += 1
+        return 204, None
+
+    def create_issue(self, payload):
+        fields = payload.get("issue", {})
+        with self._lock:
+            project = self._find_project(fields.get("project_id"))
+            if project is None:
+                return 422, {"errors": ["Progetto non è valido"]}
+            issue_id = next(self._ids)
+            issue = {
+                "id": issue_id,
+                "project": {"id": project["id"], "name": project["name"]},
+                "subject": fields.get("subject", ""),
+                "description": fields.get("description", ""),
+                "status": {"id": STATUS_NEW, "name": "Nuovo"},
+                "assigned_to": {"id": int(fields["assigned_to_id"])} if fields.get("assigned_to_id") else None,
+                "updated_on": _now(),
+                "journals": [],
+                "attachments": [],
+            }
+            self.issues[issue_id] = issue
+            self.counters["issues_created"] += 1
+        return 201, {"issue": _public_issue(issue)}
+
+    def list_projects(self, query):
+        limit = min(int(query.get("limit", 25)), 100)
+        offset = int(query.get("offset", 0))
+        with self._lock:
+            projects = [
+                {k: v for k, v in p.items() if k not in ("members", "observers", "categories")}
+                for _, p in sorted(self.projects.items())
+            ]
+        return 200, {"projects": projects[offset:offset + limit], "total_count": len(projects),
+                     "offset": offset, "limit": limit}
+
+    def list_memberships(self, project_key, query):
+        limit = min(int(query.get("limit", 25)), 100)
+        offset = int(query.get("offset", 0))
+        with self._lock:
+            project = self._find_project(project_key)
+            if project is None:
+                return 404, None
+            memberships = [
+                {
+                    "id": project["id"] * 1000 + user_id,
+                    "project": {"id": project["id"], "name": project["name"]},
+                    "user": {"id": user_id, "name": f"user {user_id}"},
+                    "roles": [ROLE_MANAGER if user_id in project["members"] else ROLE_OBSERVER],
+                }
+                for user_id in sorted(project["members"] | project["observers"])
+            ]
+        return 200, {"memberships": memberships[offset:offset + limit], "total_count": len(memberships),
+                     "offset": offset, "limit": limit}
+
+    def list_categories(self, project_key):
+        with self._lock:
+            project = self._find_project(project_key)
+            if project is None:
+                return 404, None
+            categories = [
+                {"id": category_id, "project": {"id": project["id"], "name": project["name"]}, "name": name}
+                for category_id, name in sorted(project["categories"].items())
+            ]
+        return 200, {"issue_categories": categories, "total_count": len(categories)}
+
+    def get_role(self, role_id):
+        role = ROLES.get(role_id)
+        if role is None:
+            return 404, None
+        return 200, {"role": dict(role, permissions=[])}
+
+    def current_user(self, query):
+        user = {"id": CURRENT_USER_ID, "login": "packer", "firstname": "Password", "lastname": "Packer"}
+        if "memberships" in query.get("include", "").split(","):
+            with self._lock:
+                user["memberships"] = [
+                    {
+                        "id": project["id"] * 1000 + CURRENT_USER_ID,
+                        "project": {"id": project["id"], "name": project["name"]},
+                        "roles": [ROLE_MANAGER],
+                    }
+                    for _, project in sorted(self.projects.items())
+                    if CURRENT_USER_ID in project["members"]
+                ]
+        return 200, {"user": user}
+
+
+def _now():
+    return time.strftime(TIME_FORMAT, time.gmtime())
+
+
+def _public_issue(issue):
+    return {k: v for k, v in issue.items() if v is not None and k != "journals"}
+
+
+def _make_handler(fake):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, code, payload=None):
+            body = json.dumps(payload).encode() if payload is not None else b""
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _dispatch(self, method):
+            start = time.perf_counter()
+            parts = urlsplit(self.path)
+            query = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+            delay = fake.latency + (fake._random.uniform(0, fake.jitter) if fake.jitter else 0)
+            if delay:
+                time.sleep(delay)
+            if fake.error_rate and fake._random.random() < fake.error_rate:
+                # Errore "gateway": la richiesta non è stata elaborata
+                with fake._lock:
+                    fake.counters["injected_errors"] += 1
+                return self._send(503, {"errors": ["Service Unavailable (injected)"]})
+
+            endpoint, (code, payload) = self._route(method, parts.path, query, body)
+            with fake._lock:
+                fake.timings[endpoint].append(time.perf_counter() - start)
+            self._send(code, payload)
+
+        def _route(self, method, path, query, body):
+            issue_match = _ISSUE_PATH.match(path)
+            members_match = _MEMBERSHIPS_PATH.match(path)
+            project_issues_match = _PROJECT_ISSUES_PATH.match(path)
+            categories_match = _CATEGORIES_PATH.match(path)
+            role_match = _ROLE_PATH.match(path)
+            if method == "GET" and path == "/issues.json":
+                return "GET /issues", fake.list_issues(query)
+            if method == "POST" and path == "/uploads.json":
+                return "POST /uploads", fake.upload(body)
+            if method == "GET" and issue_match:
+                return "GET /issues/:id", fake.get_issue(int(issue_match.group(1)), query)
+            if method == "PUT" and issue_match:
+                return "PUT /issues/:id", fake.update_issue(int(issue_match.group(1)), json.loads(body or b"{}"))
+            if method == "POST" and (path == "/issues.json" or project_issues_match):
+                payload = json.loads(body or b"{}")
+                if project_issues_match:
+                    payload.setdefault("issue", {})["project_id"] = project_issues_match.group(1)
+                return "POST /issues", fake.create_issue(payload)
+            if method == "GET" and path == "/users/current.json":
+                return "GET /users/current", fake.current_user(query)
+            if method == "GET" and path == "/projects.json":
+                return "GET /projects", fake.list_projects(query)
+            if method == "GET" and members_match:
+                return "GET /projects/:id/memberships", fake.list_memberships(members_match.group(1), query)
+            if method == "GET" and categories_match:
+                return "GET /projects/:id/issue_categories", fake.list_categories(categories_match.group(1))
+            if method == "GET" and role_match:
+                return "GET /roles/:id", fake.get_role(int(role_match.group(1)))
+            return "other", (404, None)
+
+        def do_GET(self):
+            self._dispatch("GET")
+
+        def do_POST(self):
+            self._dispatch("POST")
+
+        def do_PUT(self):
+            self._dispatch("PUT")
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Server Redmine finto per test locali")
+    parser.add_argument('--port', type=int, default=3000)
+    parser.add_argument('--tickets', type=int, default=0, help="Ticket 'Nuovo' da creare all'avvio")
+    parser.add_argument('--project', action='append', default=[], help="Progetto da creare (ripetibile)")
+    parser.add_argument('--latency', type=float, default=0.0, help="Latenza per richiesta (secondi)")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Latenza casuale aggiuntiva massima (secondi)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Frazione di richieste con 503")
+    args = parser.parse_args()
+
+    fake = FakeRedmine(port=args.port, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate)
+    for name in args.project:
+        fake.add_project(name)
+    if args.tickets:
+        fake.seed_tickets(args.tickets, args.project or ["demo"])
+    print(f"[*] Fake Redmine in ascolto su {fake.url} ({len(fake.issues)} ticket)")
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fake.server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,143 @@
+"""
+Engine HTTP per python-redmine con pool di connessioni keep-alive,
+timeout e retry con backoff.
+
+Politica di retry in base all'idempotenza della richiesta:
+- GET/HEAD e upload (`POST /uploads.json`): retry su errori di connessione,
+  timeout e risposte 5xx/429; un upload ripetuto crea solo un token orfano.
+- aggiornamento/creazione issue (`PUT`/`POST` su `/issues`): retry "guarded",
+  solo quando è certo che il server non ha elaborato la richiesta (connessione
+  rifiutata, 503 o 429), per non duplicare note o issue. 502 e 504 no: il
+  proxy può aver già inoltrato la richiesta a Redmine prima di rinunciare.
+"""
+
+import logging
+import random
+import threading
+import time
+from collections import Counter
+
+import requests
+from requests.adapters import HTTPAdapter
+from redminelib.engines.sync import SyncEngine
+
+logger = logging.getLogger(__name__)
+
+# Risposte che indicano che il server non ha elaborato la richiesta
+NOT_PROCESSED_STATUSES = frozenset({429, 503})
+RETRYABLE_STATUSES = NOT_PROCESSED_STATUSES | {500, 502, 504}
+
+DEFAULT_HTTP_OPTIONS = {
+    'pool_size': 10,
+    'connect_timeout': 5.0,
+    'read_timeout': 60.0,
+    'retries': 3,
+    'backoff': 0.5,
+    'backoff_max': 10.0,
+}
+
+
+class _RetryableStatus(Exception):
+    def __init__(self, response):
+        super().__init__(f"HTTP {response.status_code}")
+        self.response = response
+
+
+class PackerEngine(SyncEngine):
+    """SyncEngine con sessione condivisa, timeout e retry idempotency-aware.
+
+    Le opzioni arrivano da `Redmine(..., engine=PackerEngine, http={...})`
+    (vedi DEFAULT_HTTP_OPTIONS); i contatori sono esposti da `stats()`.
+    """
+
+    def __init__(self, **options):
+        self.http_options = dict(DEFAULT_HTTP_OPTIONS, **(options.pop('http', None) or {}))
+        self._counters = Counter()
+        self._lock = threading.Lock()
+        super().__init__(**options)
+        pool_size = int(self.http_options['pool_size'])
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._adapter = adapter
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self._counters[key] += amount
+
+    @staticmethod
+    def _is_idempotent(method, url):
+        method = method.lower()
+        return method in ('get', 'head') or (method == 'post' and '/uploads.' in url)
+
+    def _sleep_backoff(self, attempt):
+        # Full jitter: attesa casuale tra 0 e il backoff esponenziale
+        cap = min(float(self.http_options['backoff_max']),
+                  float(self.http_options['backoff']) * (2 ** attempt))
+        time.sleep(random.uniform(0, cap))
+
+    def request(self, method, url, headers=None, params=None, data=None):
+        kwargs = self.construct_request_kwargs(method, headers, params, data)
+        kwargs['timeout'] = (float(self.http_options['connect_timeout']),
+                             float(self.http_options['read_timeout']))
+        idempotent = self._is_idempotent(method, url)
+        retries = int(self.http_options['retries'])
+        body = kwargs.get('data')
+        start_pos = body.tell() if hasattr(body, 'seek') and hasattr(body, 'tell') else None
+
+        attempt = 0
+        while True:
+            self._count('requests')
+            try:
+                response = self.session.request(method, url, **kwargs)
+                if response.status_code in RETRYABLE_STATUSES:
+                    raise _RetryableStatus(response)
+                return self.process_response(response)
+            except (requests.ConnectionError, requests.Timeout, _RetryableStatus) as e:
+                if isinstance(e, _RetryableStatus):
+                    safe = idempotent or e.response.status_code in NOT_PROCESSED_STATUSES
+                else:
+                    # ConnectTimeout / connessione rifiutata: la richiesta non è partita
+                    safe = idempotent or isinstance(e, requests.ConnectTimeout) or _not_sent(e)
+                if attempt >= retries or not safe:
+                    self._count('failures')
+                    if isinstance(e, _RetryableStatus):
+                        return self.process_response(e.response)
+                    raise
+                if start_pos is not None:
+                    body.seek(start_pos)
+                self._count('retries')
+                logger.warning("%s %s failed (%s): retry %d/%d", method.upper(), url, e, attempt + 1, retries)
+                self._sleep_backoff(attempt)
+                attempt += 1
+
+    def stats(self):
+        """Contatori: richieste, retry, fallimenti, connessioni aperte e riusate."""
+        with self._lock:
+            stats = dict(self._counters)
+        opened = sent = 0
+        pools = self._adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools[key]
+            opened += pool.num_connections
+            sent += pool.num_requests
+        stats['connections_opened'] = opened
+        stats['connections_reused'] = max(0, sent - opened)
+        for key in ('requests', 'retries', 'failures'):
+            stats.setdefault(key, 0)
+        return stats
+
+
+def _not_sent(error):
+    """True se l'errore di connessione è avvenuto prima dell'invio della richiesta."""
+    stack, seen = [error], set()
+    while stack:
+        err = stack.pop()
+        if err is None or id(err) in seen:
+            continue
+        seen.add(id(err))
+        if type(err).__name__ in ('NewConnectionError', 'ConnectTimeoutError', 'NameResolutionError'):
+            return True
+        stack.append(getattr(err, 'reason', None))
+        stack.extend(arg for arg in getattr(err, 'args', ()) if isinstance(arg, BaseException))
+    return False
@@ -0,0 +1,208 @@
+"""
+Journal durevole dei ticket e spool degli archivi da ricaricare.
+
+Se un run si interrompe (crash, OOM, riavvio del container) a metà batch, al
+riavvio successivo il journal dice per ogni ticket fin dove si era arrivati:
+
+- ``built``: l'archivio cifrato è stato generato e salvato nello spool
+  (nome, dimensione e SHA-256 nel journal). Un ticket ancora "Nuovo" viene
+  pubblicato riusando l'archivio dello spool, senza rigenerare password,
+  immagini e DOCX;
+- ``upload``: l'upload è iniziato. Se il run è morto durante l'aggiornamento
+  dell'issue non si sa se l'allegato è arrivato: prima di ricaricare si
+  controllano gli allegati dell'issue (nome + digest/dimensione) e, se
+  l'archivio c'è già, il ticket viene solo segnato come completato;
+- ``failed``: l'upload è fallito, l'archivio resta nello spool per il run
+  successivo;
+- ``published``: ticket completato, l'archivio nello spool viene eliminato.
+
+Il journal è un file JSON Lines in sola aggiunta: ogni record è scritto e
+sincronizzato su disco (fsync) prima di proseguire, e una riga troncata da un
+crash viene ignorata alla rilettura. All'apertura il file è compattato
+mantenendo solo i ticket non ancora completati. Dallo spool vengono rimossi
+gli archivi registrati da questo journal e non più necessari; un file che il
+journal non conosce può essere di un altro processo con lo stesso spool
+(repliche sulla stessa `output.dir`) ed è rimosso solo se più vecchio di
+`retention_days` (archivio rimasto da un crash prima del record ``built``).
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("built", "upload", "failed", "published")
+
+
+def _fsync_dir(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _write_durable(path, data, mode=0o600):
+    """Scrive `data` in `path` in modo atomico e durevole (tmp + fsync + rename)."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    _fsync_dir(os.path.dirname(path) or ".")
+
+
+class TicketJournal:
+    """Journal dei ticket (ticket_id -> stato) con spool degli archivi.
+
+    Thread-safe: gli aggiornamenti arrivano dallo stadio di I/O.
+    """
+
+    def __init__(self, path, spool_dir, retention_days=7):
+        self.path = path
+        self.spool_dir = spool_dir
+        self.retention = retention_days * 86400
+        self._lock = threading.Lock()
+        self._entries = {}
+        os.makedirs(os.path.dirname(path) or ".", mode=0o700, exist_ok=True)
+        os.makedirs(spool_dir, mode=0o700, exist_ok=True)
+        self._load()
+        self._compact()
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        self._file = os.fdopen(fd, "a")
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return
+        for line in lines:
+            try:
+                record = json.loads(line)
+                ticket_id = int(record.pop("ticket"))
+            except (ValueError, KeyError, TypeError):
+                # Riga incompleta (crash durante la scrittura): ignorata
+                continue
+            if record.get("stage") == "published":
+                self._entries.pop(ticket_id, None)
+            else:
+                self._entries.setdefault(ticket_id, {}).update(record)
+
+    def _compact(self):
+        now = time.time()
+        for ticket_id, entry in list(self._entries.items()):
+            spool_path = entry.get("spool")
+            if not spool_path or not os.path.exists(spool_path):
+                # Senza archivio nello spool non c'è niente da riprendere
+                del self._entries[ticket_id]
+            elif now - entry.get("ts", now) > self.retention:
+                logger.warning("Journal: dropping ticket %s, idle for %.1f days",
+                               ticket_id, (now - entry["ts"]) / 86400)
+                self._remove_spool(entry)
+                del self._entries[ticket_id]
+        lines = [json.dumps({"ticket": ticket_id, **entry}) + "\n" for ticket_id, entry in self._entries.items()]
+        _write_durable(self.path, "".join(lines).encode())
+        # Archivi dello spool senza voce nel journal: un altro journal può
+        # averli appena scritti, si rimuovono solo quelli abbandonati da tempo
+        known = {entry.get("spool") for entry in self._entries.values()}
+        for name in os.listdir(self.spool_dir):
+            path = os.path.join(self.spool_dir, name)
+            try:
+                if path not in known and os.path.isfile(path) and now - os.path.getmtime(path) > self.retention:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    # --- record --------------------------------------------------------------
+
+    def record(self, ticket_id, stage, **data):
+        """Registra in modo durevole il completamento di `stage` per il ticket."""
+        if stage not in STAGES:
+            raise ValueError(f"Fase del journal non valida: {stage}")
+        record = {"stage": stage, "ts": time.time(), **data}
+        line = json.dumps({"ticket": int(ticket_id), **record}) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            if stage == "published":
+                entry = self._entries.pop(int(ticket_id), None)
+            else:
+                self._entries.setdefault(int(ticket_id), {}).update(record)
+                entry = None
+        if entry is not None:
+            self._remove_spool(entry)
+
+    def get(self, ticket_id):
+        """Stato del ticket nel journal (dizionario vuoto se non presente)."""
+        with self._lock:
+            return dict(self._entries.get(int(ticket_id), {}))
+
+    def pending(self):
+        """Ticket con un archivio nello spool non ancora pubblicato."""
+        with self._lock:
+            return sorted(self._entries)
+
+    # --- spool ---------------------------------------------------------------
+
+    def spool(self, ticket_id, archive):
+        """Salva l'archivio (percorso o (nome, bytes)) nello spool e registra ``built``.
+
+        Restituisce l'archivio come (nome, bytes).
+        """
+        if isinstance(archive, tuple):
+            name, data = archive
+        else:
+            name = os.path.basename(archive)
+            with open(archive, "rb") as f:
+                data = f.read()
+        spool_path = os.path.join(self.spool_dir, f"{int(ticket_id)}-{name}")
+        _write_durable(spool_path, data)
+        self.record(ticket_id, "built", name=name, size=len(data),
+                    sha256=hashlib.sha256(data).hexdigest(), spool=spool_path)
+        return name, data
+
+    def spooled(self, ticket_id):
+        """Archivio nello spool del ticket come (nome, bytes); None se assente o alterato."""
+        entry = self.get(ticket_id)
+        if not entry.get("spool"):
+            return None
+        try:
+            with open(entry["spool"], "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        if hashlib.sha256(data).hexdigest() != entry.get("sha256"):
+            logger.warning("Journal: spooled archive of ticket %s is corrupted, rebuilding", ticket_id)
+            return None
+        return entry["name"], data
+
+    def _remove_spool(self, entry):
+        spool_path = entry.get("spool")
+        if spool_path:
+            try:
+                os.remove(spool_path)
+            except FileNotFoundError:
+                pass
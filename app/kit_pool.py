@@ -0,0 +1,334 @@
+"""
+Pool di kit di credenziali pre-generati.
+
+Gran parte della latenza di un ticket non dipende dal ticket: password,
+immagine base, share di crittografia visuale e DOCX del template di progetto.
+Un *kit* raccoglie questi artefatti; un produttore in background (o
+`main.py --refill-kits`) mantiene per ogni combinazione template + policy
+password un pool di kit pronti tra `low_watermark` e `high_watermark`. Quando
+arriva un ticket la pipeline preleva un kit, lo rinomina per il ticket e
+crea solo l'archivio cifrato.
+
+Sicurezza:
+- ogni kit è un file cifrato con AES-256-GCM con la chiave del pool
+  (`KIT_POOL_KEY` in esadecimale, oppure `kit_pool.key_file`, creato 0600
+  al primo avvio e mai dentro la directory del pool); l'id del kit e la chiave del pool sono dati autenticati,
+  quindi un kit copiato sotto un altro nome o in un altro pool non si decifra;
+- il prelievo è un `rename` atomico del file (un solo processo vince anche
+  con più repliche sullo stesso volume) seguito dalla cancellazione: un kit
+  può essere usato una sola volta. I file prelevati e mai cancellati (crash)
+  vengono eliminati dal produttore, mai riusati.
+"""
+
+import glob
+import hashlib
+import io
+import json
+import logging
+import os
+import struct
+import threading
+import time
+from collections import namedtuple
+from contextlib import nullcontext
+
+from password_utils import render_password_image, get_password_generator
+from crypto_utils import run_visual_crypto_in_memory
+from mkdocx import build_docx
+
+logger = logging.getLogger(__name__)
+
+Kit = namedtuple("Kit", ["password", "base_png", "a_png", "b_png", "docx"])
+
+_MAGIC = b"PKIT1"
+_NONCE_SIZE = 12
+_TAG_SIZE = 16
+# Un kit prelevato ma non cancellato da più di così è considerato abbandonato
+_STALE_CLAIM_SECONDS = 600
+
+
+def build_kit(password, docx_template, timer=None):
+    """Genera in memoria gli artefatti di un ticket a partire dalla password.
+
+    `timer` (opzionale, `metrics.StageTimer`) riceve i tempi delle fasi.
+    """
+    def stage(name):
+        return timer.stage(name) if timer is not None else nullcontext()
+
+    # crea immagine base
+    with stage("image"):
+        base = render_password_image(password)
+        base_buf = io.BytesIO()
+        base.save(base_buf, "PNG")
+
+    # applica crittografia visuale -> Password_A.png, Password_B.png
+    with stage("visual_crypto"):
+        a_png, b_png = run_visual_crypto_in_memory(base)
+
+    # genera il DOCX usando il template DOCX
+    with stage("docx"):
+        docx_buf = io.BytesIO()
+        build_docx(docx_template, io.BytesIO(a_png), docx_buf)
+
+    return Kit(password, base_buf.getvalue(), a_png, b_png, docx_buf.getvalue())
+
+
+def kit_members(kit, ticket_id):
+    """Membri dell'archivio del ticket (nome -> bytes) con i nomi del ticket."""
+    return {
+        f"ticket_{ticket_id}_password.txt": kit.password.encode(),
+        f"ticket_{ticket_id}_base.png": kit.base_png,
+        "Password_A.png": kit.a_png,
+        "Password_B.png": kit.b_png,
+        f"ticket_{ticket_id}.docx": kit.docx,
+    }
+
+
+def _pack(kit):
+    fields = [kit.password.encode()] + list(kit[1:])
+    return b"".join(struct.pack(">I", len(f)) + f for f in fields)
+
+
+def _unpack(payload):
+    fields, offset = [], 0
+    while offset < len(payload):
+        (size,) = struct.unpack_from(">I", payload, offset)
+        offset += 4
+        fields.append(payload[offset:offset + size])
+        offset += size
+    if len(fields) != len(Kit._fields):
+        raise ValueError("kit malformato")
+    return Kit(fields[0].decode(), *fields[1:])
+
+
+def pool_key(docx_template, policy):
+    """Chiave del pool: template (percorso e mtime) + policy password.
+
+    Se il template cambia la chiave cambia e i kit generati con la versione
+    precedente non vengono più prelevati (e sono eliminati dal produttore).
+    """
+    path = os.path.realpath(docx_template)
+    mtime = os.stat(path).st_mtime_ns
+    material = json.dumps([path, mtime, sorted((policy or {}).items())], default=str)
+    return hashlib.sha256(material.encode()).hexdigest()[:16]
+
+
+class KitPool:
+    """Pool su disco di kit cifrati, uno sottodirectory per chiave di pool."""
+
+    def __init__(self, root, key, low_watermark=5, high_watermark=20):
+        try:
+            from Cryptodome.Cipher import AES
+        except ImportError as e:
+            raise RuntimeError(
+                "Il pool di kit richiede il pacchetto pycryptodomex (pip install pycryptodomex)"
+            ) from e
+        if len(key) != 32:
+            raise ValueError("La chiave del pool di kit deve essere di 32 byte (AES-256)")
+        if not 0 <= low_watermark <= high_watermark or high_watermark < 1:
+            raise ValueError("kit_pool: serve 0 <= low_watermark <= high_watermark e high_watermark >= 1")
+        self._aes = AES
+        self.root = root
+        self._key = key
+        self.low_watermark = low_watermark
+        self.high_watermark = high_watermark
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(root, mode=0o700, exist_ok=True)
+
+    # --- formato -------------------------------------------------------------
+
+    def _encrypt(self, key_id, kit_id, kit):
+        nonce = os.urandom(_NONCE_SIZE)
+        cipher = self._aes.new(self._key, self._aes.MODE_GCM, nonce=nonce)
+        cipher.update(_MAGIC + key_id.encode() + kit_id.encode())
+        ciphertext, tag = cipher.encrypt_and_digest(_pack(kit))
+        return _MAGIC + nonce + tag + ciphertext
+
+    def _decrypt(self, key_id, kit_id, blob):
+        if not blob.startswith(_MAGIC):
+            raise ValueError("formato kit non riconosciuto")
+        offset = len(_MAGIC)
+        nonce = blob[offset:offset + _NONCE_SIZE]
+        tag = blob[offset + _NONCE_SIZE:offset + _NONCE_SIZE + _TAG_SIZE]
+        cipher = self._aes.new(self._key, self._aes.MODE_GCM, nonce=nonce)
+        cipher.update(_MAGIC + key_id.encode() + kit_id.encode())
+        return _unpack(cipher.decrypt_and_verify(blob[offset + _NONCE_SIZE + _TAG_SIZE:], tag))
+
+    # --- pool ----------------------------------------------------------------
+
+    def _pool_dir(self, key_id):
+        return os.path.join(self.root, key_id)
+
+    def register(self, docx_template, policy):
+        """Dichiara un pool da mantenere; restituisce la sua chiave."""
+        key_id = pool_key(docx_template, policy)
+        pool_dir = self._pool_dir(key_id)
+        meta_path = os.path.join(pool_dir, "pool.json")
+        if not os.path.exists(meta_path):
+            os.makedirs(pool_dir, mode=0o700, exist_ok=True)
+            tmp_path = f"{meta_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"template": os.path.realpath(docx_template), "policy": policy or {}}, f)
+            os.replace(tmp_path, meta_path)
+        return key_id
+
+    def depth(self, key_id):
+        return len(glob.glob(os.path.join(self._pool_dir(key_id), "*.kit")))
+
+    def depths(self):
+        """Kit disponibili per pool (chiave -> numero)."""
+        return {key_id: self.depth(key_id) for key_id in self._pool_ids()}
+
+    def _pool_ids(self):
+        return sorted(
+            name for name in os.listdir(self.root)
+            if os.path.isfile(os.path.join(self.root, name, "pool.json"))
+        )
+
+    def put(self, key_id, kit):
+        kit_id = os.urandom(16).hex()
+        pool_dir = self._pool_dir(key_id)
+        tmp_path = os.path.join(pool_dir, f"{kit_id}.tmp")
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(self._encrypt(key_id, kit_id, kit))
+        # rename atomico: chi preleva vede solo kit completi
+        os.replace(tmp_path, os.path.join(pool_dir, f"{kit_id}.kit"))
+
+    def take(self, docx_template, policy):
+        """Preleva (e consuma) un kit per template/policy; None se il pool è vuoto."""
+        try:
+            key_id = self.register(docx_template, policy)
+        except OSError as e:
+            logger.warning("Kit pool unavailable for %s: %s", docx_template, e)
+            return None
+        pool_dir = self._pool_dir(key_id)
+        kit = None
+        for path in glob.glob(os.path.join(pool_dir, "*.kit")):
+            kit_id = os.path.basename(path)[:-len(".kit")]
+            claimed = os.path.join(pool_dir, f"{kit_id}.claimed-{os.getpid()}")
+            try:
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                continue  # prelevato da un altro processo
+            try:
+                with open(claimed, "rb") as f:
+                    kit = self._decrypt(key_id, kit_id, f.read())
+            except Exception as e:
+                logger.warning("Discarding unreadable kit %s: %s", kit_id, e)
+                kit = None
+            finally:
+                os.remove(claimed)
+            if kit is not None:
+                break
+        with self._lock:
+            if kit is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if kit is None or self.depth(key_id) < self.low_watermark:
+            self._wakeup.set()
+        return kit
+
+    # --- produttore ------------------------------------------------------------
+
+    def _purge(self):
+        """Elimina prelievi abbandonati, file temporanei e pool con template cambiato."""
+        now = time.time()
+        for key_id in self._pool_ids():
+            pool_dir = self._pool_dir(key_id)
+            for path in glob.glob(os.path.join(pool_dir, "*.claimed-*")) + glob.glob(os.path.join(pool_dir, "*.tmp")):
+                try:
+                    if now - os.path.getmtime(path) > _STALE_CLAIM_SECONDS:
+                        os.remove(path)
+                except FileNotFoundError:
+                    pass
+            with open(os.path.join(pool_dir, "pool.json")) as f:
+                meta = json.load(f)
+            try:
+                current = pool_key(meta["template"], meta["policy"])
+            except OSError:
+                current = None
+            if current != key_id:
+                logger.info("Removing stale kit pool %s (template %s changed)", key_id, meta["template"])
+                for path in glob.glob(os.path.join(pool_dir, "*")):
+                    os.remove(path)
+                os.rmdir(pool_dir)
+
+    def refill(self, until_full=False):
+        """Riporta a `high_watermark` i pool sotto `low_watermark` (tutti con
+        `until_full`); restituisce il numero di kit generati."""
+        self._purge()
+        produced = 0
+        for key_id in self._pool_ids():
+            depth = self.depth(key_id)
+            if not until_full and depth >= self.low_watermark:
+                continue
+            with open(os.path.join(self._pool_dir(key_id), "pool.json")) as f:
+                meta = json.load(f)
+            generator = get_password_generator(meta["policy"])
+            while depth < self.high_watermark and not self._stop.is_set():
+                self.put(key_id, build_kit(generator.generate(), meta["template"]))
+                depth += 1
+                produced += 1
+        if produced:
+            logger.info("Kit pool refilled: %d kit(s) generated, depth=%s", produced, self.depths())
+        return produced
+
+    def start(self, interval=30.0):
+        """Avvia il produttore in background: controlla i pool ogni `interval`
+        secondi o subito quando un prelievo scende sotto `low_watermark`."""
+        def loop():
+            while not self._stop.is_set():
+                try:
+                    self.refill()
+                except Exception:
+                    logger.exception("Kit pool refill failed")
+                self._wakeup.wait(interval)
+                self._wakeup.clear()
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=loop, name="kit-producer", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+def load_pool_key(key_file, pool_dir):
+    """Chiave del pool: `KIT_POOL_KEY` (64 cifre esadecimali) oppure `key_file`,
+    generato con permessi 0600 se assente.
+
+    La chiave non può stare nella directory del pool: chi legge il pool (un
+    volume condiviso, un backup) potrebbe altrimenti decifrare tutti i kit.
+    """
+    env_key = os.getenv("KIT_POOL_KEY")
+    if env_key:
+        return bytes.fromhex(env_key.strip())
+    if not key_file:
+        raise ValueError("Il pool di kit richiede la variabile KIT_POOL_KEY oppure kit_pool.key_file")
+    key_path = os.path.realpath(key_file)
+    root = os.path.realpath(pool_dir)
+    if os.path.commonpath([key_path, root]) == root:
+        raise ValueError(f"kit_pool.key_file non può stare nella directory del pool ({root}): {key_file}")
+    try:
+        with open(key_path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        os.makedirs(os.path.dirname(key_path), mode=0o700, exist_ok=True)
+        key = os.urandom(32)
+        fd = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(key)
+        logger.info("Generated new kit pool key in %s", key_path)
+        return key
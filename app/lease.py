@@ -0,0 +1,228 @@
+"""
+Lease sui ticket e sharding per più repliche del packer sulla stessa coda.
+
+Più repliche che leggono gli stessi ticket "Nuovo" li elaborerebbero tutte.
+Prima di generare gli artefatti ogni replica prende in carico (*claim*) i
+ticket del blocco; solo quelli vinti vengono elaborati. Due modalità:
+
+- ``status``: il claim porta il ticket nello stato "in lavorazione"
+  (`lease.status_id`) con una nota che contiene il token della replica.
+  Redmine registra il cambio di stato solo nel journal di chi lo ha fatto
+  per primo (per gli altri lo stato è già quello), quindi vince la replica
+  la cui nota accompagna l'ultimo cambio di stato verso "in lavorazione".
+  Un ticket rimasto in lavorazione oltre `lease.ttl` (replica morta) viene
+  rimesso in "Nuovo" da `recover`;
+- ``custom_field``: il lease è un campo personalizzato dell'issue
+  (`lease.custom_field_id`) con valore ``<token>|<scadenza UTC>``; il ticket
+  resta "Nuovo". Un lease non scaduto di un'altra replica non viene
+  sovrascritto; dopo la scrittura e un'attesa di `lease.settle` secondi il
+  valore viene riletto: vince chi lo trova ancora uguale al proprio.
+
+Scritture e verifiche di un blocco girano in parallelo, con una sola attesa
+di assestamento per blocco. Un ticket elaborato più a lungo di metà
+`lease.ttl` viene riverificato prima della pubblicazione (`held`): se nel
+frattempo il lease è stato recuperato o preso da un'altra replica, il
+ticket non viene pubblicato due volte. Lo sharding (`sharding.replicas` > 1) assegna
+invece i ticket in modo deterministico per `id % replicas`: senza lease i
+ticket dello shard di una replica ferma restano in coda fino al suo ritorno.
+"""
+
+import logging
+import os
+import socket
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+LEASE_MODES = ("status", "custom_field")
+_TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+def default_owner():
+    """Identificativo della replica: hostname (nome del container) e pid."""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def in_shard(ticket_id, replicas, index):
+    """True se il ticket appartiene allo shard `index` di `replicas`."""
+    return replicas <= 1 or int(ticket_id) % replicas == index
+
+
+def _utc(seconds):
+    return datetime.fromtimestamp(seconds, timezone.utc).strftime(_TIME_FORMAT)
+
+
+def _parse_lease(value):
+    """(token, scadenza epoch) da un valore ``<token>|<scadenza>``; (None, 0) se vuoto o illeggibile."""
+    token, _, expires = (value or "").partition("|")
+    try:
+        return token, datetime.strptime(expires, _TIME_FORMAT).replace(tzinfo=timezone.utc).timestamp()
+    except ValueError:
+        return None, 0
+
+
+class LeaseManager:
+    """Claim, rilascio e recupero dei lease sui ticket.
+
+    `client` è una funzione che restituisce il client python-redmine.
+    """
+
+    def __init__(self, client, mode="status", owner=None, ttl=900, status_id=None, custom_field_id=None,
+                 new_status_id=1, settle=1.0, concurrency=8):
+        if mode not in LEASE_MODES:
+            raise ValueError(f"Modalità lease non supportata: {mode} (disponibili: {', '.join(LEASE_MODES)})")
+        if mode == "status" and status_id in (None, ""):
+            raise ValueError("lease.mode 'status' richiede lease.status_id (stato \"in lavorazione\")")
+        if mode == "custom_field" and custom_field_id in (None, ""):
+            raise ValueError("lease.mode 'custom_field' richiede lease.custom_field_id")
+        self._client = client
+        self.mode = mode
+        self.owner = owner or default_owner()
+        self.ttl = float(ttl)
+        self.status_id = status_id
+        self.custom_field_id = int(custom_field_id) if custom_field_id not in (None, "") else None
+        self.new_status_id = new_status_id
+        self.settle = float(settle)
+        self.concurrency = max(1, int(concurrency))
+        self._held = {}  # ticket_id -> (token, istante del claim)
+
+    # --- claim ---------------------------------------------------------------
+
+    def claim(self, ticket_ids):
+        """Prende in carico i ticket indicati; restituisce l'insieme degli id vinti.
+
+        Un ticket il cui claim fallisce (errore HTTP, lease di un'altra
+        replica) non viene elaborato da questa replica.
+        """
+        ticket_ids = list(ticket_ids)
+        if not ticket_ids:
+            return set()
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(ticket_ids)),
+                                thread_name_prefix="lease") as executor:
+            tokens = dict(zip(ticket_ids, executor.map(self._safe, [self._write] * len(ticket_ids), ticket_ids)))
+            written = [ticket_id for ticket_id in ticket_ids if tokens[ticket_id]]
+            if written and self.settle:
+                # Lascia arrivare le scritture concorrenti delle altre repliche
+                time.sleep(self.settle)
+            won = executor.map(self._safe, [self._verify] * len(written), written, [tokens[t] for t in written])
+            claimed = {ticket_id for ticket_id, ok in zip(written, won) if ok}
+        now = time.time()
+        self._held.update((ticket_id, (tokens[ticket_id], now)) for ticket_id in claimed)
+        logger.debug("Lease: claimed %d/%d ticket(s) as %s", len(claimed), len(ticket_ids), self.owner)
+        return claimed
+
+    def _safe(self, fn, ticket_id, *args):
+        try:
+            return fn(ticket_id, *args)
+        except Exception as e:
+            logger.warning("Lease on ticket %s failed: %s", ticket_id, e)
+            return None
+
+    def _token(self):
+        return f"{self.owner}/{uuid.uuid4().hex[:12]}"
+
+    def _write(self, ticket_id):
+        client = self._client()
+        token = self._token()
+        if self.mode == "status":
+            # La pagina di ticket può essere vecchia: un ticket già preso o
+            # risolto da un'altra replica non va riportato "in lavorazione"
+            status = getattr(getattr(client.issue.get(ticket_id), "status", None), "id", None)
+            if status is not None and str(status) != str(self.new_status_id):
+                logger.debug("Ticket %s no longer new (status %s)", ticket_id, status)
+                return None
+            client.issue.update(ticket_id, status_id=self.status_id,
+                                notes=f"Automated: presa in carico da {self.owner} [lease {token}]")
+            return token
+        holder, expires = _parse_lease(self._field_value(client.issue.get(ticket_id)))
+        if holder and expires > time.time():
+            logger.debug("Ticket %s leased by %s until %s", ticket_id, holder, _utc(expires))
+            return None
+        value = f"{token}|{_utc(time.time() + self.ttl)}"
+        client.issue.update(ticket_id, custom_fields=[{"id": self.custom_field_id, "value": value}])
+        return value
+
+    def _verify(self, ticket_id, token):
+        client = self._client()
+        if self.mode == "custom_field":
+            return self._field_value(client.issue.get(ticket_id)) == token
+        issue = client.issue.get(ticket_id, include=["journals"])
+        status = getattr(getattr(issue, "status", None), "id", None)
+        if status is not None and str(status) != str(self.status_id):
+            # Rimesso in "Nuovo" (recover o rilascio) dopo il claim
+            return False
+        for journal in reversed(list(getattr(issue, "journals", None) or [])):
+            for detail in getattr(journal, "details", None) or []:
+                if detail.get("name") == "status_id" and str(detail.get("new_value")) == str(self.status_id):
+                    if token not in (getattr(journal, "notes", None) or ""):
+                        return False
+                    old_status = detail.get("old_value")
+                    if str(old_status) != str(self.new_status_id):
+                        # Il ticket è stato completato tra la lettura e il claim: torna com'era
+                        client.issue.update(ticket_id, status_id=old_status,
+                                            notes=f"Automated: lease annullato da {self.owner}, ticket già elaborato")
+                        return False
+                    return True
+        return False
+
+    def _field_value(self, issue):
+        for field in getattr(issue, "custom_fields", None) or []:
+            if getattr(field, "id", None) == self.custom_field_id:
+                return getattr(field, "value", None)
+        return None
+
+    def held(self, ticket_id):
+        """True se il lease vinto con `claim` è ancora di questa replica.
+
+        Entro metà di `ttl` dal claim il lease non può essere scaduto né
+        recuperato e non serve alcuna richiesta; oltre, viene riletto.
+        """
+        entry = self._held.get(ticket_id)
+        if entry is None:
+            return False
+        token, claimed_at = entry
+        if time.time() - claimed_at < self.ttl / 2:
+            return True
+        return bool(self._safe(self._verify, ticket_id, token))
+
+    # --- rilascio e recupero -------------------------------------------------
+
+    def release(self, ticket_id):
+        """Rilascia il lease di un ticket non completato (torna disponibile per tutte le repliche)."""
+        self._held.pop(ticket_id, None)
+        try:
+            if self.mode == "status":
+                self._client().issue.update(ticket_id, status_id=self.new_status_id,
+                                            notes=f"Automated: lease rilasciato da {self.owner}")
+            else:
+                self._client().issue.update(ticket_id, custom_fields=[{"id": self.custom_field_id, "value": ""}])
+        except Exception as e:
+            logger.warning("Could not release lease on ticket %s: %s", ticket_id, e)
+
+    def recover(self):
+        """Rimette in coda i ticket in lavorazione da più di `ttl` secondi (modalità ``status``).
+
+        Nella modalità ``custom_field`` la scadenza è nel valore del lease e un
+        lease scaduto viene semplicemente sovrascritto al claim successivo.
+        Restituisce il numero di ticket recuperati.
+        """
+        if self.mode != "status":
+            return 0
+        client = self._client()
+        cutoff = _utc(time.time() - self.ttl)
+        stale = list(client.issue.filter(status_id=self.status_id, assigned_to_id="me",
+                                         updated_on=f"<={cutoff}", sort="id"))
+        recovered = 0
+        for issue in stale:
+            try:
+                client.issue.update(issue.id, status_id=self.new_status_id,
+                                    notes=f"Automated: lease scaduto (oltre {self.ttl:.0f}s), ticket rimesso in coda")
+                recovered += 1
+            except Exception as e:
+                logger.warning("Could not recover abandoned lease on ticket %s: %s", issue.id, e)
+        if recovered:
+            logger.info("Lease: %d abandoned ticket(s) put back in the queue", recovered)
+        return recovered
@@ -1,32 +1,53 @@
 import argparse
+import io
+import json
 import logging
 import os
 import shutil
-import subprocess
-import sys
+import signal
+import threading
+import time
+from datetime import datetime, timedelta
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
 
-from redmine_utils import get_tickets_nuovi, attach_and_update, create_report_issue
-from password_utils import genera_password, crea_immagine
-from crypto_utils import run_visual_crypto
-# No markdown generation needed when using mkdocx.py directly
-from zipper import crea_7z_cifrato
-from config import (
-    OUTPUT_DIR,
-    ARCHIVE_PASSWORD,
-    TEMPLATE_DOCX,
-    ASSIGN_TO_ID,
-    RESOLVED_STATUS_ID,
-    PROJECT_PASSWORDS,
-    PROJECT_TICKET_PARAMS,
-    PROJECT_DOCX_TEMPLATES,
-    REPORT_CONFIG,
-    LOG_LEVEL,
+from redmine_utils import (
+    TicketRecord,
+    REDMINE_TIME_FORMAT,
+    get_tickets_nuovi,
+    get_tickets_by_id,
+    find_attachment,
+    attach_and_update,
+    create_report_issue,
+    get_http_stats,
+    get_projects,
+    get_lease_manager,
+    UpdatePlanner,
 )
+from password_utils import crea_immagine, get_password_generator
+from crypto_utils import run_visual_crypto
+from mkdocx import build_docx
+from zipper import SevenZipBackend, crea_7z_cifrato, crea_7z_cifrato_in_memoria, memory_staging_dir
+from metrics import RunMetrics, StageTimer
+from kit_pool import KitPool, build_kit, kit_members, load_pool_key
+from journal import TicketJournal
+from lease import in_shard
+import config
 
+FALLBACK_OUTPUT_DIR = "/tmp/redmine-password-packer-output"
 DIR_MODE = 0o700
 FILE_MODE = 0o600
 logger = logging.getLogger(__name__)
 
+# Lavoro da svolgere per un ticket di un progetto configurato
+TicketJob = namedtuple(
+    "TicketJob",
+    ["ticket_id", "ticket_dir", "docx_template", "archive_password", "ticket_cfg", "password", "policy",
+     "project_id"],
+    defaults=(None, None),
+)
+
 
 def _safe_chmod(path, mode):
     try:
@@ -75,7 +96,7 @@ def _resolve_writable_output_dir(preferred_dir):
         os.remove(probe)
         return preferred_dir
     except Exception as e:
-        fallback = "/tmp/redmine-password-packer-output"
+        fallback = FALLBACK_OUTPUT_DIR
         logger.warning(
             "Output dir '%s' is not writable (%s). Falling back to '%s'.",
             preferred_dir,
@@ -86,147 +107,830 @@ def _resolve_writable_output_dir(preferred_dir):
         return fallback
 
 
-def run(ticket_ids=None):
-    if ticket_ids is None:
-        tickets = list(get_tickets_nuovi())
-        logger.info("Fetched %d ticket(s) assigned to current user with status 'New'", len(tickets))
+def _resolve_project_key(ticket):
+    return ticket.project_identifier or ticket.project_name or ticket.project_id
+
+
+def _report_missing_project(project_key, ticket_ids):
+    """Apre un unico ticket di segnalazione per un progetto non in configurazione.
+
+    `ticket_ids` sono tutti i ticket del batch che appartengono al progetto:
+    nei template `subject`/`description` sono disponibili come `{ticket}`
+    (elenco separato da virgole) e `{count}`.
+    """
+    report = config.REPORT_CONFIG or {}
+    report_project = report.get('project')
+    report_assignee = report.get('assigned_to_id')
+    # Allow per-project overrides for issue creation fields.
+    report_ticket_defaults = {}
+    if isinstance(report.get('ticket'), dict):
+        report_ticket_defaults.update(report.get('ticket'))
+    record = config.PROJECTS.get(project_key)
+    project_ticket_overrides = record.ticket_params if record is not None else {}
+    if isinstance(project_ticket_overrides, dict):
+        report_ticket_defaults.update(project_ticket_overrides)
+    subj_t = report.get('subject', 'Segnalazione: progetto mancante {project}')
+    desc_t = report.get('description', 'Il progetto {project} (ticket {ticket}) non è presente nella configurazione.')
+    tickets_label = ", ".join(str(tid) for tid in ticket_ids)
+    subject = subj_t.format(project=project_key, ticket=tickets_label, count=len(ticket_ids))
+    description = desc_t.format(project=project_key, ticket=tickets_label, count=len(ticket_ids))
+    report_created = False
+    try:
+        project_id = report_ticket_defaults.pop('project_id', report_project)
+        assigned_to_id = report_ticket_defaults.pop('assigned_to_id', report_assignee)
+        if report_ticket_defaults.get('project') and not project_id:
+            project_id = report_ticket_defaults.pop('project')
+        category_id = report_ticket_defaults.get('category_id')
+        if category_id in (None, "") and assigned_to_id in (None, ""):
+            raise ValueError(
+                "Configurazione ticket non valida: se 'category_id' non è valorizzato, "
+                "'assigned_to_id' è obbligatorio."
+            )
+        create_report_issue(
+            project_id,
+            subject,
+            description,
+            assigned_to_id=assigned_to_id,
+            **report_ticket_defaults,
+        )
+        report_created = True
+    except Exception as e:
+        print(f"Errore creando ticket di segnalazione per progetto {project_key}: {e}")
+    if report_created:
+        print(f"[!] Progetto {project_key} non in configurazione: aperto ticket di segnalazione, skip ticket {tickets_label}")
     else:
-        tickets = [{"id": tid} for tid in ticket_ids]
-        logger.info("Running in manual mode for ticket ids: %s", ticket_ids)
-    run_output_dir = _resolve_writable_output_dir(OUTPUT_DIR)
+        print(f"[!] Progetto {project_key} non in configurazione: ticket di segnalazione non creato, skip ticket {tickets_label}")
+    return report_created
+
+
+def _project_lineage():
+    """Funzione `lineage` per `ProjectRegistry.resolve` basata sulla gerarchia Redmine.
+
+    L'elenco dei progetti è letto una sola volta, al primo ticket il cui
+    progetto non è in configurazione, dalla directory dei metadati (da
+    Redmine solo se la copia locale è scaduta) e riusato per il resto del run.
+    """
+    projects = None
 
-    # progetto->password già fornita da CONFIG YAML
-    proj_pw = PROJECT_PASSWORDS or {}
-    proj_docx_templates = PROJECT_DOCX_TEMPLATES or {}
+    def lineage(project_id):
+        nonlocal projects
+        if projects is None:
+            try:
+                projects = get_projects()
+            except Exception as e:
+                logger.warning("Could not load the Redmine project hierarchy: %s", e)
+                projects = {}
+        seen = set()
+        project = projects.get(project_id)
+        while project is not None and project.id not in seen:
+            seen.add(project.id)
+            yield project.identifier, project.name, project.id
+            project = projects.get(project.parent_id)
 
+    return lineage
+
+
+def _triage_tickets(tickets, run_output_dir, lineage=None, keep=None):
+    """Classifica il batch per progetto prima di generare qualsiasi artefatto.
+
+    Restituisce (jobs, missing_projects): i `TicketJob` dei ticket con
+    progetto configurato, con le password dei ticket già generate in blocco
+    per policy, e una mappa project_key -> [ticket_id] per i progetti non
+    presenti in configurazione, nell'ordine in cui compaiono nel batch.
+    `lineage` (vedi `ProjectRegistry.resolve`) permette ai sotto-progetti di
+    usare la configurazione del progetto padre. `keep` (ticket_id -> bool)
+    esclude dai job i ticket di un altro shard; i ticket di progetti mancanti
+    sono restituiti tutti.
+    """
+    jobs = []
+    jobs_by_policy = {}
+    missing_projects = {}
     for ticket in tickets:
-        ticket_id = ticket['id']
+        ticket_id = ticket.id
+        project_key = _resolve_project_key(ticket)
+        logger.debug("Ticket %s project key resolved to: %s", ticket_id, project_key)
+
+        # Determina la password per il progetto del ticket (se presente nel YAML),
+        # altrimenti usa ARCHIVE_PASSWORD. Se il progetto non è noto, il ticket viene saltato.
+        pw = config.ARCHIVE_PASSWORD
+        project_ticket_cfg = {}
+        project_docx_template = config.TEMPLATE_DOCX
+        # Policy della password del ticket: default globale + override di progetto
+        policy = dict(config.PASSWORD_POLICY or {})
+        if project_key is not None:
+            record = config.PROJECTS.resolve(ticket.project_identifier, ticket.project_name, ticket.project_id,
+                                      lineage=lineage)
+            if record is None or not record.configured:
+                missing_projects.setdefault(project_key, []).append(ticket_id)
+                continue
+            if keep is not None and not keep(ticket_id):
+                continue
+            logger.debug("Ticket %s using configuration of project %s", ticket_id, record.key)
+            pw = record.password
+            project_ticket_cfg = record.ticket_params
+            project_docx_template = record.docx_template or config.TEMPLATE_DOCX
+            policy.update(record.password_policy)
+        jobs_by_policy.setdefault(repr(sorted(policy.items())), (policy, []))[1].append(len(jobs))
+
         ticket_dir = os.path.join(run_output_dir, f"ticket_{ticket_id}")
-        _ensure_secure_dir(ticket_dir)
-        logger.debug("Processing ticket id=%s in dir=%s", ticket_id, ticket_dir)
+        jobs.append(TicketJob(ticket_id, ticket_dir, project_docx_template, pw, project_ticket_cfg, None, policy,
+                              ticket.project_id))
+
+    # Password generate in blocco: un generatore e una lettura CSPRNG per policy
+    for policy, indexes in jobs_by_policy.values():
+        passwords = get_password_generator(policy).generate_many(len(indexes))
+        for idx, password in zip(indexes, passwords):
+            jobs[idx] = jobs[idx]._replace(password=password)
+
+    logger.info(
+        "Triage: %d ticket(s) to pack, %d ticket(s) in %d unconfigured project(s)",
+        len(jobs),
+        sum(len(ids) for ids in missing_projects.values()),
+        len(missing_projects),
+    )
+    return jobs, missing_projects
 
-        project_key = None
-        try:
-            proj = getattr(ticket, 'project', None)
-            if proj is not None:
-                project_key = getattr(proj, 'identifier', None) or getattr(proj, 'name', None) or getattr(proj, 'id', None)
-        except Exception:
-            project_key = None
-        logger.debug("Ticket %s project key resolved to: %s", ticket_id, project_key)
 
-        # 1) genera password e la salva in ticket_dir
-        password = genera_password()
+def _build_ticket_archive(ticket_id, ticket_dir, docx_template, archive_password, password):
+    """Fasi CPU-bound di un ticket: file password, immagini, DOCX e archivio 7z.
+
+    Funzione top-level (picklable) così da poter girare in un worker del
+    process pool; restituisce (percorso dell'archivio creato, durate per fase).
+    """
+    timer = StageTimer()
+    _ensure_secure_dir(ticket_dir)
+
+    # 1) salva la password del ticket in ticket_dir
+    with timer.stage("password"):
         password_file = os.path.join(ticket_dir, f"ticket_{ticket_id}_password.txt")
         with open(password_file, 'w') as f:
             f.write(password)
         _ensure_secure_file(password_file)
 
-        # 2) crea immagine base nella directory del ticket
+    # 2) crea immagine base nella directory del ticket
+    with timer.stage("image"):
         base_img = crea_immagine(password, ticket_id, ticket_dir)
 
-        # 3) applica crittografia visuale -> Password_A.png, Password_B.png
+    # 3) applica crittografia visuale -> Password_A.png, Password_B.png
+    with timer.stage("visual_crypto"):
         A_img, B_img = run_visual_crypto(base_img)
         _ensure_secure_file(base_img)
         _ensure_secure_file(A_img)
         _ensure_secure_file(B_img)
 
-        # 4) genera il DOCX usando mkdocx.py e il template DOCX
+    # 4) genera il DOCX in-process (template in cache) usando il template DOCX
+    with timer.stage("docx"):
         docx_out = os.path.join(ticket_dir, f"ticket_{ticket_id}.docx")
-        mkdocx_py = os.path.join(os.path.dirname(__file__), 'mkdocx.py')
-        project_docx_template = TEMPLATE_DOCX
-        if project_key is not None and str(project_key) in proj_docx_templates:
-            project_docx_template = proj_docx_templates[str(project_key)]
-        logger.debug("Ticket %s DOCX template: %s", ticket_id, project_docx_template)
-        subprocess.run([sys.executable, mkdocx_py, '--template', project_docx_template, '--image', A_img, '--out', docx_out], check=True)
+        logger.debug("Ticket %s DOCX template: %s", ticket_id, docx_template)
+        build_docx(docx_template, A_img, docx_out)
         _ensure_secure_file(docx_out)
 
-        # 6) comprimi la directory del ticket in 7z cifrato
-        # Determina la password per il progetto del ticket (se presente nel YAML),
-        # altrimenti usa ARCHIVE_PASSWORD. Se il progetto non è noto, apri un ticket di segnalazione e salta il ticket.
-        pw = ARCHIVE_PASSWORD
-        project_ticket_cfg = {}
-        if project_key is not None:
-            project_ticket_cfg = PROJECT_TICKET_PARAMS.get(str(project_key), {}) or {}
-            if str(project_key) in proj_pw:
-                pw = proj_pw.get(str(project_key), pw)
-                logger.debug("Ticket %s using project-specific archive password", ticket_id)
-            else:
-                # progetto non trovato nella mappa: apri ticket di segnalazione usando la configurazione
-                report = REPORT_CONFIG or {}
-                report_project = report.get('project')
-                report_assignee = report.get('assigned_to_id')
-                # Allow per-project overrides for issue creation fields.
-                report_ticket_defaults = {}
-                if isinstance(report.get('ticket'), dict):
-                    report_ticket_defaults.update(report.get('ticket'))
-                project_ticket_overrides = PROJECT_TICKET_PARAMS.get(str(project_key), {})
-                if isinstance(project_ticket_overrides, dict):
-                    report_ticket_defaults.update(project_ticket_overrides)
-                subj_t = report.get('subject', 'Segnalazione: progetto mancante {project}')
-                desc_t = report.get('description', 'Il progetto {project} (ticket {ticket}) non è presente nella configurazione.')
-                subject = subj_t.format(project=project_key, ticket=ticket_id)
-                description = desc_t.format(project=project_key, ticket=ticket_id)
-                report_created = False
-                try:
-                    project_id = report_ticket_defaults.pop('project_id', report_project)
-                    assigned_to_id = report_ticket_defaults.pop('assigned_to_id', report_assignee)
-                    if report_ticket_defaults.get('project') and not project_id:
-                        project_id = report_ticket_defaults.pop('project')
-                    category_id = report_ticket_defaults.get('category_id')
-                    if category_id in (None, "") and assigned_to_id in (None, ""):
-                        raise ValueError(
-                            "Configurazione ticket non valida: se 'category_id' non è valorizzato, "
-                            "'assigned_to_id' è obbligatorio."
-                        )
-                    create_report_issue(
-                        project_id,
-                        subject,
-                        description,
-                        assigned_to_id=assigned_to_id,
-                        **report_ticket_defaults,
-                    )
-                    report_created = True
-                except Exception as e:
-                    print(f"Errore creando ticket di segnalazione per progetto {project_key}: {e}")
-                if report_created:
-                    print(f"[!] Progetto {project_key} non in configurazione: aperto ticket di segnalazione, skip ticket {ticket_id}")
-                else:
-                    print(f"[!] Progetto {project_key} non in configurazione: ticket di segnalazione non creato, skip ticket {ticket_id}")
-                _cleanup_sensitive_artifacts(ticket_dir)
-                continue
-
+    # 5) comprimi la directory del ticket in 7z cifrato
+    with timer.stage("archive"):
         _ensure_secure_tree(ticket_dir)
-        archive_path = crea_7z_cifrato(ticket_dir, ticket_id, pw)
+        archive_path = crea_7z_cifrato(ticket_dir, ticket_id, archive_password)
         logger.debug("Ticket %s archive created at %s", ticket_id, archive_path)
         _ensure_secure_file(archive_path)
+    return archive_path, timer.durations
+
+
+def _build_ticket_archive_in_memory(ticket_id, docx_template, archive_password, password):
+    """Come `_build_ticket_archive`, ma tutti gli artefatti restano in memoria.
+
+    Restituisce ((nome archivio, contenuto dell'archivio), durate per fase).
+    """
+    timer = StageTimer()
+    # 1) la password del ticket è già generata in blocco (vedi _triage_tickets)
+    # 2-4) immagine base, crittografia visuale e DOCX
+    logger.debug("Ticket %s DOCX template: %s", ticket_id, docx_template)
+    kit = build_kit(password, docx_template, timer)
+
+    # 5) archivio 7z cifrato a partire dai buffer
+    with timer.stage("archive"):
+        archive = crea_7z_cifrato_in_memoria(kit_members(kit, ticket_id), ticket_id, archive_password,
+                                             config.MEMORY_STAGING_DIR)
+    return archive, timer.durations
+
+
+def _build_ticket_archive_from_kit(ticket_id, kit, archive_password):
+    """Archivio del ticket a partire da un kit pre-generato (vedi `kit_pool`)."""
+    timer = StageTimer()
+    with timer.stage("archive"):
+        archive = crea_7z_cifrato_in_memoria(kit_members(kit, ticket_id), ticket_id, archive_password,
+                                             config.MEMORY_STAGING_DIR)
+    return archive, timer.durations
+
+
+_KIT_POOL = None
+
+
+def get_kit_pool():
+    """Pool di kit pre-generati (`kit_pool.enabled`), creato al primo uso; None se disabilitato."""
+    global _KIT_POOL
+    if _KIT_POOL is None and config.KIT_POOL_ENABLED:
+        root = config.KIT_POOL_DIR or os.path.join(_resolve_writable_output_dir(config.OUTPUT_DIR), ".kit_pool")
+        key = load_pool_key(config.KIT_POOL_KEY_FILE, root)
+        _KIT_POOL = KitPool(root, key, config.KIT_POOL_LOW_WATERMARK, config.KIT_POOL_HIGH_WATERMARK)
+    return _KIT_POOL
+
+
+def _kit_specs():
+    """Coppie (template, policy) dei progetti configurati, per registrare i pool."""
+    specs = {}
+    records = [None] + sorted((r for r in config.PROJECTS if r.configured), key=lambda r: r.key)
+    for record in records:
+        template = config.TEMPLATE_DOCX
+        policy = dict(config.PASSWORD_POLICY or {})
+        if record is not None:
+            template = record.docx_template or config.TEMPLATE_DOCX
+            policy.update(record.password_policy)
+        specs[(template, repr(sorted(policy.items())))] = (template, policy)
+    return list(specs.values())
+
 
-        # 7) aggiorna il ticket su Redmine: allega, risolve, assegna (se configurato)
-        notes = f"Automated: allegato {os.path.basename(archive_path)}. Chiudo ticket."
-        update_assign_to_id = ASSIGN_TO_ID
-        update_category_id = None
-        if isinstance(project_ticket_cfg, dict):
-            update_category_id = project_ticket_cfg.get('category_id')
-            if project_ticket_cfg.get('assigned_to_id') not in (None, ''):
-                update_assign_to_id = project_ticket_cfg.get('assigned_to_id')
-        attach_and_update(
-            ticket_id,
-            archive_path,
-            assign_to_id=update_assign_to_id,
-            status_id=RESOLVED_STATUS_ID,
-            notes=notes,
-            category_id=update_category_id,
+def refill_kits():
+    """Registra i pool dei progetti configurati e li riempie fino a `high_watermark`."""
+    kits = get_kit_pool()
+    if kits is None:
+        raise RuntimeError("Pool di kit disabilitato: impostare kit_pool.enabled: true")
+    for template, policy in _kit_specs():
+        try:
+            kits.register(template, policy)
+        except OSError as e:
+            logger.warning("Kit pool not registered for template %s: %s", template, e)
+    produced = kits.refill(until_full=True)
+    print(f"[✓] Kit generati: {produced}; disponibili per pool: {kits.depths()}")
+    return produced
+
+
+def _publish_ticket(ticket_id, archive, project_ticket_cfg, project_id=None, planner=None):
+    """Allega l'archivio al ticket e lo risolve/assegna (se configurato).
+
+    `archive` è il percorso dell'archivio oppure (nome, bytes) in modalità memoria.
+    Con `planner` (`UpdatePlanner`) e `project_id` assegnatario e categoria
+    sono validati sul progetto del ticket prima dell'aggiornamento.
+    Restituisce la dimensione in byte dell'archivio caricato.
+    """
+    if isinstance(archive, tuple):
+        archive_name, archive_data = archive
+        archive_src = io.BytesIO(archive_data)
+        archive_size = len(archive_data)
+    else:
+        archive_name, archive_src = os.path.basename(archive), archive
+        archive_size = os.path.getsize(archive)
+    notes = f"Automated: allegato {archive_name}. Chiudo ticket."
+    update_assign_to_id = config.ASSIGN_TO_ID
+    update_category_id = None
+    if isinstance(project_ticket_cfg, dict):
+        update_category_id = project_ticket_cfg.get('category_id')
+        if project_ticket_cfg.get('assigned_to_id') not in (None, ''):
+            update_assign_to_id = project_ticket_cfg.get('assigned_to_id')
+    if planner is not None:
+        update_assign_to_id, update_category_id = planner.plan(
+            project_id, update_assign_to_id, update_category_id, fallback_assign_to_id=config.ASSIGN_TO_ID,
         )
-        _cleanup_sensitive_artifacts(ticket_dir, archive_path)
+    retried = attach_and_update(
+        ticket_id,
+        archive_src,
+        assign_to_id=update_assign_to_id,
+        status_id=config.RESOLVED_STATUS_ID,
+        notes=notes,
+        category_id=update_category_id,
+        filename=archive_name,
+    )
+    if retried and planner is not None and project_id is not None:
+        # Metadati superati: il prossimo ticket del progetto li rilegge
+        planner.invalidate(project_id)
+    return archive_size
+
+
+def _open_journal():
+    """Journal dei ticket (`journal.enabled`); None se disabilitato."""
+    if not config.JOURNAL_ENABLED:
+        return None
+    output_dir = _resolve_writable_output_dir(config.OUTPUT_DIR)
+    return TicketJournal(
+        config.JOURNAL_FILE or os.path.join(output_dir, ".journal.jsonl"),
+        config.JOURNAL_SPOOL_DIR or os.path.join(output_dir, ".spool"),
+        retention_days=config.JOURNAL_RETENTION_DAYS,
+    )
+
+
+def _already_attached(journal, ticket_id):
+    """True se un upload interrotto del ticket è in realtà arrivato su Redmine."""
+    if journal.get(ticket_id).get("stage") not in ("upload", "failed"):
+        return False
+    spooled = journal.spooled(ticket_id)
+    if spooled is None:
+        return False
+    attachment_id = find_attachment(ticket_id, *spooled)
+    if attachment_id is None:
+        return False
+    logger.info("Ticket %s: archive %s already attached (attachment %s), not uploading again",
+                ticket_id, spooled[0], attachment_id)
+    return True
+
+
+def _reconcile_journal(journal):
+    # Ticket con un upload interrotto che nel frattempo sono usciti dal filtro
+    # "Nuovo" (l'aggiornamento era arrivato): chiusi senza ricaricare nulla
+    for ticket_id in journal.pending():
+        try:
+            if _already_attached(journal, ticket_id):
+                journal.record(ticket_id, "published")
+        except Exception as e:
+            logger.warning("Journal: unable to check attachments of ticket %s: %s", ticket_id, e)
+
+
+def _write_metrics(metrics, output_dir=None):
+    """Scrive le metriche del run (`metrics.file`, default `metrics.prom`/`metrics.json`
+    nella directory di output); un errore di scrittura non fa fallire il run.
+
+    Senza `output.dir` in configurazione la directory di default ("output",
+    relativa alla directory corrente) può essere nel sorgente: le metriche
+    vanno allora in `FALLBACK_OUTPUT_DIR`.
+    """
+    if config.METRICS_FORMAT == "none":
+        return None
+    try:
+        path = config.METRICS_FILE
+        if not path:
+            if not config.OUTPUT_DIR_CONFIGURED:
+                output_dir = _resolve_writable_output_dir(FALLBACK_OUTPUT_DIR)
+            output_dir = output_dir or _resolve_writable_output_dir(config.OUTPUT_DIR)
+            path = os.path.join(output_dir, "metrics.json" if config.METRICS_FORMAT == "json" else "metrics.prom")
+        metrics.write(path, config.METRICS_FORMAT)
+        logger.info("Run metrics written to %s", path)
+        return path
+    except Exception as e:
+        logger.warning("Unable to write run metrics: %s", e)
+        return None
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _print_summary(results):
+    packed = sum(1 for _, status, _ in results if status == "packed")
+    print(f"[*] Riepilogo: {packed}/{len(results)} ticket completati")
+    for ticket_id, status, detail in results:
+        line = f"    - Ticket {ticket_id}: {status}"
+        if detail:
+            line += f" ({detail})"
+        print(line)
+
+
+def run(ticket_ids=None, workers=1, in_memory=None, io_concurrency=None, metrics=None, tickets=None,
+        pool=None):
+    """Elabora i ticket; con `workers` > 1 le fasi CPU-bound girano in un process pool.
+
+    Upload e aggiornamenti delle issue girano nello stadio di I/O asincrono
+    (`io_concurrency` operazioni in parallelo, default `redmine.io_concurrency`)
+    sovrapponendosi alla generazione dei ticket successivi.
+
+    Con `in_memory` (default: `output.mode: memory`) gli artefatti non vengono
+    scritti nella directory di output: l'archivio è caricato da un buffer.
+    Il fallimento di un ticket non interrompe il batch; restituisce la lista
+    (ticket_id, esito, dettaglio) nell'ordine dei ticket in input. Tempi per
+    fase ed esiti sono raccolti in `metrics` (un `RunMetrics` nuovo se non
+    fornito) e scritti a fine run secondo la sezione `metrics` della config.
+    `tickets` (iterabile di `TicketRecord`) sostituisce la lettura da Redmine;
+    `pool` è un process pool già avviato da riusare (es. in modalità daemon).
+
+    Con `journal.enabled` ogni archivio è salvato nello spool prima
+    dell'upload e le fasi completate sono registrate nel journal: dopo
+    un'interruzione i ticket ripartono dall'archivio già generato e un
+    archivio già allegato non viene caricato una seconda volta.
+
+    Con più repliche sulla stessa coda (`sharding.replicas` > 1) ogni replica
+    elabora solo i ticket del proprio shard; con `lease.enabled` i ticket
+    sono presi in carico prima di generare gli artefatti e quelli vinti da
+    un'altra replica sono saltati. I ticket indicati esplicitamente con
+    `ticket_ids` non sono filtrati per shard.
+    """
+    # Importato qui: asyncio pesa sull'avvio dei comandi che non elaborano ticket
+    from redmine_io import RedmineIOStage
+
+    sharded = config.SHARD_COUNT > 1 and (tickets is not None or ticket_ids is None)
+    if tickets is not None:
+        logger.debug("Processing supplied ticket stream")
+    elif ticket_ids is None:
+        tickets = get_tickets_nuovi()
+        logger.info("Streaming ticket(s) assigned to current user with status 'New'")
+    else:
+        tickets = [TicketRecord(tid, None, None, None) for tid in ticket_ids]
+        logger.info("Running in manual mode for ticket ids: %s", ticket_ids)
+    if in_memory is None:
+        in_memory = config.OUTPUT_MODE == "memory"
+    if in_memory and (config.ARCHIVE_BACKEND or SevenZipBackend.name).lower() == SevenZipBackend.name:
+        # Senza una directory in RAM per il binario 7z si ferma subito, non a ogni ticket
+        memory_staging_dir(config.MEMORY_STAGING_DIR)
+    # In modalità memoria la directory di output non viene usata
+    run_output_dir = config.OUTPUT_DIR if in_memory else _resolve_writable_output_dir(config.OUTPUT_DIR)
+
+    results = {}
+    order = []
+    missing_projects = {}
+    missing_claimed = set()  # ticket di progetti mancanti vinti con il lease sul campo personalizzato
+    metrics = metrics if metrics is not None else RunMetrics(slowest=config.METRICS_SLOWEST)
+    journal = _open_journal()
+    if journal is not None:
+        _reconcile_journal(journal)
+    lineage = _project_lineage()
+    planner = UpdatePlanner()
+    leases = get_lease_manager() if config.LEASE_ENABLED else None
+    if leases is not None:
+        try:
+            metrics.counter("lease_recovered", leases.recover())
+        except Exception as e:
+            logger.warning("Could not recover abandoned leases: %s", e)
+    # Chi segnala un progetto mancante: con lo sharding la replica dello shard
+    # del ticket con id minore, altrimenti chi vince quel ticket con il lease
+    # sul campo personalizzato. Lo stato dei ticket non cambia: restano "Nuovo".
+    report_leases = None
+    if leases is not None and not sharded:
+        if leases.mode == "custom_field":
+            report_leases = leases
+        elif config.LEASE_CUSTOM_FIELD_ID not in (None, ""):
+            report_leases = get_lease_manager(mode="custom_field")
+        else:
+            logger.warning("lease.custom_field_id not set: every replica may report the same missing project")
+    keep = (lambda ticket_id: in_shard(ticket_id, config.SHARD_COUNT, config.SHARD_INDEX)) if sharded else None
+
+    def _reporter(ticket_ids):
+        first = min(ticket_ids)
+        if sharded:
+            return keep(first)
+        if report_leases is not None:
+            return first in missing_claimed
+        return True
 
+    def job_stream():
+        # Triage a blocchi (una pagina alla volta): i ticket partono subito
+        # senza attendere il download dell'intero elenco.
+        for chunk in _chunks(tickets, config.REDMINE_PAGE_SIZE):
+            with metrics.stage("triage"):
+                jobs, chunk_missing = _triage_tickets(chunk, run_output_dir, lineage, keep)
+            missing_ids = [ticket_id for ids in chunk_missing.values() for ticket_id in ids]
+            order.extend(ticket.id for ticket in chunk)
+            if leases is not None and jobs:
+                # Claim prima di generare gli artefatti: i ticket persi sono di un'altra replica
+                with metrics.stage("lease_claim"):
+                    claimed = leases.claim(job.ticket_id for job in jobs)
+                metrics.counter("lease_claims", len(claimed), result="won")
+                metrics.counter("lease_claims", len(jobs) - len(claimed), result="lost")
+                if len(claimed) < len(jobs):
+                    logger.info("Lease: %d ticket(s) taken by another replica", len(jobs) - len(claimed))
+                jobs = [job for job in jobs if job.ticket_id in claimed]
+            if report_leases is not None and missing_ids:
+                with metrics.stage("lease_claim"):
+                    missing_claimed.update(report_leases.claim(missing_ids))
+            for project_key, project_ticket_ids in chunk_missing.items():
+                missing_projects.setdefault(project_key, []).extend(project_ticket_ids)
+            yield from jobs
+
+    def _report_missing(project_key, ticket_ids):
+        # Il lease resta ai ticket segnalati (fino a `lease.ttl`): nessuna
+        # replica riapre la stessa segnalazione; se non è stata creata i
+        # ticket vengono rilasciati e la segnalazione si riprova
+        if not _report_missing_project(project_key, ticket_ids) and report_leases is not None:
+            for ticket_id in ticket_ids:
+                if ticket_id in missing_claimed:
+                    report_leases.release(ticket_id)
+
+    def _fail(ticket_id, error):
+        logger.exception("Ticket %s failed", ticket_id)
+        print(f"[✗] Ticket {ticket_id} fallito: {error}")
+        results[ticket_id] = (ticket_id, "failed", str(error))
+        if leases is not None:
+            # Il ticket torna disponibile per tutte le repliche
+            leases.release(ticket_id)
+
+    def _publish(job, archive, durations, spooled=False):
+        # Stadio di I/O: upload e aggiornamento issue, poi pulizia artefatti
+        ticket_id = job.ticket_id
+        timer = StageTimer()
+        timer.durations.update(durations)
+        detail = None
+        try:
+            if leases is not None and not leases.held(ticket_id):
+                # Elaborato oltre `lease.ttl`: ripreso da un'altra replica, che lo pubblica
+                logger.warning("Ticket %s: lease lost before publishing, left to the other replica", ticket_id)
+                metrics.counter("lease_lost")
+                results[ticket_id] = (ticket_id, "skipped", "lease perso prima della pubblicazione")
+                return
+            if journal is not None and not spooled:
+                with timer.stage("spool"):
+                    journal.spool(ticket_id, archive)
+            with timer.stage("publish"):
+                if journal is not None and _already_attached(journal, ticket_id):
+                    metrics.counter("journal_already_attached")
+                    detail = "archivio già allegato"
+                else:
+                    if journal is not None:
+                        journal.record(ticket_id, "upload")
+                    metrics.add_bytes_uploaded(_publish_ticket(ticket_id, archive, job.ticket_cfg,
+                                                                    job.project_id, planner))
+            if journal is not None:
+                journal.record(ticket_id, "published")
+        except Exception as e:
+            if journal is not None and journal.get(ticket_id):
+                journal.record(ticket_id, "failed", error=str(e))
+            _fail(ticket_id, e)
+            return
+        finally:
+            if not in_memory:
+                with timer.stage("cleanup"):
+                    # Da kit o dallo spool l'archivio è (nome, bytes): non c'è un file da rimuovere
+                    archive_path = archive if isinstance(archive, str) and not spooled else None
+                    _cleanup_sensitive_artifacts(job.ticket_dir, archive_path)
+            metrics.record_ticket(ticket_id, timer.durations)
+        results[ticket_id] = (ticket_id, "packed", detail)
         print(f"[✓] Ticket {ticket_id} completato: archivio caricato e artefatti locali rimossi")
 
+    kits = get_kit_pool()
+
+    def _take_kit(job):
+        if kits is None:
+            return None
+        with metrics.stage("kit_take"):
+            kit = kits.take(job.docx_template, job.policy)
+        metrics.counter("kit_pool_takes", result="hit" if kit is not None else "miss")
+        return kit
+
+    def _prepared(job):
+        # Archivio già pronto: nello spool (run precedente interrotto o upload
+        # fallito) oppure da un kit pre-generato. None: generazione completa.
+        if journal is not None:
+            archive = journal.spooled(job.ticket_id)
+            if archive is not None:
+                logger.info("Ticket %s: resuming from spooled archive %s", job.ticket_id, archive[0])
+                metrics.counter("journal_resumed")
+                return lambda: (archive, {}), True
+        kit = _take_kit(job)
+        if kit is not None:
+            return lambda: _build_ticket_archive_from_kit(job.ticket_id, kit, job.archive_password), False
+        return None, False
+
+    def _finish(job, build, spooled=False):
+        logger.debug("Processing ticket id=%s in dir=%s", job.ticket_id, job.ticket_dir)
+        try:
+            archive, durations = build()
+        except Exception as e:
+            _fail(job.ticket_id, e)
+            if not in_memory:
+                _cleanup_sensitive_artifacts(job.ticket_dir)
+            return
+        # L'upload prosegue in background mentre si genera il ticket successivo
+        io_stage.submit(_publish, job, archive, durations, spooled)
+
+    if in_memory:
+        build_fn = _build_ticket_archive_in_memory
+        build_args = lambda job: (job.ticket_id, job.docx_template, job.archive_password, job.password)
+    else:
+        build_fn = _build_ticket_archive
+        build_args = lambda job: (job.ticket_id, job.ticket_dir, job.docx_template, job.archive_password, job.password)
+
+    with RedmineIOStage(io_concurrency) as io_stage:
+        if workers and workers > 1:
+            with (nullcontext(pool) if pool is not None else ProcessPoolExecutor(max_workers=workers)) as pool:
+                # Finestra limitata di ticket in volo: gli archivi passano allo
+                # stadio di I/O nell'ordine dei ticket mentre il pool prosegue
+                inflight = deque()
+                for job in job_stream():
+                    build, spooled = _prepared(job)
+                    if build is not None:
+                        _finish(job, build, spooled)
+                        continue
+                    inflight.append((job, pool.submit(build_fn, *build_args(job))))
+                    if len(inflight) >= workers * 2:
+                        done_job, future = inflight.popleft()
+                        _finish(done_job, future.result)
+                while inflight:
+                    done_job, future = inflight.popleft()
+                    _finish(done_job, future.result)
+        else:
+            for job in job_stream():
+                build, spooled = _prepared(job)
+                if build is not None:
+                    _finish(job, build, spooled)
+                    continue
+                _finish(job, lambda job=job: build_fn(*build_args(job)))
+
+        # Un solo ticket di segnalazione per progetto mancante, con tutti i ticket del run
+        for project_key, project_ticket_ids in missing_projects.items():
+            if not _reporter(project_ticket_ids):
+                # Segnalato (con tutti i suoi ticket) da un'altra replica
+                continue
+            io_stage.submit(_report_missing, project_key, project_ticket_ids)
+            for ticket_id in project_ticket_ids:
+                results[ticket_id] = (ticket_id, "skipped", f"progetto {project_key} non in configurazione")
+
+    if journal is not None:
+        journal.close()
+    ordered = [results[ticket_id] for ticket_id in order if ticket_id in results]
+    _print_summary(ordered)
+    logger.info("Redmine HTTP stats: %s", get_http_stats())
+    for _, status, _ in ordered:
+        metrics.count(status)
+    if kits is not None:
+        for key_id, depth in kits.depths().items():
+            metrics.gauge("kit_pool_depth", depth, pool=key_id)
+    _write_metrics(metrics, run_output_dir if not in_memory else None)
+    return ordered
+
+
+def _load_daemon_state(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.warning("Daemon state '%s' unreadable (%s): starting with a full scan", path, e)
+        return {}
+
+
+def _save_daemon_state(path, state):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f)
+    _safe_chmod(tmp_path, FILE_MODE)
+    os.replace(tmp_path, path)
+
+
+def _next_cursor(updated_on):
+    # Il filtro Redmine è ">=": si riparte dal secondo successivo, così i
+    # ticket di progetti non configurati (che restano "Nuovo") non vengono
+    # segnalati a ogni ciclo. Gli eventuali ticket aggiornati nello stesso
+    # secondo ma non ancora visibili sono recuperati dalla scansione completa.
+    moment = datetime.strptime(updated_on, REDMINE_TIME_FORMAT) + timedelta(seconds=1)
+    return moment.strftime(REDMINE_TIME_FORMAT)
+
+
+def run_daemon(interval=None, full_scan_interval=None, state_file=None, stop_event=None, listen=None,
+               **run_kwargs):
+    """Esegue `run` in ciclo mantenendo il processo (font, template, pool HTTP) caldo.
+
+    Ogni ciclo legge solo i ticket aggiornati dopo il cursore `updated_on`,
+    salvato in `state_file` (default `<output.dir>/.daemon_state.json`) per
+    sopravvivere ai riavvii. Ogni `full_scan_interval` secondi (e al primo
+    avvio) la lettura è completa: recupera i ticket falliti, che restano
+    "Nuovo" senza cambiare `updated_on`. Termina a SIGTERM/SIGINT al termine
+    del ciclo in corso (o quando `stop_event` viene impostato).
+
+    Con `listen` ("host:port", default `webhook.listen`) avvia anche il
+    listener webhook: i ticket notificati sono elaborati subito tra un ciclo
+    e l'altro, e il polling diventa una riconciliazione a bassa frequenza
+    (`webhook.reconcile_interval`, salvo `interval` esplicito).
+    """
+    listen = listen or config.WEBHOOK_LISTEN
+    if interval is None:
+        interval = config.WEBHOOK_RECONCILE_INTERVAL if listen else config.DAEMON_INTERVAL
+    full_scan_interval = config.DAEMON_FULL_SCAN_INTERVAL if full_scan_interval is None else full_scan_interval
+    state_file = state_file or config.DAEMON_STATE_FILE or os.path.join(
+        _resolve_writable_output_dir(config.OUTPUT_DIR), ".daemon_state.json")
+    stop_event = stop_event or threading.Event()
+
+    def _stop(signum, frame):
+        logger.info("Signal %s received: stopping after the current cycle", signum)
+        stop_event.set()
+
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, _stop)
+        signal.signal(signal.SIGINT, _stop)
+
+    workers = run_kwargs.get("workers") or 1
+    # Process pool unico per tutta la vita del daemon: i worker mantengono
+    # font e template in cache tra un ciclo e l'altro
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+
+    queue = listener = None
+    if listen:
+        from webhook import TicketQueue, WebhookServer, parse_listen_address
+
+        queue = TicketQueue(dedupe_window=config.WEBHOOK_DEDUPE_WINDOW)
+        host, port = parse_listen_address(listen)
+        listener = WebhookServer(queue, host, port, token=config.WEBHOOK_TOKEN).start()
+    # Ticket già elaborati su notifica dall'ultimo polling: il polling
+    # successivo li salta (quelli di progetti non configurati restano
+    # "Nuovo" e verrebbero segnalati due volte)
+    pushed = set()
+
+    def run_pushed(ticket_ids):
+        start = time.time()
+        try:
+            results = run(tickets=get_tickets_by_id(ticket_ids), pool=pool, **run_kwargs)
+        except Exception:
+            logger.exception("Push cycle failed for ticket(s) %s", ticket_ids)
+            return
+        pushed.update(ticket_ids)
+        logger.info("Push cycle: %d notified, %d processed in %.1fs",
+                    len(ticket_ids), len(results), time.time() - start)
+
+    kits = get_kit_pool()
+    if kits is not None:
+        for template, policy in _kit_specs():
+            try:
+                kits.register(template, policy)
+            except OSError as e:
+                logger.warning("Kit pool not registered for template %s: %s", template, e)
+        kits.start(config.KIT_POOL_REFILL_INTERVAL)
+
+    state = _load_daemon_state(state_file)
+    logger.info("Daemon started: interval=%ss full_scan_interval=%ss cursor=%s state=%s",
+                interval, full_scan_interval, state.get("cursor"), state_file)
+    while not stop_event.is_set():
+        cycle_start = time.time()
+        full_scan = not state.get("cursor") or cycle_start - state.get("last_full_scan", 0) >= full_scan_interval
+        updated_since = None if full_scan else state["cursor"]
+        newest = []
+
+        def tracked():
+            for ticket in get_tickets_nuovi(updated_since=updated_since):
+                if ticket.updated_on and (not newest or ticket.updated_on > newest[0]):
+                    newest[:] = [ticket.updated_on]
+                if ticket.id in pushed and not full_scan:
+                    continue
+                yield ticket
+
+        try:
+            results = run(tickets=tracked(), pool=pool, **run_kwargs)
+        except Exception:
+            # Redmine non raggiungibile o simili: il cursore non avanza
+            logger.exception("Daemon cycle failed")
+        else:
+            if newest:
+                cursor = _next_cursor(newest[0])
+                if not state.get("cursor") or cursor > state["cursor"]:
+                    state["cursor"] = cursor
+            if full_scan:
+                state["last_full_scan"] = cycle_start
+            pushed.clear()
+            _save_daemon_state(state_file, state)
+            logger.info("Daemon cycle (%s): %d ticket(s) in %.1fs, cursor=%s",
+                        "full scan" if full_scan else "incremental",
+                        len(results), time.time() - cycle_start, state.get("cursor"))
+
+        deadline = cycle_start + interval
+        while not stop_event.is_set() and time.time() < deadline:
+            if queue is None:
+                stop_event.wait(max(0.0, deadline - time.time()))
+                continue
+            # Attesa a passi brevi per reagire subito a stop_event
+            ticket_ids = queue.drain(min(1.0, max(0.0, deadline - time.time())), debounce=config.WEBHOOK_DEBOUNCE)
+            if ticket_ids:
+                run_pushed(ticket_ids)
+    if listener is not None:
+        listener.stop()
+    if kits is not None:
+        kits.stop()
+    if pool is not None:
+        pool.shutdown()
+    logger.info("Daemon stopped")
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Redmine Password Visual Packer")
+    parser.add_argument('--ticket-id', type=int, nargs='*', help="Specifica uno o più ID ticket manualmente")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Numero di processi per le fasi CPU-bound (default: 1, sequenziale)")
+    parser.add_argument('--in-memory', action='store_true', default=None,
+                        help="Mantiene tutti gli artefatti in memoria (default: output.mode in config)")
+    parser.add_argument('--io-concurrency', type=int, default=None,
+                        help="Upload/aggiornamenti Redmine in parallelo (default: redmine.io_concurrency in config)")
+    parser.add_argument('--daemon', action='store_true',
+                        help="Resta in esecuzione e controlla i nuovi ticket a intervalli (daemon.interval)")
+    parser.add_argument('--interval', type=float, default=None,
+                        help="Secondi tra due cicli in modalità daemon (default: daemon.interval in config)")
+    parser.add_argument('--refill-kits', action='store_true',
+                        help="Riempie il pool di kit pre-generati (kit_pool) ed esce")
+    parser.add_argument('--listen', metavar='HOST:PORT', default=None,
+                        help="In modalità daemon avvia il listener webhook (default: webhook.listen in config)")
+    args = parser.parse_args()
+    if args.listen and not args.daemon:
+        parser.error("--listen richiede --daemon")
+    # Il livello di log è in configurazione: letto dopo gli argomenti, così --help non la carica
     logging.basicConfig(
-        level=getattr(logging, LOG_LEVEL, logging.INFO),
+        level=getattr(logging, config.LOG_LEVEL, logging.INFO),
         format="%(asctime)s %(levelname)s %(name)s: %(message)s",
     )
     logger.debug("current userid: %s", os.getuid())
-    parser = argparse.ArgumentParser(description="Redmine Password Visual Packer")
-    parser.add_argument('--ticket-id', type=int, nargs='*', help="Specifica uno o più ID ticket manualmente")
-    args = parser.parse_args()
-    run(ticket_ids=args.ticket_id)
+    if args.refill_kits:
+        refill_kits()
+    elif args.daemon:
+        if args.ticket_id:
+            parser.error("--daemon non è compatibile con --ticket-id")
+        run_daemon(interval=args.interval, listen=args.listen, workers=args.workers,
+                   in_memory=args.in_memory, io_concurrency=args.io_concurrency)
+    else:
+        run(ticket_ids=args.ticket_id, workers=args.workers, in_memory=args.in_memory,
+            io_concurrency=args.io_concurrency)
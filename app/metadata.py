@@ -0,0 +1,276 @@
+"""
+Directory locale dei metadati Redmine (progetti, categorie, membri).
+
+Elencare i progetti dell'utente interrogando le membership di ogni progetto
+costa una richiesta per progetto: su un'istanza con migliaia di progetti
+sono minuti. `MetadataDirectory` legge invece:
+
+- le membership dell'utente corrente con una sola richiesta
+  (`/users/current.json?include=memberships`);
+- l'elenco dei progetti (`/projects.json`, a pagine) con `updated_on` e
+  progetto padre;
+- categorie e membri di un progetto solo quando servono, in parallelo per
+  più progetti, con i ruoli di ogni membro;
+- per ogni ruolo, una volta sola, se consente l'assegnazione dei ticket
+  (`/roles/<id>.json`, attributo `assignable`): un membro con soli ruoli
+  non assegnabili (es. "Osservatore") farebbe rifiutare l'aggiornamento.
+
+Tutto è salvato in un file JSON (0600) nella directory `metadata.dir`, uno
+per server e chiave API, condiviso da `main.py` e `test_runner.py`. Ogni voce
+scade dopo `metadata.ttl` secondi; categorie e membri di un progetto sono
+scaduti anche quando il suo `updated_on` nell'elenco progetti cambia.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 2
+
+# Progetto Redmine con il riferimento al progetto padre (None per i progetti radice)
+ProjectInfo = namedtuple("ProjectInfo", ["id", "identifier", "name", "parent_id", "updated_on"],
+                         defaults=(None,))
+# Membership dell'utente corrente in un progetto
+Membership = namedtuple("Membership", ["project_id", "project_name", "roles"])
+# Categorie e membri (utenti e gruppi) di un progetto: {id: nome}; `assignable`
+# sono gli id dei membri con almeno un ruolo che consente l'assegnazione
+ProjectDetails = namedtuple("ProjectDetails", ["categories", "members", "assignable"])
+
+
+def _timestamp(value):
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%dT%H:%M:%SZ")
+    return str(value) if value is not None else None
+
+
+def metadata_path(directory, url, key):
+    """File dei metadati per server e chiave API (la chiave non finisce nel nome)."""
+    digest = hashlib.sha256(f"{url}\0{key}".encode()).hexdigest()[:24]
+    return os.path.join(directory, f"{digest}.json")
+
+
+class MetadataDirectory:
+    """Cache su disco dei metadati Redmine; thread-safe.
+
+    `client` è una funzione che restituisce il client python-redmine, chiamata
+    solo quando una voce va aggiornata. Con `path` None i metadati restano
+    solo in memoria per la durata del processo.
+    """
+
+    def __init__(self, path, client, ttl=3600, concurrency=8):
+        self.path = path
+        self._client = client
+        self.ttl = ttl
+        self.concurrency = max(1, int(concurrency))
+        self._lock = threading.RLock()
+        self._data = self._load()
+        self._projects = None   # (voce "projects" da cui è costruito, {id: ProjectInfo}, indice alias)
+
+    # --- persistenza ---------------------------------------------------------
+
+    def _load(self):
+        empty = {"version": FORMAT_VERSION, "user": None, "projects": None, "details": {}, "roles": {}}
+        if not self.path:
+            return empty
+        try:
+            with open(self.path) as f:
+                st = os.fstat(f.fileno())
+                if st.st_uid != os.getuid() or st.st_mode & 0o077:
+                    return empty
+                data = json.load(f)
+        except (OSError, ValueError):
+            return empty
+        if not isinstance(data, dict) or data.get("version") != FORMAT_VERSION:
+            return empty
+        return data
+
+    def _save(self):
+        if not self.path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", mode=0o700, exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w") as f:
+                json.dump(self._data, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            # La cache è solo un'ottimizzazione: si continua con i dati in memoria
+            logger.warning("Could not write metadata cache %s: %s", self.path, e)
+
+    def _fresh(self, entry):
+        return entry is not None and time.time() - entry.get("fetched", 0) < self.ttl
+
+    def invalidate(self, project_id=None):
+        """Scarta i metadati di un progetto, o tutti se `project_id` è None."""
+        with self._lock:
+            if project_id is None:
+                self._data.update(user=None, projects=None, details={}, roles={})
+                self._projects = None
+            else:
+                self._data["details"].pop(str(project_id), None)
+            self._save()
+
+    # --- utente corrente -----------------------------------------------------
+
+    def memberships(self, refresh=False):
+        """Membership dell'utente corrente, lette con una sola richiesta."""
+        with self._lock:
+            entry = self._data["user"]
+            if refresh or not self._fresh(entry):
+                user = self._client().user.get("current", include=["memberships"])
+                entry = {
+                    "fetched": time.time(),
+                    "id": user.id,
+                    "memberships": [
+                        [m.project.id, getattr(m.project, "name", None),
+                         [role.name for role in getattr(m, "roles", None) or []]]
+                        for m in getattr(user, "memberships", None) or []
+                        if getattr(m, "project", None) is not None
+                    ],
+                }
+                self._data["user"] = entry
+                self._save()
+            return [Membership(*m) for m in entry["memberships"]]
+
+    def user_id(self):
+        with self._lock:
+            self.memberships()
+            return self._data["user"]["id"]
+
+    def user_projects(self):
+        """Progetti su cui l'utente corrente è abilitato, in ordine di nome."""
+        projects = self.projects()
+        found = []
+        for membership in self.memberships():
+            project = projects.get(membership.project_id)
+            if project is None:
+                project = ProjectInfo(membership.project_id, None, membership.project_name, None)
+            found.append(project)
+        return sorted(found, key=lambda p: (p.name or "").lower())
+
+    # --- progetti ------------------------------------------------------------
+
+    def projects(self, refresh=False):
+        """Tutti i progetti visibili come {id: `ProjectInfo`}."""
+        with self._lock:
+            entry = self._data["projects"]
+            if refresh or not self._fresh(entry):
+                items = []
+                for project in self._client().project.all():
+                    parent = getattr(project, "parent", None)
+                    items.append([project.id, getattr(project, "identifier", None),
+                                  getattr(project, "name", None), getattr(parent, "id", None),
+                                  _timestamp(getattr(project, "updated_on", None))])
+                entry = {"fetched": time.time(), "items": items}
+                self._data["projects"] = entry
+                self._save()
+            if self._projects is None or self._projects[0] is not entry:
+                projects = {item[0]: ProjectInfo(*item) for item in entry["items"]}
+                index = {}
+                for project in projects.values():
+                    for alias in (project.name, project.identifier, project.id):
+                        if alias is not None:
+                            index[str(alias)] = project
+                self._projects = (entry, projects, index)
+            return self._projects[1]
+
+    def find_project(self, key):
+        """`ProjectInfo` per id, identificatore o nome; None se non esiste."""
+        if key is None:
+            return None
+        with self._lock:
+            self.projects()
+            return self._projects[2].get(str(key))
+
+    # --- categorie e membri --------------------------------------------------
+
+    def _fetch_details(self, project_id):
+        client = self._client()
+        categories = {c.id: c.name for c in client.issue_category.filter(project_id=project_id)}
+        members = {}
+        roles = {}
+        for membership in client.project_membership.filter(project_id=project_id):
+            principal = getattr(membership, "user", None) or getattr(membership, "group", None)
+            if principal is not None:
+                members[principal.id] = getattr(principal, "name", None)
+                roles.setdefault(principal.id, set()).update(
+                    role.id for role in getattr(membership, "roles", None) or [])
+        return categories, members, {k: sorted(v) for k, v in roles.items()}
+
+    def _assignable_roles(self, role_ids):
+        """{role_id: bool} per i ruoli indicati; un ruolo non leggibile conta come assegnabile."""
+        with self._lock:
+            roles = self._data["roles"]
+            stale = [rid for rid in role_ids if not self._fresh(roles.get(str(rid)))]
+        if stale:
+            fetched = {}
+            for rid in stale:
+                try:
+                    fetched[rid] = bool(getattr(self._client().role.get(rid), "assignable", True))
+                except Exception as e:
+                    logger.warning("Could not load role %s, assuming it is assignable: %s", rid, e)
+                    fetched[rid] = True
+            with self._lock:
+                now = time.time()
+                for rid, assignable in fetched.items():
+                    self._data["roles"][str(rid)] = {"fetched": now, "assignable": assignable}
+                self._save()
+        with self._lock:
+            return {rid: self._data["roles"].get(str(rid), {}).get("assignable", True) for rid in role_ids}
+
+    def details(self, project_ids, refresh=False):
+        """Categorie, membri e membri assegnabili dei progetti indicati come {id: `ProjectDetails`}.
+
+        Le voci scadute (TTL o `updated_on` del progetto cambiato) sono
+        aggiornate in parallelo con `concurrency` richieste alla volta; un
+        progetto non leggibile (es. senza permessi) è omesso dal risultato.
+        """
+        project_ids = [int(pid) for pid in project_ids]
+        projects = self.projects()
+        with self._lock:
+            stale = []
+            for pid in project_ids:
+                entry = self._data["details"].get(str(pid))
+                updated_on = projects[pid].updated_on if pid in projects else None
+                if refresh or not self._fresh(entry) or entry.get("updated_on") != updated_on:
+                    stale.append(pid)
+        if stale:
+            fetched = {}
+            with ThreadPoolExecutor(max_workers=min(self.concurrency, len(stale)),
+                                    thread_name_prefix="metadata") as executor:
+                futures = {pid: executor.submit(self._fetch_details, pid) for pid in stale}
+                for pid, future in futures.items():
+                    try:
+                        fetched[pid] = future.result()
+                    except Exception as e:
+                        logger.warning("Could not load metadata of project %s: %s", pid, e)
+            with self._lock:
+                now = time.time()
+                for pid, (categories, members, roles) in fetched.items():
+                    self._data["details"][str(pid)] = {
+                        "fetched": now,
+                        "updated_on": projects[pid].updated_on if pid in projects else None,
+                        "categories": [[k, v] for k, v in categories.items()],
+                        "members": [[k, v] for k, v in members.items()],
+                        "roles": [[k, v] for k, v in roles.items()],
+                    }
+                self._save()
+        with self._lock:
+            entries = {pid: self._data["details"].get(str(pid)) for pid in project_ids}
+            entries = {pid: entry for pid, entry in entries.items() if entry is not None}
+        role_ids = sorted({rid for entry in entries.values() for _, rids in entry["roles"] for rid in rids})
+        assignable_roles = self._assignable_roles(role_ids)
+        result = {}
+        for pid, entry in entries.items():
+            assignable = {member for member, rids in entry["roles"] if any(assignable_roles[r] for r in rids)}
+            result[pid] = ProjectDetails(dict(entry["categories"]), dict(entry["members"]), assignable)
+        return result
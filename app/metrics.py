@@ -0,0 +1,206 @@
+"""
+Metriche di esecuzione della pipeline.
+
+`StageTimer` misura le fasi di un singolo ticket ed è picklable, così i
+tempi raccolti in un worker del process pool tornano al processo principale
+insieme all'archivio. `RunMetrics` aggrega i tempi di tutto il run
+(istogrammi per fase, esiti dei ticket, byte caricati, ticket più lenti) e a
+fine run li scrive nella directory di output in formato Prometheus (text
+exposition, adatto al textfile collector di node_exporter) o JSON.
+"""
+
+import heapq
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Estremi superiori (secondi) dei bucket degli istogrammi per fase
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+FORMATS = ("prometheus", "json", "none")
+
+
+class StageTimer:
+    """Durate delle fasi di un ticket (nome fase -> secondi)."""
+
+    def __init__(self):
+        self.durations = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.durations[name] = self.durations.get(name, 0.0) + time.perf_counter() - start
+
+
+class _Histogram:
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.total += seconds
+        self.count += 1
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+
+    def cumulative(self):
+        running = 0
+        out = []
+        for n in self.counts:
+            running += n
+            out.append(running)
+        return out
+
+
+class RunMetrics:
+    """Metriche aggregate di un run; thread-safe (le fasi di I/O girano in altri thread)."""
+
+    def __init__(self, slowest=10):
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._outcomes = {}
+        self._slowest = []      # min-heap (secondi, ticket_id, durate per fase)
+        self._slowest_size = max(0, int(slowest))
+        self._gauges = {}       # (nome, etichette) -> valore
+        self._counters = {}
+        self.bytes_uploaded = 0
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            self._histograms.setdefault(stage, _Histogram()).observe(seconds)
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def record_ticket(self, ticket_id, durations):
+        """Registra le fasi di un ticket (vedi `StageTimer.durations`)."""
+        for stage, seconds in durations.items():
+            self.observe(stage, seconds)
+        total = sum(durations.values())
+        with self._lock:
+            if not self._slowest_size:
+                return
+            entry = (total, ticket_id, dict(durations))
+            if len(self._slowest) < self._slowest_size:
+                heapq.heappush(self._slowest, entry)
+            elif total > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, entry)
+
+    def count(self, outcome, amount=1):
+        with self._lock:
+            self._outcomes[outcome] = self._outcomes.get(outcome, 0) + amount
+
+    def gauge(self, name, value, **labels):
+        """Imposta una metrica istantanea aggiuntiva (es. profondità di un pool)."""
+        with self._lock:
+            self._gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def counter(self, name, amount=1, **labels):
+        """Incrementa un contatore aggiuntivo del run."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def add_bytes_uploaded(self, amount):
+        with self._lock:
+            self.bytes_uploaded += amount
+
+    def snapshot(self):
+        """Metriche correnti come dizionario serializzabile in JSON."""
+        with self._lock:
+            stages = {
+                name: {
+                    "count": h.count,
+                    "sum_seconds": h.total,
+                    "buckets": dict(zip([str(b) for b in BUCKETS] + ["+Inf"], h.cumulative() + [h.count])),
+                }
+                for name, h in sorted(self._histograms.items())
+            }
+            slowest = [
+                {"ticket_id": ticket_id, "seconds": total, "stages": durations}
+                for total, ticket_id, durations in sorted(self._slowest, reverse=True)
+            ]
+            extra = {}
+            for kind, values in (("gauges", self._gauges), ("counters", self._counters)):
+                extra[kind] = {}
+                for (name, labels), value in sorted(values.items()):
+                    extra[kind].setdefault(name, []).append({"labels": dict(labels), "value": value})
+            return {
+                "started": self.started,
+                "duration_seconds": time.perf_counter() - self._start,
+                "tickets": dict(sorted(self._outcomes.items())),
+                "bytes_uploaded": self.bytes_uploaded,
+                "stages": stages,
+                "slowest_tickets": slowest,
+                **extra,
+            }
+
+    def to_prometheus(self):
+        snap = self.snapshot()
+        lines = [
+            "# HELP packer_stage_duration_seconds Durata delle fasi della pipeline per ticket.",
+            "# TYPE packer_stage_duration_seconds histogram",
+        ]
+        for stage, h in snap["stages"].items():
+            for bound, value in h["buckets"].items():
+                lines.append(f'packer_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {value}')
+            lines.append(f'packer_stage_duration_seconds_sum{{stage="{stage}"}} {h["sum_seconds"]:.6f}')
+            lines.append(f'packer_stage_duration_seconds_count{{stage="{stage}"}} {h["count"]}')
+        lines += [
+            "# HELP packer_tickets_total Ticket elaborati nel run per esito.",
+            "# TYPE packer_tickets_total counter",
+        ]
+        for outcome, value in snap["tickets"].items():
+            lines.append(f'packer_tickets_total{{outcome="{outcome}"}} {value}')
+        lines += [
+            "# HELP packer_bytes_uploaded_total Byte di archivi caricati su Redmine nel run.",
+            "# TYPE packer_bytes_uploaded_total counter",
+            f"packer_bytes_uploaded_total {snap['bytes_uploaded']}",
+            "# HELP packer_run_duration_seconds Durata complessiva del run.",
+            "# TYPE packer_run_duration_seconds gauge",
+            f"packer_run_duration_seconds {snap['duration_seconds']:.6f}",
+            "# HELP packer_run_timestamp_seconds Inizio dell'ultimo run (epoch).",
+            "# TYPE packer_run_timestamp_seconds gauge",
+            f"packer_run_timestamp_seconds {snap['started']:.3f}",
+            "# HELP packer_slowest_ticket_seconds Ticket più lenti del run (somma delle fasi).",
+            "# TYPE packer_slowest_ticket_seconds gauge",
+        ]
+        for entry in snap["slowest_tickets"]:
+            lines.append(f'packer_slowest_ticket_seconds{{ticket="{entry["ticket_id"]}"}} {entry["seconds"]:.6f}')
+        for kind, suffix, prom_type in (("gauges", "", "gauge"), ("counters", "_total", "counter")):
+            for name, samples in snap[kind].items():
+                lines.append(f"# TYPE packer_{name}{suffix} {prom_type}")
+                for sample in samples:
+                    labels = ",".join(f'{k}="{v}"' for k, v in sample["labels"].items())
+                    lines.append(f"packer_{name}{suffix}{{{labels}}} {sample['value']}" if labels
+                                 else f"packer_{name}{suffix} {sample['value']}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path, fmt="prometheus"):
+        """Scrive le metriche in `path` in modo atomico (file temporaneo + rename)."""
+        if fmt == "none":
+            return None
+        if fmt not in FORMATS:
+            raise ValueError(f"Formato metriche non supportato: {fmt} (disponibili: {', '.join(FORMATS)})")
+        payload = self.to_prometheus() if fmt == "prometheus" else json.dumps(self.snapshot(), indent=2) + "\n"
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+        return path
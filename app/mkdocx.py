@@ -2,9 +2,14 @@
 # -*- coding: utf-8 -*-
 
 import argparse
-from docx import Document
-from docx.oxml import parse_xml
-from docx.oxml.ns import nsdecls
+import copy
+import io
+import os
+
+import config
+
+# python-docx è importato nelle funzioni, al primo uso, per non pesare
+# sull'avvio dei comandi che non generano DOCX
 
 # Costanti (EMU)
 EMU_PER_INCH = 914400
@@ -20,8 +25,27 @@ POS_Y = 129857  # come nel frammento "corretto"
 # relativeHeight richiesto
 REL_HEIGHT = 251661312
 
+# Namespace del run di ancoraggio (prefisso -> URI)
+NAMESPACES = {
+    "w": "http://schemas.openxmlformats.org/wordprocessingml/2006/main",
+    "r": "http://schemas.openxmlformats.org/officeDocument/2006/relationships",
+    "wp": "http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing",
+    "a": "http://schemas.openxmlformats.org/drawingml/2006/main",
+    "pic": "http://schemas.openxmlformats.org/drawingml/2006/picture",
+    "wp14": "http://schemas.microsoft.com/office/word/2010/wordprocessingDrawing",
+}
+
+# Motori di generazione: "splice" innesta il run nel template senza
+# riparsarlo (vedi docx_splice), "python-docx" passa dall'albero lxml
+DOCX_ENGINES = ("splice", "python-docx")
+
+# Cache dei template parsati: percorso risolto -> (mtime_ns, Document, docpr_id)
+_TEMPLATE_CACHE = {}
+# Run di ancoraggio parsato una sola volta (vedi _anchor_element)
+_ANCHOR_PROTOTYPE = None
 
-def _next_docpr_id(doc: Document) -> int:
+
+def _next_docpr_id(doc) -> int:
     """
     Trova un id libero per wp:docPr evitando collisioni.
     """
@@ -40,22 +64,21 @@ def _next_docpr_id(doc: Document) -> int:
     return i
 
 
-def add_body_background_anchor(paragraph, image_path: str, docpr_id: int):
+def _anchor_xml(r_id, docpr_id, prefixes=None) -> str:
     """
-    Inserisce l'immagine come oggetto floating (wp:anchor) nel BODY,
+    XML del run con l'immagine come oggetto floating (wp:anchor) nel BODY,
     behind text, posizionata:
       - H: relativeFrom="column", offset 0
       - V: relativeFrom="paragraph", offset 129857
     con dimensioni CX/CY.
-    """
-    # Crea la relationship per l'immagine e ottiene rId
-    rId, _ = paragraph.part.get_or_add_image(image_path)
 
-    # nsdecls doesn't include the Word 2010 "wp14" prefix by default,
-    # so append its declaration explicitly.
-    ns = nsdecls('w', 'r', 'wp', 'a', 'pic') + ' xmlns:wp14="http://schemas.microsoft.com/office/word/2010/wordprocessingDrawing"'
+    `prefixes` limita le dichiarazioni di namespace sul run a quelle non
+    già presenti nel documento (default: tutte, vedi `NAMESPACES`).
+    """
+    ns = " ".join(f'xmlns:{prefix}="{NAMESPACES[prefix]}"'
+                  for prefix in (NAMESPACES if prefixes is None else prefixes))
 
-    anchor_xml = f"""
+    return f"""
     <w:r {ns}>
       <w:drawing>
         <wp:anchor distT="0" distB="0" distL="0" distR="0"
@@ -93,7 +116,7 @@ def add_body_background_anchor(paragraph, image_path: str, docpr_id: int):
                 </pic:nvPicPr>
 
                 <pic:blipFill>
-                  <a:blip r:embed="{rId}"/>
+                  <a:blip r:embed="{r_id}"/>
                   <a:stretch>
                     <a:fillRect/>
                   </a:stretch>
@@ -124,7 +147,104 @@ def add_body_background_anchor(paragraph, image_path: str, docpr_id: int):
     </w:r>
     """
 
-    paragraph._p.append(parse_xml(anchor_xml))
+
+def _anchor_element(r_id, docpr_id):
+    """
+    Restituisce una copia del run di ancoraggio già parsato una sola volta,
+    con rId e id del docPr impostati.
+    """
+    global _ANCHOR_PROTOTYPE
+    from docx.oxml import parse_xml
+    from docx.oxml.ns import qn
+
+    if _ANCHOR_PROTOTYPE is None:
+        _ANCHOR_PROTOTYPE = parse_xml(_anchor_xml("rIdPlaceholder", 0))
+    run = copy.deepcopy(_ANCHOR_PROTOTYPE)
+    run.xpath(".//wp:docPr")[0].set("id", str(docpr_id))
+    run.xpath(".//a:blip")[0].set(qn("r:embed"), r_id)
+    return run
+
+
+def add_body_background_anchor(paragraph, image_path, docpr_id: int):
+    """
+    Inserisce l'immagine come oggetto floating (wp:anchor) nel BODY,
+    behind text (vedi `_anchor_xml`).
+
+    `image_path` può essere un percorso o un file-like object.
+    """
+    # Crea la relationship per l'immagine e ottiene rId
+    rId, _ = paragraph.part.get_or_add_image(image_path)
+    paragraph._p.append(_anchor_element(rId, docpr_id))
+
+
+def _load_template(template_path):
+    """
+    Restituisce (copia del Document, docpr_id libero) per il template.
+
+    Il template parsato viene tenuto in cache per percorso risolto e
+    invalidato quando cambia l'mtime del file; ogni chiamata riceve una
+    deepcopy indipendente, molto più economica di un nuovo parse.
+    """
+    path = os.path.realpath(template_path)
+    mtime = os.stat(path).st_mtime_ns
+    cached = _TEMPLATE_CACHE.get(path)
+    if cached is None or cached[0] != mtime:
+        from docx import Document
+
+        doc = Document(path)
+        cached = (mtime, doc, _next_docpr_id(doc))
+        _TEMPLATE_CACHE[path] = cached
+    return copy.deepcopy(cached[1]), cached[2]
+
+
+def clear_template_cache():
+    from docx_splice import clear_template_cache as clear_splice_cache
+
+    _TEMPLATE_CACHE.clear()
+    clear_splice_cache()
+
+
+def _read_image(image_path):
+    if hasattr(image_path, "read"):
+        return image_path.read()
+    with open(image_path, "rb") as f:
+        return f.read()
+
+
+def build_docx(template_path, image_path, out_path, paragraph_index=0, engine=None):
+    """
+    Genera `out_path` a partire da `template_path` inserendo `image_path`
+    come sfondo del paragrafo `paragraph_index` (default: primo).
+
+    Con il motore `splice` (default, `templates.docx_engine`) il template è
+    indicizzato una volta e ogni DOCX è scritto copiando i membri invariati;
+    i template o le immagini che lo splice non gestisce passano da
+    python-docx, come con `engine="python-docx"`.
+    """
+    engine = (engine or config.DOCX_ENGINE or "splice").lower()
+    if engine not in DOCX_ENGINES:
+        raise ValueError(f"Motore DOCX non supportato: {engine} (disponibili: {', '.join(DOCX_ENGINES)})")
+    if engine == "splice":
+        from docx_splice import splice_docx
+
+        image = _read_image(image_path)
+        if splice_docx(template_path, image, out_path, paragraph_index):
+            return out_path
+        image_path = io.BytesIO(image)
+
+    doc, docpr_id = _load_template(template_path)
+
+    # Paragrafo target (default: primo)
+    paragraphs = doc.paragraphs
+    if paragraphs:
+        idx = max(0, min(paragraph_index, len(paragraphs) - 1))
+        p = paragraphs[idx]
+    else:
+        p = doc.add_paragraph("")
+
+    add_body_background_anchor(p, image_path, docpr_id)
+    doc.save(out_path)
+    return out_path
 
 
 def main():
@@ -136,21 +256,11 @@ def main():
     ap.add_argument("--out", required=True, help="DOCX di output.")
     ap.add_argument("--paragraph-index", type=int, default=0,
                     help="Indice del paragrafo in cui inserire l'anchor (default: 0).")
+    ap.add_argument("--engine", choices=DOCX_ENGINES, default=None,
+                    help="Motore di generazione (default: templates.docx_engine, altrimenti splice).")
     args = ap.parse_args()
 
-    doc = Document(args.template)
-
-    # Paragrafo target (default: primo)
-    if doc.paragraphs:
-        idx = max(0, min(args.paragraph_index, len(doc.paragraphs) - 1))
-        p = doc.paragraphs[idx]
-    else:
-        p = doc.add_paragraph("")
-
-    docpr_id = _next_docpr_id(doc)
-    add_body_background_anchor(p, args.image, docpr_id)
-
-    doc.save(args.out)
+    build_docx(args.template, args.image, args.out, args.paragraph_index, args.engine)
 
 
 if __name__ == "__main__":
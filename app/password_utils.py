@@ -1,8 +1,7 @@
-from PIL import Image, ImageDraw, ImageFont
 import secrets
 import string
 import os
-from config import FONT_PATH
+import config
 
 def rimuovi_caratteri(stringa_originale, caratteri_da_rimuovere):
     """
@@ -23,30 +22,192 @@ def rimuovi_caratteri(stringa_originale, caratteri_da_rimuovere):
 
 
 
-def genera_password(lunghezza=12):
-    charset = string.ascii_letters + string.digits + string.punctuation
-    charset = rimuovi_caratteri(charset, '0`\\')
-    return ''.join(secrets.choice(charset) for _ in range(lunghezza))
+DEFAULT_CHARSET = string.ascii_letters + string.digits + string.punctuation
+DEFAULT_EXCLUDE = '0`\\'
+DEFAULT_LENGTH = 12
 
-def crea_immagine(password, ticket_id, img_dir):
-    os.makedirs(img_dir, exist_ok=True)
-    IMG_SIZE = (400, 100)
-    img_path = os.path.join(img_dir, f'ticket_{ticket_id}_base.png')
-    img = Image.new('1', IMG_SIZE, color=1)
-    draw = ImageDraw.Draw(img)
+# Classi di caratteri per `min_per_class`
+CHAR_CLASSES = {
+    'lower': string.ascii_lowercase,
+    'upper': string.ascii_uppercase,
+    'digits': string.digits,
+    'punctuation': string.punctuation,
+}
+
+
+class PasswordGenerator:
+    """Generatore di password costruito una volta a partire da una policy.
+
+    Il charset viene filtrato una sola volta; i caratteri sono estratti da
+    letture bulk del CSPRNG (`secrets.token_bytes`) con rejection sampling:
+    i byte >= multiplo massimo della dimensione del charset vengono scartati,
+    così `byte % len(charset)` resta uniforme.
+    """
+
+    def __init__(self, length=DEFAULT_LENGTH, charset=DEFAULT_CHARSET, exclude=DEFAULT_EXCLUDE,
+                 min_per_class=None):
+        self.length = int(length)
+        self.charset = rimuovi_caratteri(charset, exclude or '')
+        # dict.fromkeys preserva l'ordine ed elimina i duplicati
+        self.charset = ''.join(dict.fromkeys(self.charset))
+        self.min_per_class = {k: int(v) for k, v in (min_per_class or {}).items() if v}
+
+        if self.length < 1:
+            raise ValueError(f"Password policy non valida: length deve essere >= 1 (got {self.length})")
+        if not self.charset or len(self.charset) > 256 or not self.charset.isascii():
+            raise ValueError("Password policy non valida: charset vuoto o non ASCII")
+        for cls, count in self.min_per_class.items():
+            if cls not in CHAR_CLASSES:
+                raise ValueError(
+                    f"Password policy non valida: classe '{cls}' sconosciuta "
+                    f"(disponibili: {', '.join(CHAR_CLASSES)})"
+                )
+            if not set(CHAR_CLASSES[cls]) & set(self.charset):
+                raise ValueError(f"Password policy non valida: nessun carattere '{cls}' nel charset")
+        if sum(self.min_per_class.values()) > self.length:
+            raise ValueError("Password policy non valida: min_per_class supera la lunghezza")
+
+        size = len(self.charset)
+        limit = 256 - (256 % size)
+        self._table = bytes(ord(self.charset[b % size]) if b < limit else 0 for b in range(256))
+        self._reject = bytes(range(limit, 256))
+        self._classes = [(frozenset(CHAR_CLASSES[cls]), count) for cls, count in self.min_per_class.items()]
+
+    @classmethod
+    def from_policy(cls, policy=None):
+        """Costruisce il generatore da un dict di policy (vedi `password_policy` in config)."""
+        policy = dict(policy or {})
+        return cls(
+            length=policy.get('length', DEFAULT_LENGTH),
+            charset=policy.get('charset', DEFAULT_CHARSET),
+            exclude=policy.get('exclude', DEFAULT_EXCLUDE),
+            min_per_class=policy.get('min_per_class'),
+        )
+
+    def _random_chars(self, count):
+        out = bytearray()
+        while len(out) < count:
+            need = count - len(out)
+            out += secrets.token_bytes(need + (need >> 2) + 16).translate(self._table, self._reject)
+        return out[:count].decode('ascii')
+
+    def _acceptable(self, password):
+        return all(sum(1 for c in password if c in chars) >= count for chars, count in self._classes)
+
+    def generate(self):
+        return self.generate_many(1)[0]
+
+    def generate_many(self, n):
+        """Restituisce `n` password; le password che non rispettano `min_per_class` vengono riestratte."""
+        passwords = []
+        while len(passwords) < n:
+            missing = n - len(passwords)
+            chars = self._random_chars(missing * self.length)
+            for i in range(missing):
+                candidate = chars[i * self.length:(i + 1) * self.length]
+                if self._acceptable(candidate):
+                    passwords.append(candidate)
+        return passwords
+
+
+_GENERATORS = {}
+
+
+def get_password_generator(policy=None):
+    """Generatore per `policy`, costruito una sola volta per processo."""
+    key = repr(sorted((policy or {}).items()))
+    generator = _GENERATORS.get(key)
+    if generator is None:
+        generator = _GENERATORS[key] = PasswordGenerator.from_policy(policy)
+    return generator
+
+
+def genera_password(lunghezza=12, policy=None):
+    if policy is None:
+        policy = {'length': lunghezza}
+    return get_password_generator(policy).generate()
+
+IMG_SIZE = (400, 100)
+MAX_FONT_SIZE = 80
+MIN_FONT_SIZE = 11
+# Margine (px) della stima lineare: hinting e kerning spostano la larghezza
+# reale di meno di un pixel per carattere rispetto allo scaling lineare.
+_FIT_SLACK = 4
+
+_FONT_CACHE = {}
+_ADVANCE_CACHE = {}
+
+
+def _font(size):
+    """Font TrueType per `size`, caricato una sola volta per processo."""
+    font = _FONT_CACHE.get(size)
+    if font is None:
+        from PIL import ImageFont
 
-    for size in range(80, 10, -1):
         try:
-            font = ImageFont.truetype(FONT_PATH, size)
+            font = ImageFont.truetype(config.FONT_PATH, size)
         except:
             font = ImageFont.load_default()
-        bbox = draw.textbbox((0, 0), password, font=font)
-        w, h = bbox[2] - bbox[0], bbox[3] - bbox[1]
-        if w < IMG_SIZE[0] - 10 and h < IMG_SIZE[1] - 10:
+        _FONT_CACHE[size] = font
+    return font
+
+
+def _advance(size, char):
+    """Avanzamento (px) di `char` a `size`, da tabella per dimensione."""
+    table = _ADVANCE_CACHE.setdefault(size, {})
+    adv = table.get(char)
+    if adv is None:
+        adv = table[char] = _font(size).getlength(char, mode='1')
+    return adv
+
+
+def _fits(draw, password, size):
+    bbox = draw.textbbox((0, 0), password, font=_font(size))
+    w, h = bbox[2] - bbox[0], bbox[3] - bbox[1]
+    return w < IMG_SIZE[0] - 10 and h < IMG_SIZE[1] - 10, w, h
+
+
+def _start_size(password):
+    """Dimensione massima da cui può partire la ricerca del font.
+
+    Stima la larghezza per scaling lineare delle tabelle di avanzamento alla
+    dimensione massima e scarta solo le dimensioni che eccedono il limite
+    anche tenendo conto del margine: il risultato è lo stesso della scansione
+    completa da MAX_FONT_SIZE, ma con 1-3 misure invece di fino a 70.
+    """
+    from PIL import ImageFont
+
+    if not isinstance(_font(MAX_FONT_SIZE), ImageFont.FreeTypeFont):
+        return MAX_FONT_SIZE
+    ref_width = sum(_advance(MAX_FONT_SIZE, c) for c in password)
+    if ref_width <= 0:
+        return MAX_FONT_SIZE
+    slack = len(password) + _FIT_SLACK
+    limit = IMG_SIZE[0] - 10 + slack
+    size = int(limit * MAX_FONT_SIZE / ref_width)
+    return max(MIN_FONT_SIZE, min(MAX_FONT_SIZE, size))
+
+
+def render_password_image(password):
+    """Restituisce l'immagine base (1 bit, 400x100) con la password centrata."""
+    # Pillow importato al primo uso: la sola generazione delle password non lo richiede
+    from PIL import Image, ImageDraw
+
+    img = Image.new('1', IMG_SIZE, color=1)
+    draw = ImageDraw.Draw(img)
+
+    for size in range(_start_size(password), MIN_FONT_SIZE - 1, -1):
+        fits, w, h = _fits(draw, password, size)
+        if fits:
             break
 
     x = (IMG_SIZE[0] - w) // 2
     y = (IMG_SIZE[1] - h) // 2
-    draw.text((x, y), password, font=font, fill=0)
-    img.save(img_path)
+    draw.text((x, y), password, font=_font(size), fill=0)
+    return img
+
+def crea_immagine(password, ticket_id, img_dir):
+    os.makedirs(img_dir, exist_ok=True)
+    img_path = os.path.join(img_dir, f'ticket_{ticket_id}_base.png')
+    render_password_image(password).save(img_path)
     return img_path
@@ -0,0 +1,93 @@
+"""
+Stadio di I/O Redmine asincrono.
+
+Le fasi CPU-bound (immagini, DOCX, archivio) restano nel thread principale o
+nel process pool; gli upload e gli aggiornamenti delle issue vengono passati a
+questo stadio, che li esegue in concorrenza (fino a `redmine.io_concurrency`)
+su un event loop asyncio dedicato. Il tempo totale di un batch tende così a
+max(CPU, rete) invece che alla loro somma.
+
+python-redmine è sincrono: ogni chiamata gira in un executor di thread
+dimensionato sul limite di concorrenza, condividendo il pool di connessioni
+keep-alive di `http_engine.PackerEngine`.
+"""
+
+import asyncio
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class RedmineIOStage:
+    """Esegue chiamate Redmine bloccanti in concorrenza limitata.
+
+    `submit()` è chiamato dal thread produttore e si blocca quando ci sono già
+    `max_pending` operazioni in coda o in corso (backpressure: in modalità
+    memoria ogni operazione in attesa trattiene un archivio).
+    Uso tipico:
+
+        with RedmineIOStage() as io_stage:
+            io_stage.submit(_publish_ticket, ticket_id, archive, cfg)
+    """
+
+    def __init__(self, concurrency=None, max_pending=None):
+        self.concurrency = max(1, int(concurrency or config.REDMINE_IO_CONCURRENCY))
+        self._pending = threading.BoundedSemaphore(max_pending or self.concurrency * 2)
+        self._futures = set()
+        self._futures_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="redmine-io")
+        self._loop = asyncio.new_event_loop()
+        self._loop.set_default_executor(self._executor)
+        self._limit = asyncio.Semaphore(self.concurrency)
+        self._thread = threading.Thread(target=self._loop.run_forever, name="redmine-io-loop", daemon=True)
+        self._thread.start()
+
+    async def _call(self, fn, args, kwargs):
+        async with self._limit:
+            return await self._loop.run_in_executor(None, functools.partial(fn, *args, **kwargs))
+
+    def _release(self, future):
+        with self._futures_lock:
+            self._futures.discard(future)
+        self._pending.release()
+        if not future.cancelled() and future.exception() is not None:
+            # Gli errori per ticket sono gestiti dal chiamante: qui solo traccia
+            logger.debug("Redmine I/O task failed: %s", future.exception())
+
+    def submit(self, fn, *args, **kwargs):
+        """Accoda `fn(*args, **kwargs)`; restituisce un `concurrent.futures.Future`."""
+        self._pending.acquire()
+        future = asyncio.run_coroutine_threadsafe(self._call(fn, args, kwargs), self._loop)
+        with self._futures_lock:
+            self._futures.add(future)
+        future.add_done_callback(self._release)
+        return future
+
+    def close(self):
+        """Attende il completamento delle operazioni accodate e ferma l'event loop."""
+        while True:
+            with self._futures_lock:
+                pending = list(self._futures)
+            if not pending:
+                break
+            for future in pending:
+                try:
+                    future.result()
+                except Exception:
+                    pass
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
@@ -1,26 +1,191 @@
-from redminelib import Redmine
-from redminelib.exceptions import ValidationError
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import hashlib
 import logging
 import os
-from config import REDMINE_URL, API_KEY
+import threading
+import config
+from metadata import MetadataDirectory, metadata_path
 
-redmine = Redmine(REDMINE_URL, key=API_KEY)
 logger = logging.getLogger(__name__)
 
-def get_tickets_nuovi():
-    logger.debug("Querying Redmine for assigned_to_id='me', status_id='1'")
-    return redmine.issue.filter(assigned_to_id='me', status_id='1')  # 1 = "Nuovo"
 
+def _build_client(url=None, key=None):
+    # python-redmine (e requests) importati al primo uso: non pesano
+    # sull'avvio di chi non parla con Redmine (--help, benchmark, ...)
+    from redminelib import Redmine
+    from http_engine import PackerEngine
 
-def attach_and_update(issue_id, archive_path, assign_to_id=None, status_id=None, notes=None, category_id=None):
-    """Allega `archive_path` all'issue e aggiorna campi issue se forniti."""
-    logger.debug("Uploading archive for issue %s: %s", issue_id, archive_path)
-    with open(archive_path, 'rb') as f:
-        upload = redmine.upload(f)
+    return Redmine(url or config.REDMINE_URL, key=key or config.API_KEY, engine=PackerEngine,
+                   http=config.REDMINE_HTTP)
+
+
+# Client condiviso, creato alla prima richiesta (vedi `_client`)
+redmine = None
+# Directory dei metadati del server corrente (vedi `get_metadata`)
+_metadata = None
+
+
+def _client():
+    global redmine
+    if redmine is None:
+        redmine = _build_client()
+    return redmine
+
+
+def _build_metadata(url=None, key=None, directory=None):
+    path = metadata_path(directory, url or config.REDMINE_URL, key or config.API_KEY) if directory else None
+    return MetadataDirectory(path, _client, ttl=config.METADATA_TTL, concurrency=config.METADATA_CONCURRENCY)
+
+
+def configure_client(url=None, key=None, metadata_dir=None):
+    """Ricrea il client condiviso, ad esempio per puntare a un server di test.
+
+    `metadata_dir` sostituisce `metadata.dir` per la cache dei metadati del
+    nuovo server ("" per tenerli solo in memoria).
+    """
+    global redmine, _metadata
+    redmine = _build_client(url, key)
+    _metadata = _build_metadata(url, key, config.METADATA_DIR if metadata_dir is None else metadata_dir)
+    return redmine
+
+
+def get_metadata():
+    """`MetadataDirectory` condivisa del server configurato (progetti, categorie, membri)."""
+    global _metadata
+    if _metadata is None:
+        _metadata = _build_metadata(directory=config.METADATA_DIR)
+    return _metadata
+
+
+def get_lease_manager(mode=None):
+    """`LeaseManager` per il client condiviso, configurato dalla sezione `lease`.
+
+    `mode` sostituisce `lease.mode` (es. ``custom_field`` per eleggere chi
+    segnala i progetti mancanti senza cambiare lo stato dei ticket).
+    """
+    from lease import LeaseManager
+
+    return LeaseManager(_client, mode=mode or config.LEASE_MODE, owner=config.LEASE_OWNER, ttl=config.LEASE_TTL,
+                        status_id=config.LEASE_STATUS_ID, custom_field_id=config.LEASE_CUSTOM_FIELD_ID,
+                        settle=config.LEASE_SETTLE, concurrency=config.REDMINE_IO_CONCURRENCY)
+
+
+def get_http_stats():
+    """Contatori del layer HTTP (richieste, retry, connessioni aperte/riusate)."""
+    if redmine is None:
+        return {}
+    return redmine.engine.stats()
+
+# Record compatto con i soli campi usati dalla pipeline
+TicketRecord = namedtuple(
+    "TicketRecord",
+    ["id", "project_identifier", "project_name", "project_id", "updated_on"],
+    defaults=(None,),
+)
+
+# Formato dei timestamp dell'API REST di Redmine (UTC)
+REDMINE_TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+def _to_record(issue):
+    proj = getattr(issue, 'project', None)
+    updated_on = getattr(issue, 'updated_on', None)
+    if isinstance(updated_on, datetime):
+        updated_on = updated_on.strftime(REDMINE_TIME_FORMAT)
+    return TicketRecord(
+        issue.id,
+        getattr(proj, 'identifier', None),
+        getattr(proj, 'name', None),
+        getattr(proj, 'id', None),
+        updated_on,
+    )
+
+
+def _fetch_page(after_id, page_size, updated_since=None):
+    # Paginazione a cursore (id crescente) invece che per offset: i ticket
+    # risolti durante l'elaborazione escono dal filtro "Nuovo" e con gli
+    # offset farebbero saltare quelli successivi.
+    filters = {'assigned_to_id': 'me', 'status_id': '1', 'sort': 'id'}  # 1 = "Nuovo"
+    if after_id is not None:
+        filters['issue_id'] = f'>={after_id + 1}'
+    if updated_since:
+        filters['updated_on'] = f'>={updated_since}'
+    return [_to_record(issue) for issue in _client().issue.filter(limit=page_size, **filters)]
+
+
+def get_tickets_nuovi(page_size=None, updated_since=None):
+    """Itera i ticket "Nuovo" assegnati all'utente corrente come `TicketRecord`.
+
+    I ticket sono letti a pagine di `page_size` (default `redmine.page_size`):
+    la pagina successiva viene scaricata in background mentre il chiamante
+    elabora quella corrente, e in memoria restano al massimo due pagine.
+    Con `updated_since` (timestamp `REDMINE_TIME_FORMAT`) restituisce solo i
+    ticket aggiornati da quell'istante in poi.
+    """
+    page_size = page_size or config.REDMINE_PAGE_SIZE
+    logger.debug("Querying Redmine for assigned_to_id='me', status_id='1' (page size %d, updated since %s)",
+                 page_size, updated_since)
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="ticket-prefetch") as prefetch:
+        page = prefetch.submit(_fetch_page, None, page_size, updated_since).result()
+        while page:
+            following = None
+            if len(page) >= page_size:
+                following = prefetch.submit(_fetch_page, page[-1].id, page_size, updated_since)
+            yield from page
+            page = following.result() if following is not None else []
+
+
+def get_tickets_by_id(ticket_ids):
+    """`TicketRecord` dei ticket indicati che sono ancora "Nuovo" e assegnati
+    all'utente corrente (gli altri sono ignorati), in ordine di id."""
+    ids = sorted({int(ticket_id) for ticket_id in ticket_ids})
+    records = []
+    for start in range(0, len(ids), config.REDMINE_PAGE_SIZE):
+        chunk = ids[start:start + config.REDMINE_PAGE_SIZE]
+        filters = {'assigned_to_id': 'me', 'status_id': '1', 'sort': 'id',
+                   'issue_id': ",".join(str(ticket_id) for ticket_id in chunk)}
+        records.extend(_to_record(issue) for issue in _client().issue.filter(limit=len(chunk), **filters))
+    return records
+
+
+def get_projects():
+    """Tutti i progetti visibili all'utente corrente come {id: `ProjectInfo`}.
+
+    Serve a risalire la gerarchia dei sotto-progetti: le issue riportano solo
+    id e nome del proprio progetto. L'elenco viene dalla directory dei
+    metadati (vedi `get_metadata`), quindi è riletto da Redmine solo dopo
+    `metadata.ttl` secondi.
+    """
+    return get_metadata().projects()
+
+
+def attach_and_update(issue_id, archive_path, assign_to_id=None, status_id=None, notes=None, category_id=None,
+                      filename=None):
+    """Allega `archive_path` all'issue e aggiorna campi issue se forniti.
+
+    `archive_path` può essere anche un file-like object (es. `io.BytesIO`):
+    in quel caso `filename` è obbligatorio e nulla viene letto dal disco.
+    Restituisce True se l'assegnatario è stato rifiutato e l'aggiornamento
+    ripetuto senza riassegnazione.
+    """
+    from redminelib.exceptions import ValidationError
+
+    if hasattr(archive_path, 'read'):
+        if not filename:
+            raise ValueError("filename is required when uploading from a file-like object")
+        logger.debug("Uploading in-memory archive for issue %s: %s", issue_id, filename)
+        upload = _client().upload(archive_path, filename=filename)
+    else:
+        filename = filename or os.path.basename(archive_path)
+        logger.debug("Uploading archive for issue %s: %s", issue_id, archive_path)
+        with open(archive_path, 'rb') as f:
+            upload = _client().upload(f)
 
     uploads = [{
         'token': upload['token'],
-        'filename': os.path.basename(archive_path),
+        'filename': filename,
         'content_type': 'application/x-7z-compressed'
     }]
 
@@ -45,17 +210,117 @@ def attach_and_update(issue_id, archive_path, assign_to_id=None, status_id=None,
         len(uploads),
     )
     try:
-        redmine.issue.update(issue_id, **params)
+        _client().issue.update(issue_id, **params)
     except ValidationError as e:
         # Fallback: some projects reject the configured assignee
         # (e.g. user not member of that project). Retry without reassignment.
+        # Con `UpdatePlanner` succede solo se i metadati del progetto sono superati.
         err = str(e).lower()
         if assign_to_id and ('assigned' in err or 'assegnato' in err):
             print(f"[!] Assignee {assign_to_id} non valido per ticket {issue_id}: retry senza riassegnazione")
             params.pop('assigned_to_id', None)
-            redmine.issue.update(issue_id, **params)
-            return
+            _client().issue.update(issue_id, **params)
+            return True
         raise
+    return False
+
+
+class UpdatePlanner:
+    """Valida assegnatario e categoria di un aggiornamento prima di inviarlo.
+
+    Membri e categorie del progetto dell'issue sono letti dalla directory dei
+    metadati una volta per progetto e tenuti per tutta la vita del planner (un
+    run). Un assegnatario che non è membro del progetto con un ruolo
+    assegnabile (Redmine rifiuta gli altri con 422) è sostituito con
+    `fallback_assign_to_id`, se valido, altrimenti omesso; una categoria
+    inesistente è omessa. Ogni correzione è segnalata una sola volta per
+    progetto, così ogni ticket costa un solo aggiornamento.
+    """
+
+    def __init__(self, metadata=None):
+        self._metadata = metadata
+        self._lock = threading.Lock()
+        self._project_locks = {}
+        self._details = {}      # project_id -> ProjectDetails, None se non disponibili
+        self._reported = set()
+
+    def _project(self, project_id):
+        with self._lock:
+            if project_id in self._details:
+                return self._details[project_id]
+            project_lock = self._project_locks.setdefault(project_id, threading.Lock())
+        # Un solo caricamento per progetto anche con più upload in parallelo
+        with project_lock:
+            with self._lock:
+                if project_id in self._details:
+                    return self._details[project_id]
+            try:
+                details = (self._metadata or get_metadata()).details([project_id]).get(project_id)
+            except Exception as e:
+                logger.warning("Could not load members/categories of project %s: %s", project_id, e)
+                details = None
+            with self._lock:
+                self._details[project_id] = details
+            return details
+
+    def _report(self, project_id, field, value, replacement):
+        with self._lock:
+            if (project_id, field, value) in self._reported:
+                return
+            self._reported.add((project_id, field, value))
+        action = f"uso {replacement}" if replacement is not None else "campo omesso"
+        logger.warning("Project %s: %s %s is not valid, %s", project_id, field, value,
+                       f"using {replacement}" if replacement is not None else "field dropped")
+        print(f"[!] Progetto {project_id}: {field} {value} non valido, {action} (verificare la configurazione)")
+
+    def plan(self, project_id, assign_to_id=None, category_id=None, fallback_assign_to_id=None):
+        """Restituisce (assign_to_id, category_id) validi per il progetto.
+
+        Senza `project_id` o se membri e categorie non sono leggibili i valori
+        sono restituiti invariati.
+        """
+        if project_id is None or (assign_to_id in (None, '') and category_id in (None, '')):
+            return assign_to_id, category_id
+        details = self._project(int(project_id))
+        if details is None:
+            return assign_to_id, category_id
+        if assign_to_id not in (None, '') and int(assign_to_id) not in details.assignable:
+            replacement = None
+            if fallback_assign_to_id not in (None, '') and int(fallback_assign_to_id) in details.assignable:
+                replacement = fallback_assign_to_id
+            self._report(project_id, "assigned_to_id", assign_to_id, replacement)
+            assign_to_id = replacement
+        if category_id not in (None, '') and int(category_id) not in details.categories:
+            self._report(project_id, "category_id", category_id, None)
+            category_id = None
+        return assign_to_id, category_id
+
+    def invalidate(self, project_id):
+        """Scarta membri e categorie del progetto (es. dopo un aggiornamento rifiutato)."""
+        with self._lock:
+            self._details.pop(int(project_id), None)
+        (self._metadata or get_metadata()).invalidate(project_id)
+
+
+def find_attachment(issue_id, filename, data):
+    """Cerca tra gli allegati dell'issue un archivio già caricato.
+
+    Confronta nome, dimensione e, se Redmine lo espone, il digest (SHA-256
+    da Redmine 4.2, MD5 nelle versioni precedenti) con `data`. Restituisce
+    l'id dell'allegato oppure None.
+    """
+    issue = _client().issue.get(issue_id, include=['attachments'])
+    digests = {hashlib.sha256(data).hexdigest(), hashlib.md5(data).hexdigest()}
+    for attachment in getattr(issue, 'attachments', []) or []:
+        if getattr(attachment, 'filename', None) != filename:
+            continue
+        if int(getattr(attachment, 'filesize', -1)) != len(data):
+            continue
+        digest = getattr(attachment, 'digest', None)
+        if digest and digest.lower() not in digests:
+            continue
+        return attachment.id
+    return None
 
 
 def create_report_issue(project_identifier, subject, description, assigned_to_id=None, **extra_params):
@@ -77,5 +342,5 @@ def create_report_issue(project_identifier, subject, description, assigned_to_id
     if not params.get('project_id'):
         raise ValueError("project_id is required to create an issue")
 
-    issue = redmine.issue.create(**params)
+    issue = _client().issue.create(**params)
     return issue
@@ -6,20 +6,26 @@ Test runner for Redmine Password Visual Packer.
 Performs the following checks:
 1. Verifies Redmine connectivity and authentication
 2. Lists assigned tickets for the current user
-3. Lists projects where the current user is enabled
+3. Lists projects where the current user is enabled and validates the
+   configured projects (cached metadata directory, see `metadata.py`)
 4. Creates a test 7z archive with a dummy ticket ID
+
+With `--load N` it instead runs the full pipeline (`main.run`) against a local
+fake Redmine server (`fake_redmine.py`) seeded with N synthetic tickets and
+reports throughput and per-endpoint latency.
 """
 
 import argparse
 import os
 import sys
 import shutil
+import time
+from collections import Counter
+
+import config
 
-from redminelib import Redmine
-from config import REDMINE_URL, API_KEY, OUTPUT_DIR, ARCHIVE_PASSWORD, PROJECT_PASSWORDS
-from zipper import crea_7z_cifrato
-from password_utils import genera_password, crea_immagine
-from crypto_utils import run_visual_crypto
+# I moduli della pipeline (Pillow, python-docx, redminelib) sono importati
+# dai singoli test: i test saltati non ne pagano l'avvio
 
 
 def _get_current_user(redmine):
@@ -62,16 +68,18 @@ def _get_current_user(redmine):
 
 def test_connectivity():
     """Verifica la connessione e autenticazione con Redmine."""
+    from redminelib import Redmine
+
     print("[*] Testing Redmine connectivity...")
     try:
-        redmine = Redmine(REDMINE_URL, key=API_KEY)
+        redmine = Redmine(config.REDMINE_URL, key=config.API_KEY)
         user = _get_current_user(redmine)
-        print(f"[✓] Connected to {REDMINE_URL} as user: {user.login} (ID: {user.id})")
+        print(f"[✓] Connected to {config.REDMINE_URL} as user: {user.login} (ID: {user.id})")
         return redmine, user
     except Exception as e:
         print(f"[✗] Connection failed: {e}")
-        api_key_l = (API_KEY or "").lower()
-        if api_key_l.startswith("your_redmine_api") or API_KEY in {"CHANGEME", "", None}:
+        api_key_l = (config.API_KEY or "").lower()
+        if api_key_l.startswith("your_redmine_api") or config.API_KEY in {"CHANGEME", "", None}:
             print("[!] API key appears to be a placeholder. Verify config.yml is loaded and redmine.api_key is valid.")
         return None, None
 
@@ -98,24 +106,26 @@ def test_assigned_tickets(redmine):
         return []
 
 
-def test_user_projects(redmine, user_id):
-    """Lista i progetti su cui l'utente è abilitato."""
+def _metadata_directory(redmine):
+    """Directory dei metadati condivisa con `main.py`, servita dal client del test."""
+    from metadata import MetadataDirectory, metadata_path
+
+    path = metadata_path(config.METADATA_DIR, config.REDMINE_URL, config.API_KEY) if config.METADATA_DIR else None
+    return MetadataDirectory(path, lambda: redmine, ttl=config.METADATA_TTL, concurrency=config.METADATA_CONCURRENCY)
+
+
+def test_user_projects(metadata, refresh=False):
+    """Lista i progetti su cui l'utente è abilitato (membership lette con una sola richiesta)."""
     print("\n[*] Fetching user projects...")
     try:
-        projects = redmine.project.all()
-        user_projects = []
-        for p in projects:
-            try:
-                members = redmine.project_member.filter(project_id=p.id)
-                for m in members:
-                    if m.user.id == user_id:
-                        user_projects.append(p)
-                        break
-            except Exception:
-                pass
+        if refresh:
+            metadata.invalidate()
+        start = time.perf_counter()
+        user_projects = metadata.user_projects()
+        elapsed = time.perf_counter() - start
 
         if user_projects:
-            print(f"[✓] User is enabled on {len(user_projects)} project(s):")
+            print(f"[✓] User is enabled on {len(user_projects)} project(s) ({elapsed * 1000:.0f} ms):")
             for p in user_projects[:10]:
                 print(f"    - {p.name} (ID: {p.id}, Identifier: {p.identifier})")
             if len(user_projects) > 10:
@@ -128,15 +138,67 @@ def test_user_projects(redmine, user_id):
         return []
 
 
+def test_project_config(metadata):
+    """Verifica che i progetti configurati esistano e che `category_id` e
+    `assigned_to_id` dei parametri ticket siano validi per il progetto."""
+
+    print("\n[*] Validating configured projects...")
+    try:
+        start = time.perf_counter()
+        found = {}
+        problems = []
+        for record in config.PROJECTS:
+            if not record.configured:
+                continue
+            project = None
+            for alias in (record.id, record.identifier, record.name, record.key):
+                project = project or metadata.find_project(alias)
+            if project is None:
+                problems.append(f"{record.key}: project not found on Redmine")
+            else:
+                found[record.key] = (record, project)
+        details = metadata.details({project.id for _, project in found.values()})
+        for key, (record, project) in sorted(found.items()):
+            project_details = details.get(project.id)
+            if project_details is None:
+                problems.append(f"{key}: categories/members not readable")
+                continue
+            category_id = record.ticket_params.get("category_id")
+            if category_id not in (None, "") and int(category_id) not in project_details.categories:
+                problems.append(f"{key}: category_id {category_id} does not exist in project {project.identifier}")
+            assignee = record.ticket_params.get("assigned_to_id")
+            if assignee not in (None, "") and int(assignee) not in project_details.members:
+                problems.append(f"{key}: assigned_to_id {assignee} is not a member of project {project.identifier}")
+            elif assignee not in (None, "") and int(assignee) not in project_details.assignable:
+                problems.append(f"{key}: assigned_to_id {assignee} has no assignable role in project "
+                                f"{project.identifier}")
+        elapsed = time.perf_counter() - start
+        checked = sum(1 for record in config.PROJECTS if record.configured)
+        if problems:
+            print(f"[!] {len(problems)} problem(s) in {checked} configured project(s) ({elapsed * 1000:.0f} ms):")
+            for problem in problems:
+                print(f"    - {problem}")
+        else:
+            print(f"[✓] {checked} configured project(s) valid ({elapsed * 1000:.0f} ms)")
+        return not problems
+    except Exception as e:
+        print(f"[✗] Error validating projects: {e}")
+        return False
+
+
 def test_7z_creation(test_ticket_id=9999):
     """Crea un file 7z cifrato di prova usando un ticket ID fittizio.
     
     Ricrea la directory di test da zero se già presente.
     """
+    from zipper import crea_7z_cifrato
+    from password_utils import genera_password, crea_immagine
+    from crypto_utils import run_visual_crypto
+
     print(f"\n[*] Creating test 7z archive (ticket_id={test_ticket_id})...")
     
     # Prepara directory di test
-    test_dir = os.path.join(OUTPUT_DIR, f"ticket_{test_ticket_id}")
+    test_dir = os.path.join(config.OUTPUT_DIR, f"ticket_{test_ticket_id}")
     if os.path.exists(test_dir):
         print(f"    Removing existing test directory: {test_dir}")
         shutil.rmtree(test_dir)
@@ -166,7 +228,7 @@ def test_7z_creation(test_ticket_id=9999):
         print(f"    [✓] Created DOCX file: {docx_out}")
         
         # 5) Crea archivio 7z cifrato
-        archive_pwd = ARCHIVE_PASSWORD
+        archive_pwd = config.ARCHIVE_PASSWORD
         archive = crea_7z_cifrato(test_dir, test_ticket_id, archive_pwd)
         print(f"    [✓] Created encrypted 7z archive: {archive}")
         
@@ -187,6 +249,90 @@ def test_7z_creation(test_ticket_id=9999):
         return False
 
 
+def test_load(count, unconfigured_ratio=0.1, latency=0.0, error_rate=0.0, workers=1,
+              io_concurrency=None, in_memory=None, kits=0):
+    """Esegue `main.run` su N ticket sintetici serviti da un Redmine finto locale.
+
+    I ticket sono distribuiti sui progetti configurati e, per la quota
+    `unconfigured_ratio`, su progetti non configurati (ticket di segnalazione).
+    Con `kits` > 0 i primi ticket di ogni template/policy usano kit
+    pre-generati in un pool temporaneo (chiave casuale). Il test fallisce se
+    un ticket manca dai risultati, fallisce o riceve più di un archivio.
+    """
+    import main as packer
+    import redmine_utils
+    from fake_redmine import FakeRedmine
+    from metrics import RunMetrics
+
+    print(f"\n[*] Load test: {count} ticket(s) on a local fake Redmine "
+          f"(latency={latency}s, error_rate={error_rate}, workers={workers})...")
+    configured = sorted(config.PROJECT_PASSWORDS)
+    unconfigured = ["load-unconfigured-a", "load-unconfigured-b"]
+    if not configured:
+        print("[!] No projects configured: every ticket will be reported as missing project")
+
+    projects = []
+    for i in range(count):
+        if not configured or int((i + 1) * unconfigured_ratio) > int(i * unconfigured_ratio):
+            projects.append(unconfigured[int(i * unconfigured_ratio) % len(unconfigured)])
+        else:
+            projects.append(configured[i % len(configured)])
+
+    with FakeRedmine(latency=latency, error_rate=error_rate, seed=0) as fake:
+        members = [config.ASSIGN_TO_ID] if config.ASSIGN_TO_ID else ()
+        for name in configured:
+            fake.add_project(name, members=members)
+        if config.REPORT_CONFIG.get('project'):
+            fake.add_project(str(config.REPORT_CONFIG['project']), members=members)
+        fake.seed_tickets(count, projects)
+        # Metadati solo in memoria: ogni run usa un server (e una porta) diversi
+        redmine_utils.configure_client(fake.url, "load-test", metadata_dir="")
+
+        kit_dir = None
+        if kits:
+            import tempfile
+            from kit_pool import KitPool
+
+            kit_dir = tempfile.mkdtemp(prefix="packer-load-kits-")
+            pool = KitPool(kit_dir, os.urandom(32), low_watermark=0, high_watermark=kits)
+            for template, policy in packer._kit_specs():
+                pool.register(template, policy)
+            print(f"[*] Pre-generated kits: {pool.refill(until_full=True)}")
+            packer._KIT_POOL = pool
+
+        metrics = RunMetrics()
+        start = time.perf_counter()
+        try:
+            results = packer.run(workers=workers, in_memory=in_memory, io_concurrency=io_concurrency,
+                                 metrics=metrics)
+        finally:
+            if kit_dir is not None:
+                packer._KIT_POOL = None
+                shutil.rmtree(kit_dir, ignore_errors=True)
+        elapsed = time.perf_counter() - start
+        stats = fake.stats()
+        duplicates = sum(1 for issue in fake.issues.values() if len(issue["attachments"]) > 1)
+
+    outcomes = Counter(status for _, status, _ in results)
+    print(f"\n[✓] {len(results)} ticket(s) in {elapsed:.2f}s: {len(results) / elapsed:.1f} ticket/s")
+    print("    " + ", ".join(f"{status}={n}" for status, n in sorted(outcomes.items())))
+    print(f"    {'fase':<32}{'campioni':>10}{'media ms':>10}")
+    for stage, h in metrics.snapshot()["stages"].items():
+        print(f"    {stage:<32}{h['count']:>10}{h['sum_seconds'] / max(1, h['count']) * 1000:>10.1f}")
+    counters = stats.pop("counters", {})
+    print(f"    {'endpoint':<32}{'richieste':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for endpoint, m in sorted(stats.items()):
+        print(f"    {endpoint:<32}{m['requests']:>10}{m['p50_ms']:>10.1f}{m['p95_ms']:>10.1f}")
+    print("    " + ", ".join(f"{k}={v}" for k, v in sorted(counters.items())))
+    if duplicates:
+        print(f"[✗] {duplicates} ticket(s) received more than one archive")
+        return False
+    if len(results) != count:
+        print(f"[✗] {count - len(results)} ticket(s) missing from the run results")
+        return False
+    return outcomes.get("failed", 0) == 0
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Test runner for Redmine Password Visual Packer"
@@ -199,10 +345,36 @@ def main():
                         help="Skip assigned tickets listing")
     parser.add_argument('--skip-projects', action='store_true',
                         help="Skip user projects listing")
+    parser.add_argument('--refresh-metadata', action='store_true',
+                        help="Ignore the cached Redmine metadata and reload it")
     parser.add_argument('--skip-7z', action='store_true',
                         help="Skip 7z archive creation test")
+    parser.add_argument('--load', type=int, metavar='N',
+                        help="Load test: run main.run on N synthetic tickets against a local fake Redmine")
+    parser.add_argument('--load-unconfigured', type=float, default=0.1,
+                        help="Share of load-test tickets in unconfigured projects (default: 0.1)")
+    parser.add_argument('--load-latency', type=float, default=0.0,
+                        help="Fake Redmine latency per request in seconds (default: 0)")
+    parser.add_argument('--load-error-rate', type=float, default=0.0,
+                        help="Fraction of fake Redmine requests answered with 503 (default: 0)")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Load test: processes for the CPU-bound stages (default: 1)")
+    parser.add_argument('--io-concurrency', type=int, default=None,
+                        help="Load test: parallel Redmine uploads/updates (default: from config)")
+    parser.add_argument('--in-memory', action='store_true', default=None,
+                        help="Load test: keep artifacts in memory")
+    parser.add_argument('--load-kits', type=int, default=0, metavar='K',
+                        help="Load test: pre-generate K kits per template/policy in a temporary pool (default: 0)")
     args = parser.parse_args()
 
+    if args.load:
+        print("=" * 60)
+        print("Redmine Password Visual Packer - Load Test")
+        print("=" * 60)
+        ok = test_load(args.load, args.load_unconfigured, args.load_latency, args.load_error_rate,
+                       args.workers, args.io_concurrency, args.in_memory, args.load_kits)
+        return 0 if ok else 1
+
     print("=" * 60)
     print("Redmine Password Visual Packer - Test Suite")
     print("=" * 60)
@@ -224,7 +396,9 @@ def main():
         print("[*] Skipping tickets test")
 
     if not args.skip_projects and redmine and user:
-        test_user_projects(redmine, user.id)
+        metadata = _metadata_directory(redmine)
+        test_user_projects(metadata, args.refresh_metadata)
+        test_project_config(metadata)
     elif args.skip_projects:
         print("[*] Skipping projects test")
 
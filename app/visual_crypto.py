@@ -0,0 +1,157 @@
+"""
+Motore di crittografia visuale in-process.
+
+Produce le stesse due share dello script `visual_cryptography_py3__*.py`
+(schema 2-su-4: ogni pixel sorgente diventa un blocco 2x2 con due subpixel
+neri e due bianchi; la share B riceve lo stesso pattern per i pixel bianchi
+e il pattern complementare per quelli neri), ma:
+
+- estrae la casualità a blocchi da `os.urandom` invece di una syscall per pixel;
+- costruisce le share con operazioni bulk di Pillow (LUT/paste) invece di
+  `draw.point` per subpixel;
+- scrive direttamente i PNG finali con i pixel bianchi trasparenti, senza
+  passare dai file intermedi `__A`/`__B`.
+
+Le share hanno solo pixel neri e trasparenti: di default (`palette`) sono
+PNG a 1 bit con palette nero/bianco e il bianco trasparente (chunk tRNS),
+circa un ottavo dei dati di una share RGBA e molto più rapidi da
+comprimere; sovrapposte in Word appaiono identiche. `1bit` usa la scala di
+grigi a 1 bit con chiave di trasparenza, `rgba` il formato dello script
+originale (4 byte per pixel).
+"""
+
+import io
+import os
+
+# Pillow è importato nelle funzioni, al primo uso, per non pesare sull'avvio
+
+# I 6 (4 su 2) pattern possibili, nell'ordine dello script originale.
+# Indici dei subpixel: 0=(2x,2y) 1=(2x+1,2y) 2=(2x,2y+1) 3=(2x+1,2y+1)
+PATTERNS = ((1, 1, 0, 0), (1, 0, 1, 0), (1, 0, 0, 1),
+            (0, 1, 1, 0), (0, 1, 0, 1), (0, 0, 1, 1))
+
+# Byte >= 252 scartati: 252 è il massimo multiplo di 6 in un byte, così
+# `b % 6` resta uniforme (rejection sampling senza bias).
+_REJECT = bytes(range(252, 256))
+_MOD6 = bytes(b % 6 for b in range(256))
+
+# Codice per pixel: indice pattern (0-5) + 6 se il pixel sorgente è nero.
+# Una LUT per posizione di subpixel restituisce 255 (bianco) o 0 (nero).
+_LUT_A = [
+    [(255 if PATTERNS[code % 6][k] else 0) for code in range(256)]
+    for k in range(4)
+]
+_LUT_B = [
+    [(255 if (PATTERNS[code % 6][k] ^ (code >= 6)) else 0) for code in range(256)]
+    for k in range(4)
+]
+_DARK_TO_6 = [6 if v == 0 else 0 for v in range(256)]
+
+SHARE_FORMATS = ("palette", "1bit", "rgba")
+# Share 'L' 0/255 -> indice di palette 0 (nero) / 1 (bianco, trasparente)
+_TO_INDEX = [0] * 128 + [1] * 128
+_PALETTE = [0, 0, 0, 255, 255, 255]
+
+
+def random_pattern_indices(count, randbytes=os.urandom):
+    """Restituisce `count` byte uniformi in 0..5 estratti da `randbytes`."""
+    out = bytearray()
+    while len(out) < count:
+        # Piccolo margine per coprire i byte scartati (~1.6%).
+        need = count - len(out)
+        chunk = randbytes(need + (need >> 5) + 16)
+        out += chunk.translate(_MOD6, _REJECT)
+    return bytes(out[:count])
+
+
+def _compose(planes, size):
+    """Assembla 4 piani (uno per subpixel) in un'immagine 'L' di dimensione doppia."""
+    from PIL import Image
+
+    w, h = size
+    even = bytearray(2 * w * h)
+    odd = bytearray(2 * w * h)
+    even[0::2] = planes[0].tobytes()
+    even[1::2] = planes[1].tobytes()
+    odd[0::2] = planes[2].tobytes()
+    odd[1::2] = planes[3].tobytes()
+
+    # Ogni riga larga 4w = riga pari + riga dispari: reinterpretata a
+    # larghezza 2w diventa la coppia di righe (2y, 2y+1).
+    rows = Image.new('L', (4 * w, h))
+    rows.paste(Image.frombytes('L', (2 * w, h), bytes(even)), (0, 0))
+    rows.paste(Image.frombytes('L', (2 * w, h), bytes(odd)), (2 * w, 0))
+    return Image.frombytes('L', (2 * w, 2 * h), rows.tobytes())
+
+
+def split_image(img, randbytes=os.urandom):
+    """Divide `img` nelle due share A/B (immagini 'L' 0/255, dimensione doppia).
+
+    `randbytes` è iniettabile per ottenere output deterministici.
+    """
+    from PIL import Image, ImageChops
+
+    src = img.convert('1').convert('L')
+    indices = Image.frombytes('L', src.size, random_pattern_indices(src.size[0] * src.size[1], randbytes))
+    codes = ImageChops.add(indices, src.point(_DARK_TO_6))
+
+    share_a = _compose([codes.point(lut) for lut in _LUT_A], src.size)
+    share_b = _compose([codes.point(lut) for lut in _LUT_B], src.size)
+    return share_a, share_b
+
+
+def to_transparent(share):
+    """Converte una share 'L' 0/255 in RGBA con i pixel bianchi trasparenti."""
+    from PIL import Image, ImageChops
+
+    return Image.merge('RGBA', (share, share, share, ImageChops.invert(share)))
+
+
+def save_share(share, fp, fmt="palette", compress_level=6):
+    """Salva una share 'L' 0/255 come PNG con i pixel bianchi trasparenti.
+
+    `fmt` è uno di `SHARE_FORMATS`; `compress_level` (0-9) è il livello zlib
+    dell'encoder PNG.
+    """
+    from PIL import Image
+
+    if fmt == "palette":
+        img = Image.frombytes('P', share.size, share.point(_TO_INDEX).tobytes())
+        img.putpalette(_PALETTE)
+        img.save(fp, "PNG", bits=1, transparency=1, compress_level=compress_level)
+    elif fmt == "1bit":
+        share.convert('1').save(fp, "PNG", transparency=1, compress_level=compress_level)
+    elif fmt == "rgba":
+        to_transparent(share).save(fp, "PNG", compress_level=compress_level)
+    else:
+        raise ValueError(f"Formato share non supportato: {fmt} (disponibili: {', '.join(SHARE_FORMATS)})")
+
+
+def _png_bytes(share, fmt, compress_level):
+    buf = io.BytesIO()
+    save_share(share, buf, fmt, compress_level)
+    return buf.getvalue()
+
+
+def shares_png_bytes(img, randbytes=os.urandom, fmt="palette", compress_level=6):
+    """Come `write_shares`, ma restituisce i PNG (A, B) come bytes senza toccare il disco."""
+    share_a, share_b = split_image(img, randbytes)
+    return _png_bytes(share_a, fmt, compress_level), _png_bytes(share_b, fmt, compress_level)
+
+
+def write_shares(base_img_path, out_dir=None, randbytes=os.urandom, fmt="palette", compress_level=6):
+    """Genera `Password_A.png` e `Password_B.png` a partire da `base_img_path`.
+
+    Restituisce la coppia di percorsi scritti (di default accanto all'immagine base).
+    """
+    from PIL import Image
+
+    out_dir = out_dir or os.path.dirname(base_img_path)
+    with Image.open(base_img_path) as img:
+        share_a, share_b = split_image(img, randbytes)
+
+    a_path = os.path.join(out_dir, "Password_A.png")
+    b_path = os.path.join(out_dir, "Password_B.png")
+    save_share(share_a, a_path, fmt, compress_level)
+    save_share(share_b, b_path, fmt, compress_level)
+    return a_path, b_path
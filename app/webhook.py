@@ -0,0 +1,230 @@
+"""
+Listener HTTP per l'elaborazione su notifica (webhook).
+
+Accetta `POST /notify` con l'id del ticket da elaborare, ad esempio da un
+plugin webhook di Redmine o da uno script agganciato alla posta:
+
+    curl -X POST -H 'X-Packer-Token: <token>' 'http://packer:8080/notify?ticket_id=123'
+    curl -X POST -H 'X-Packer-Token: <token>' -H 'Content-Type: application/json' \
+         -d '{"ticket_id": 123}' http://packer:8080/notify
+
+Il token è accettato solo nell'header `X-Packer-Token` (in query string
+finirebbe nei log di accesso dei proxy); senza token il listener si avvia
+solo su un indirizzo di loopback.
+
+Sono riconosciuti anche i payload `{"ticket_ids": [...]}`, `{"issue": {"id": N}}`
+e `{"payload": {"issue": {"id": N}}}` (plugin redmine_webhook). `GET /healthz`
+restituisce lo stato della coda.
+
+Gli id ricevuti finiscono in `TicketQueue`, che unisce le raffiche: un id già
+in coda, o elaborato da meno di `dedupe_window` secondi, viene ignorato. Il
+daemon (vedi `main.run_daemon`) preleva gli id e li passa alla stessa pipeline
+di `main.run`; la notifica è solo un "risveglio": il ticket viene comunque
+riletto da Redmine e processato solo se è "Nuovo" e assegnato all'utente.
+"""
+
+import hmac
+import ipaddress
+import json
+import logging
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+logger = logging.getLogger(__name__)
+
+MAX_BODY = 64 * 1024
+
+
+class TicketQueue:
+    """Coda di id ticket con deduplica delle raffiche."""
+
+    def __init__(self, dedupe_window=30.0):
+        self.dedupe_window = dedupe_window
+        self._pending = {}      # id -> istante della prima notifica (ordine di arrivo)
+        self._recent = {}       # id -> istante del prelievo
+        self._cond = threading.Condition()
+
+    def put(self, ticket_id):
+        """Accoda `ticket_id`; False se è un duplicato della raffica corrente."""
+        now = time.monotonic()
+        with self._cond:
+            if ticket_id in self._pending:
+                return False
+            taken = self._recent.get(ticket_id)
+            if taken is not None and now - taken < self.dedupe_window:
+                return False
+            self._pending[ticket_id] = now
+            self._cond.notify_all()
+            return True
+
+    def drain(self, timeout, debounce=0.0):
+        """Attende fino a `timeout` secondi il primo id, poi altri `debounce`
+        secondi per raccogliere il resto della raffica; restituisce la lista
+        degli id (vuota allo scadere del timeout)."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while not self._pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return []
+                self._cond.wait(remaining)
+        if debounce:
+            time.sleep(debounce)
+        now = time.monotonic()
+        with self._cond:
+            ids = list(self._pending)
+            self._pending.clear()
+            for ticket_id in ids:
+                self._recent[ticket_id] = now
+            # Scarta le voci scadute della finestra di deduplica
+            self._recent = {k: v for k, v in self._recent.items() if now - v < self.dedupe_window}
+        return ids
+
+    def __len__(self):
+        with self._cond:
+            return len(self._pending)
+
+
+def _ticket_id(value):
+    # Solo interi o stringhe di cifre: true o 1.9 non sono id validi
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError(f"id ticket non valido: {value!r}")
+    ticket_id = int(value)
+    if ticket_id <= 0:
+        raise ValueError(f"id ticket non valido: {value!r}")
+    return ticket_id
+
+
+def parse_ticket_ids(query, body):
+    """Estrae gli id ticket dalla query string e/o dal corpo JSON della notifica.
+
+    Un payload di forma inattesa solleva `ValueError`.
+    """
+    ids = []
+    for key in ("ticket_id", "issue_id", "id"):
+        ids.extend(query.get(key, []))
+    if body:
+        payload = json.loads(body)
+        if isinstance(payload, dict):
+            payload = payload.get("payload", payload)
+            if not isinstance(payload, dict):
+                raise ValueError("'payload' deve essere un oggetto")
+            if "ticket_id" in payload:
+                ids.append(payload["ticket_id"])
+            ticket_ids = payload.get("ticket_ids") or []
+            if not isinstance(ticket_ids, list):
+                raise ValueError("'ticket_ids' deve essere una lista")
+            ids.extend(ticket_ids)
+            if isinstance(payload.get("issue"), dict) and "id" in payload["issue"]:
+                ids.append(payload["issue"]["id"])
+        elif isinstance(payload, list):
+            ids.extend(payload)
+        else:
+            raise ValueError("atteso un oggetto o una lista JSON")
+    result = []
+    for value in ids:
+        ticket_id = _ticket_id(value)
+        if ticket_id not in result:
+            result.append(ticket_id)
+    return result
+
+
+def is_loopback(host):
+    """True se `host` è un indirizzo di loopback (127.0.0.0/8, ::1) o "localhost"."""
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class WebhookServer:
+    """Server HTTP in un thread dedicato che alimenta una `TicketQueue`.
+
+    Senza `token` accetta solo un indirizzo di loopback: esposto in rete
+    chiunque potrebbe accodare ticket.
+    """
+
+    def __init__(self, queue, host="0.0.0.0", port=8080, token=None):
+        if not token and not is_loopback(host):
+            raise ValueError(f"webhook.token obbligatorio per ascoltare su {host} (senza token solo loopback)")
+        self.queue = queue
+        self.token = token
+        self.server = ThreadingHTTPServer((host, port), _make_handler(self))
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def address(self):
+        host, port = self.server.server_address[:2]
+        return f"{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name="webhook", daemon=True)
+        self._thread.start()
+        logger.info("Webhook listener on %s", self.address)
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def authorized(self, headers):
+        if not self.token:
+            return True
+        supplied = headers.get("X-Packer-Token") or ""
+        return hmac.compare_digest(str(supplied).encode(), str(self.token).encode())
+
+
+def parse_listen_address(value):
+    """'host:port' o ':port' -> (host, port)."""
+    host, _, port = str(value).rpartition(":")
+    return host or "0.0.0.0", int(port)
+
+
+def _make_handler(webhook):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, fmt, *args):
+            logger.debug("webhook %s - %s", self.address_string(), fmt % args)
+
+        def _send(self, code, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if urlsplit(self.path).path == "/healthz":
+                return self._send(200, {"status": "ok", "queued": len(webhook.queue)})
+            self._send(404, {"error": "not found"})
+
+        def do_POST(self):
+            parts = urlsplit(self.path)
+            query = parse_qs(parts.query)
+            length = int(self.headers.get("Content-Length") or 0)
+            if length > MAX_BODY:
+                return self._send(413, {"error": "payload troppo grande"})
+            body = self.rfile.read(length)
+            if parts.path not in ("/notify", "/"):
+                return self._send(404, {"error": "not found"})
+            if not webhook.authorized(self.headers):
+                return self._send(401, {"error": "token non valido"})
+            try:
+                ticket_ids = parse_ticket_ids(query, body)
+            except (ValueError, TypeError) as e:
+                return self._send(400, {"error": f"payload non valido: {e}"})
+            if not ticket_ids:
+                return self._send(400, {"error": "nessun id ticket"})
+            queued = [ticket_id for ticket_id in ticket_ids if webhook.queue.put(ticket_id)]
+            logger.info("Webhook: ticket %s queued, %d duplicate(s) ignored",
+                        queued, len(ticket_ids) - len(queued))
+            self._send(202, {"queued": queued, "duplicates": len(ticket_ids) - len(queued)})
+
+    return Handler
@@ -1,8 +1,40 @@
+import io
 import subprocess
 import os
-from typing import List
+import shutil
+import tempfile
+from typing import Dict, List, Union
+
+import config
+
+# Membri di un archivio: nome nell'archivio -> bytes in memoria o percorso di un file
+Members = Dict[str, Union[bytes, str]]
+
+# Directory in RAM usata di default per passare i membri in memoria al binario 7z
+DEFAULT_MEMORY_STAGING_DIR = "/dev/shm"
+
+
+def memory_staging_dir(staging_dir=None):
+    """Directory in cui il backend `7z` scrive i membri in memoria.
+
+    Senza `staging_dir` (`output.memory_staging_dir`) è `/dev/shm`. Se manca
+    non si ripiega sulla directory temporanea di sistema, che è su disco:
+    password e share finirebbero in chiaro sul disco. Serve allora indicarla
+    esplicitamente (anche su disco, se accettabile) o usare il backend native.
+    """
+    if staging_dir:
+        return staging_dir
+    if os.path.isdir(DEFAULT_MEMORY_STAGING_DIR):
+        return DEFAULT_MEMORY_STAGING_DIR
+    raise RuntimeError(
+        f"{DEFAULT_MEMORY_STAGING_DIR} non disponibile: impostare output.memory_staging_dir "
+        "(una directory in RAM, o su disco accettando che gli artefatti vi siano scritti in chiaro) "
+        "oppure archive.backend: native"
+    )
+
 
 def crea_zip_cifrato(output_dir, ticket_id, password):
+    """Legacy: usa ZipCrypto (debole) e una lista file fissa; preferire crea_7z_cifrato."""
     zipfile = f"{output_dir}/ticket_{ticket_id}.zip"
     subprocess.run([
         'zip', '-j', '-P', password, zipfile,
@@ -15,7 +47,102 @@ def crea_zip_cifrato(output_dir, ticket_id, password):
     return zipfile
 
 
-def crea_7z_cifrato(ticket_dir, ticket_id, password):
+class SevenZipBackend:
+    """Backend che usa il binario esterno `7z` (fork/exec per archivio)."""
+
+    name = "7z"
+
+    def __init__(self, staging_dir=None):
+        self.staging_dir = staging_dir
+
+    def write(self, dest, members: Members, password):
+        """Scrive in `dest` (percorso o file-like) un 7z cifrato con `members`.
+
+        Il binario lavora solo su file: i membri in memoria vengono scritti
+        in una directory temporanea privata sotto `staging_dir` (di default
+        `/dev/shm`, quindi in RAM; vedi `memory_staging_dir`) e rimossi
+        subito dopo.
+        """
+        needs_staging = hasattr(dest, 'write') or any(
+            not isinstance(data, str) or os.path.basename(data) != os.path.basename(name)
+            for name, data in members.items()
+        )
+        staging_dir = memory_staging_dir(self.staging_dir) if needs_staging else self.staging_dir
+
+        work_dir = tempfile.mkdtemp(prefix="archive_", dir=staging_dir)
+        try:
+            files = []
+            for name, data in members.items():
+                if isinstance(data, str):
+                    # Percorso su disco: passato così com'è se il nome coincide
+                    if os.path.basename(data) == os.path.basename(name):
+                        files.append(data)
+                        continue
+                    with open(data, 'rb') as f:
+                        data = f.read()
+                path = os.path.join(work_dir, os.path.basename(name))
+                fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                files.append(path)
+
+            if hasattr(dest, 'write'):
+                archive = os.path.join(work_dir, "archive.7z")
+                _run_7z(archive, files, password)
+                with open(archive, 'rb') as f:
+                    shutil.copyfileobj(f, dest)
+            else:
+                _run_7z(dest, files, password)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+class NativeBackend:
+    """Backend in-process (py7zr): LZMA2 + AES-256 con header cifrato, senza fork/exec.
+
+    Produce archivi equivalenti a `7z a -t7z -mhe=on -p`.
+    """
+
+    name = "native"
+
+    def __init__(self, staging_dir=None):
+        try:
+            import py7zr
+        except ImportError as e:
+            raise RuntimeError(
+                "Il backend 'native' richiede il pacchetto py7zr (pip install py7zr)"
+            ) from e
+        self._py7zr = py7zr
+
+    def write(self, dest, members: Members, password):
+        with self._py7zr.SevenZipFile(dest, 'w', password=password, header_encryption=True) as archive:
+            for name, data in members.items():
+                arcname = os.path.basename(name)
+                if isinstance(data, str):
+                    archive.write(data, arcname)
+                else:
+                    archive.writestr(data, arcname)
+
+
+ARCHIVE_BACKENDS = {
+    SevenZipBackend.name: SevenZipBackend,
+    NativeBackend.name: NativeBackend,
+}
+
+
+def get_archive_backend(name=None, staging_dir=None):
+    """Restituisce il backend di archiviazione (`archive.backend` in config)."""
+    name = (name or config.ARCHIVE_BACKEND or SevenZipBackend.name).lower()
+    try:
+        backend_cls = ARCHIVE_BACKENDS[name]
+    except KeyError:
+        raise ValueError(
+            f"Archive backend non supportato: {name} (disponibili: {', '.join(ARCHIVE_BACKENDS)})"
+        ) from None
+    return backend_cls(staging_dir=staging_dir)
+
+
+def crea_7z_cifrato(ticket_dir, ticket_id, password, backend=None):
     """Crea un archivio 7z cifrato contenente il contenuto di `ticket_dir`.
     Restituisce il percorso dell'archivio creato.
     """
@@ -26,10 +153,31 @@ def crea_7z_cifrato(ticket_dir, ticket_id, password):
     if not files:
         raise RuntimeError(f"Nessun file in {ticket_dir} da archiviare")
 
+    backend = backend or get_archive_backend()
+    backend.write(archive, {os.path.basename(f): f for f in files}, password)
+    return archive
+
+
+def crea_7z_cifrato_in_memoria(members: Dict[str, bytes], ticket_id, password, staging_dir=None, backend=None):
+    """Crea un archivio 7z cifrato a partire da file in memoria (nome -> bytes).
+
+    Con il backend `native` l'archivio è costruito interamente in memoria;
+    con `7z` i membri passano da `staging_dir` (vedi `SevenZipBackend`).
+    Restituisce (nome archivio, contenuto dell'archivio).
+    """
+    if not members:
+        raise RuntimeError(f"Nessun file da archiviare per il ticket {ticket_id}")
+
+    backend = backend or get_archive_backend(staging_dir=staging_dir)
+    buf = io.BytesIO()
+    backend.write(buf, members, password)
+    return f"ticket_{ticket_id}.7z", buf.getvalue()
+
+
+def _run_7z(archive, files, password):
     # Use '-p' without password so the password isn't visible in process list.
     # 7z will prompt twice for new archives; provide password twice via stdin.
     cmd: List[str] = ['7z', 'a', '-t7z', '-mhe=on', '-p', archive] + files
     # supply password twice (enter + re-enter) and a final newline
     pw_input = (password + '\n' + password + '\n').encode()
     subprocess.run(cmd, input=pw_input, check=True)
-    return archive
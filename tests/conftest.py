@@ -0,0 +1,5 @@
+import os
+import sys
+
+# I moduli dell'applicazione sono importati come script della directory app/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app"))
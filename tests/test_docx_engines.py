@@ -0,0 +1,62 @@
+"""I motori DOCX splice e python-docx producono lo stesso documento."""
+
+import io
+import os
+import posixpath
+import zipfile
+import xml.etree.ElementTree as ET
+
+import pytest
+from PIL import Image
+
+import docx_splice
+import mkdocx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEMPLATES = [
+    os.path.join(ROOT, "app", "static", "template.docx"),
+    os.path.join(ROOT, "ticket_238837.docx"),
+]
+W = "{%s}" % mkdocx.NAMESPACES["w"]
+WP = "{%s}" % mkdocx.NAMESPACES["wp"]
+
+
+def _share():
+    buf = io.BytesIO()
+    Image.new("1", (400, 100)).save(buf, "PNG")
+    return buf.getvalue()
+
+
+def _build(template, engine, paragraph_index):
+    out = io.BytesIO()
+    mkdocx.build_docx(template, io.BytesIO(_share()), out, paragraph_index, engine=engine)
+    return zipfile.ZipFile(out)
+
+
+def _tree(element):
+    return (element.tag, sorted(element.attrib.items()), (element.text or "").strip(),
+            [_tree(child) for child in element])
+
+
+def _document(docx):
+    """Testo dei paragrafi, ancoraggi (albero XML completo) e immagini referenziate."""
+    body = ET.fromstring(docx.read("word/document.xml")).find(W + "body")
+    paragraphs = ["".join(t.text or "" for t in p.iter(W + "t")) for p in body.iter(W + "p")]
+    anchors = [(i, _tree(anchor)) for i, p in enumerate(body.iter(W + "p")) for anchor in p.iter(WP + "anchor")]
+    rels = ET.fromstring(docx.read("word/_rels/document.xml.rels"))
+    images = {rel.get("Id"): docx.read(posixpath.normpath(posixpath.join("word", rel.get("Target"))))
+              for rel in rels if rel.get("Type", "").endswith("/image")}
+    return paragraphs, anchors, images
+
+
+@pytest.mark.parametrize("paragraph_index", [0, 3])
+@pytest.mark.parametrize("template", TEMPLATES, ids=os.path.basename)
+def test_splice_matches_python_docx(template, paragraph_index):
+    # Il template deve essere gestito dallo splice, non ricadere su python-docx
+    assert docx_splice.get_template(template, paragraph_index) is not None
+    spliced = _build(template, "splice", paragraph_index)
+    assert spliced.testzip() is None
+
+    expected = _document(_build(template, "python-docx", paragraph_index))
+    assert _document(spliced) == expected
+    assert len(expected[1]) > 0
@@ -0,0 +1,105 @@
+"""Ripresa dallo spool, re-upload idempotente e compattazione del journal."""
+
+import hashlib
+import os
+import time
+
+import pytest
+
+from fake_redmine import FakeRedmine
+from journal import TicketJournal
+
+ARCHIVE = ("ticket_1.7z", b"7z-cifrato" * 100)
+
+
+def _open(tmp_path, name="journal", retention_days=7):
+    return TicketJournal(str(tmp_path / f"{name}.jsonl"), str(tmp_path / "spool"), retention_days=retention_days)
+
+
+def test_resume_from_spool_after_restart(tmp_path):
+    with _open(tmp_path) as journal:
+        journal.spool(1, ARCHIVE)
+        journal.record(1, "upload")
+
+    with _open(tmp_path) as journal:
+        assert journal.pending() == [1]
+        assert journal.get(1)["stage"] == "upload"
+        assert journal.spooled(1) == ARCHIVE
+
+
+def test_truncated_record_and_corrupted_spool(tmp_path):
+    with _open(tmp_path) as journal:
+        journal.spool(1, ARCHIVE)
+    with open(tmp_path / "journal.jsonl", "a") as f:
+        f.write('{"ticket": 1, "stage": "publ')  # crash a metà scrittura
+    with open(tmp_path / "spool" / f"1-{ARCHIVE[0]}", "ab") as f:
+        f.write(b"x")
+
+    with _open(tmp_path) as journal:
+        assert journal.get(1)["stage"] == "built"
+        assert journal.spooled(1) is None
+
+
+def test_published_removes_spooled_archive(tmp_path):
+    with _open(tmp_path) as journal:
+        journal.spool(1, ARCHIVE)
+        journal.record(1, "published")
+        assert os.listdir(tmp_path / "spool") == []
+
+    with _open(tmp_path) as journal:
+        assert journal.pending() == []
+
+
+def test_compaction_keeps_files_of_other_journals(tmp_path):
+    with _open(tmp_path, "replica-a") as other:
+        other.spool(1, ARCHIVE)
+        foreign = other.get(1)["spool"]
+    stale = tmp_path / "spool" / "9-abbandonato.7z"
+    stale.write_bytes(b"vecchio")
+    old = time.time() - 8 * 86400
+    os.utime(stale, (old, old))
+
+    with _open(tmp_path, "replica-b"):
+        pass
+
+    # L'archivio in volo dell'altro journal resta, quello abbandonato no
+    assert os.path.exists(foreign)
+    assert not stale.exists()
+
+
+def test_compaction_drops_entries_past_retention(tmp_path):
+    with _open(tmp_path) as journal:
+        journal.spool(1, ARCHIVE)
+        journal.record(1, "failed", error="503", ts=time.time() - 8 * 86400)
+
+    with _open(tmp_path) as journal:
+        assert journal.pending() == []
+    assert os.listdir(tmp_path / "spool") == []
+
+
+@pytest.fixture
+def fake():
+    import redmine_utils
+
+    with FakeRedmine() as server:
+        server.seed_tickets(2, ["cfgd"])
+        redmine_utils.configure_client(server.url, "k", metadata_dir="")
+        yield server
+
+
+def test_interrupted_upload_is_not_uploaded_again(tmp_path, fake):
+    import main
+
+    name, data = ARCHIVE
+    fake.issues[1]["attachments"].append({"id": 50, "filename": name, "filesize": len(data),
+                                          "digest": hashlib.sha256(data).hexdigest()})
+    with _open(tmp_path) as journal:
+        for ticket_id in (1, 2):
+            journal.spool(ticket_id, ARCHIVE)
+            journal.record(ticket_id, "upload")
+
+        main._reconcile_journal(journal)
+
+        # L'allegato del ticket 1 era arrivato: chiuso senza ricaricare
+        assert journal.pending() == [2]
+        assert os.listdir(tmp_path / "spool") == [f"2-{name}"]
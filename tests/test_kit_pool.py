@@ -0,0 +1,122 @@
+"""Cifratura dei kit, prelievo esclusivo e posizione della chiave del pool."""
+
+import multiprocessing
+import os
+import shutil
+import stat
+
+import pytest
+
+from kit_pool import Kit, KitPool, load_pool_key
+
+KEY = bytes(range(32))
+TEMPLATE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app", "static", "template.docx")
+
+
+def _kit(password="Pw-1"):
+    return Kit(password, b"base", b"share a", b"share b", b"docx")
+
+
+@pytest.fixture
+def pool(tmp_path):
+    return KitPool(str(tmp_path / "pool"), KEY)
+
+
+def _files(pool, key_id, pattern=".kit"):
+    return sorted(name for name in os.listdir(pool._pool_dir(key_id)) if name.endswith(pattern))
+
+
+def test_sealed_kit_round_trip(pool):
+    key_id = pool.register(TEMPLATE, {})
+    pool.put(key_id, _kit())
+    name = _files(pool, key_id)[0]
+    with open(os.path.join(pool._pool_dir(key_id), name), "rb") as f:
+        assert b"Pw-1" not in f.read()
+
+    assert pool.take(TEMPLATE, {}) == _kit()
+    assert _files(pool, key_id) == []
+    assert pool.take(TEMPLATE, {}) is None
+    assert (pool.hits, pool.misses) == (1, 1)
+
+
+def test_tampered_kit_is_rejected(pool):
+    key_id = pool.register(TEMPLATE, {})
+    pool.put(key_id, _kit())
+    path = os.path.join(pool._pool_dir(key_id), _files(pool, key_id)[0])
+    with open(path, "r+b") as f:
+        f.seek(-1, os.SEEK_END)
+        last = f.read(1)
+        f.seek(-1, os.SEEK_END)
+        f.write(bytes([last[0] ^ 1]))
+
+    assert pool.take(TEMPLATE, {}) is None
+    assert _files(pool, key_id) == []
+
+
+def test_kit_bound_to_its_id_and_pool(pool):
+    key_id = pool.register(TEMPLATE, {})
+    other_id = pool.register(TEMPLATE, {"length": 30})
+    pool.put(key_id, _kit())
+    source = os.path.join(pool._pool_dir(key_id), _files(pool, key_id)[0])
+    # Stesso contenuto sotto un altro id e in un altro pool: i dati autenticati non corrispondono
+    shutil.copy(source, os.path.join(pool._pool_dir(key_id), "0" * 32 + ".kit"))
+    shutil.move(source, os.path.join(pool._pool_dir(other_id), os.path.basename(source)))
+
+    assert pool.take(TEMPLATE, {}) is None
+    assert pool.take(TEMPLATE, {"length": 30}) is None
+
+
+def test_wrong_key_is_rejected(pool):
+    key_id = pool.register(TEMPLATE, {})
+    pool.put(key_id, _kit())
+
+    assert KitPool(pool.root, bytes(32)).take(TEMPLATE, {}) is None
+    assert _files(pool, key_id) == []
+
+
+def _take(root, start, results):
+    start.wait()
+    kit = KitPool(root, KEY).take(TEMPLATE, {})
+    results.put(kit.password if kit is not None else None)
+
+
+def test_racing_takers_never_share_a_kit(pool):
+    key_id = pool.register(TEMPLATE, {})
+    for i in range(3):
+        pool.put(key_id, _kit(f"Pw-{i}"))
+    context = multiprocessing.get_context("fork")
+    start, results = context.Event(), context.Queue()
+    takers = [context.Process(target=_take, args=(pool.root, start, results)) for _ in range(8)]
+    for taker in takers:
+        taker.start()
+    start.set()
+    taken = [results.get(timeout=30) for _ in takers]
+    for taker in takers:
+        taker.join()
+
+    assert sorted(p for p in taken if p is not None) == ["Pw-0", "Pw-1", "Pw-2"]
+    assert taken.count(None) == 5
+    assert os.listdir(pool._pool_dir(key_id)) == ["pool.json"]
+
+
+def test_key_file_outside_pool_is_created_private(tmp_path, monkeypatch):
+    monkeypatch.delenv("KIT_POOL_KEY", raising=False)
+    key_file = tmp_path / "keys" / "kit_pool.key"
+
+    key = load_pool_key(str(key_file), str(tmp_path / "pool"))
+    assert len(key) == 32
+    assert stat.S_IMODE(os.stat(key_file).st_mode) == 0o600
+    assert load_pool_key(str(key_file), str(tmp_path / "pool")) == key
+
+
+@pytest.mark.parametrize("inside", ["pool/kit_pool.key", "pool/abc/kit_pool.key", "pool/../pool/k.key"])
+def test_key_file_inside_pool_is_refused(tmp_path, monkeypatch, inside):
+    monkeypatch.delenv("KIT_POOL_KEY", raising=False)
+    with pytest.raises(ValueError, match="directory del pool"):
+        load_pool_key(str(tmp_path / inside), str(tmp_path / "pool"))
+    assert not (tmp_path / "pool").exists()
+
+
+def test_key_from_environment(monkeypatch, tmp_path):
+    monkeypatch.setenv("KIT_POOL_KEY", KEY.hex())
+    assert load_pool_key(None, str(tmp_path / "pool")) == KEY
@@ -0,0 +1,101 @@
+"""Claim, verifica, scadenza e recupero dei lease contro il server Redmine finto."""
+
+import threading
+import time
+
+import pytest
+from redminelib import Redmine
+
+from fake_redmine import FakeRedmine, STATUS_NEW
+from lease import LeaseManager
+
+LEASE_STATUS = 2
+LEASE_FIELD = 9
+
+
+@pytest.fixture
+def fake():
+    with FakeRedmine() as server:
+        server.seed_tickets(6, ["cfgd"])
+        yield server
+
+
+def _manager(fake, owner, mode, ttl=900):
+    client = Redmine(fake.url, key="k")
+    return LeaseManager(lambda: client, mode=mode, owner=owner, ttl=ttl, status_id=LEASE_STATUS,
+                        custom_field_id=LEASE_FIELD, new_status_id=STATUS_NEW, settle=0.2, concurrency=4)
+
+
+def _compete(managers, ticket_ids):
+    """Claim contemporaneo degli stessi ticket da più repliche."""
+    barrier = threading.Barrier(len(managers))
+    won = [None] * len(managers)
+
+    def claim(index):
+        barrier.wait()
+        won[index] = managers[index].claim(ticket_ids)
+
+    threads = [threading.Thread(target=claim, args=(i,)) for i in range(len(managers))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return won
+
+
+@pytest.mark.parametrize("mode", ["status", "custom_field"])
+def test_competing_claims_have_one_winner_per_ticket(fake, mode):
+    ticket_ids = sorted(fake.issues)
+    first, second = _compete([_manager(fake, "r0", mode), _manager(fake, "r1", mode)], ticket_ids)
+
+    assert not first & second
+    assert first | second == set(ticket_ids)
+    expected_status = LEASE_STATUS if mode == "status" else STATUS_NEW
+    assert {issue["status"]["id"] for issue in fake.issues.values()} == {expected_status}
+
+
+def test_custom_field_lease_is_not_taken_until_expired(fake):
+    holder = _manager(fake, "r0", "custom_field")
+    assert holder.claim([1]) == {1}
+    assert _manager(fake, "r1", "custom_field").claim([1]) == set()
+    assert holder.held(1)
+
+
+def test_expired_custom_field_lease_is_taken_over(fake):
+    holder = _manager(fake, "r0", "custom_field", ttl=0)
+    assert holder.claim([1]) == {1}
+    time.sleep(1.1)  # scadenza con risoluzione al secondo
+
+    assert _manager(fake, "r1", "custom_field").claim([1]) == {1}
+    assert not holder.held(1)
+
+
+def test_recover_requeues_expired_status_lease(fake):
+    holder = _manager(fake, "r0", "status", ttl=0)
+    assert holder.claim([1, 2]) == {1, 2}
+    time.sleep(1.1)
+
+    assert _manager(fake, "r1", "status", ttl=0).recover() == 2
+    assert {fake.issues[i]["status"]["id"] for i in (1, 2)} == {STATUS_NEW}
+    assert not holder.held(1)
+
+    assert _manager(fake, "r1", "status").claim([2]) == {2}
+    assert not holder.held(2)
+
+
+def test_held_within_half_ttl_without_requests(fake):
+    holder = _manager(fake, "r0", "status")
+    assert holder.claim([1]) == {1}
+    fake.issues[1]["status"] = {"id": STATUS_NEW, "name": "Nuovo"}
+
+    # Entro metà del ttl il lease non può essere stato recuperato: nessuna rilettura
+    assert holder.held(1)
+    assert not holder.held(2)
+
+
+def test_status_claim_skips_ticket_no_longer_new(fake):
+    # Pagina letta prima che un'altra replica risolvesse il ticket
+    fake.issues[1]["status"] = {"id": 3, "name": "Risolto"}
+
+    assert _manager(fake, "r1", "status").claim([1, 2]) == {2}
+    assert fake.issues[1]["status"]["id"] == 3
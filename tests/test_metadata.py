@@ -0,0 +1,48 @@
+"""Assegnabilità dei membri letta dai ruoli e uso in `UpdatePlanner`."""
+
+import pytest
+from redminelib import Redmine
+
+from fake_redmine import FakeRedmine
+from metadata import MetadataDirectory
+from redmine_utils import UpdatePlanner
+
+MANAGER = 7
+OBSERVER = 8
+
+
+@pytest.fixture
+def fake():
+    with FakeRedmine() as server:
+        server.add_project("cfgd", members=[MANAGER], observers=[OBSERVER])
+        yield server
+
+
+def _directory(fake, tmp_path):
+    client = Redmine(fake.url, key="k")
+    return MetadataDirectory(str(tmp_path / "metadata.json"), lambda: client)
+
+
+def test_observer_is_member_but_not_assignable(fake, tmp_path):
+    details = _directory(fake, tmp_path).details([1])[1]
+
+    assert {MANAGER, OBSERVER} <= set(details.members)
+    assert MANAGER in details.assignable
+    assert OBSERVER not in details.assignable
+
+
+def test_role_assignability_is_cached(fake, tmp_path):
+    _directory(fake, tmp_path).details([1])
+    fake.timings.clear()
+
+    # Seconda istanza sulla stessa directory: nessuna rilettura dei ruoli
+    assert OBSERVER not in _directory(fake, tmp_path).details([1])[1].assignable
+    assert "GET /roles/:id" not in fake.timings
+
+
+def test_planner_replaces_observer_with_fallback(fake, tmp_path):
+    planner = UpdatePlanner(_directory(fake, tmp_path))
+
+    assert planner.plan(1, assign_to_id=OBSERVER, fallback_assign_to_id=MANAGER) == (MANAGER, None)
+    assert planner.plan(1, assign_to_id=OBSERVER, fallback_assign_to_id=OBSERVER) == (None, None)
+    assert planner.plan(1, assign_to_id=MANAGER) == (MANAGER, None)
@@ -0,0 +1,90 @@
+"""Ereditarietà da `parent` e risoluzione dei progetti con la gerarchia Redmine."""
+
+import pytest
+
+from config import _build_project_registry
+
+PROJECTS = {
+    "infra": {
+        "password": "segreta",
+        "identifier": "infra",
+        "name": "Infrastruttura",
+        "id": 10,
+        "docx_template": "/templates/infra.docx",
+        "password_policy": {"length": 20, "exclude": "0O"},
+        "ticket": {"category_id": 5, "assigned_to_id": 3},
+    },
+    "infra-rete": {
+        "parent": "Infrastruttura",
+        "identifier": "infra-rete",
+        "password_policy": {"length": 24},
+        "ticket": {"category_id": 6},
+    },
+    "infra-lab": {"parent": "infra", "identifier": "infra-lab", "subprojects": False},
+    "solo-report": {"identifier": "solo-report", "ticket": {"assigned_to_id": 9}},
+}
+
+# Gerarchia Redmine: (identificatore, nome, id) dal progetto alla radice
+HIERARCHY = {
+    101: [("infra-rete-core", "Core", 101), ("infra-rete", "Rete", 20), ("infra", "Infrastruttura", 10)],
+    102: [("infra-lab-x", "Lab X", 102), ("infra-lab", "Lab", 30), ("infra", "Infrastruttura", 10)],
+    103: [("altro", "Altro", 103)],
+}
+
+
+@pytest.fixture
+def registry():
+    return _build_project_registry(PROJECTS)
+
+
+def test_child_inherits_from_parent(registry):
+    child = registry.get("infra-rete")
+
+    assert child.password == "segreta"
+    assert child.docx_template == "/templates/infra.docx"
+    assert child.password_policy == {"length": 24, "exclude": "0O"}
+    assert child.ticket_params == {"category_id": 6, "assigned_to_id": 3}
+    assert child.subprojects is True
+    assert registry.get("infra-lab").subprojects is False
+
+
+def test_report_only_project_is_not_configured(registry):
+    assert not registry.get("solo-report").configured
+    assert registry.get("solo-report").ticket_params == {"assigned_to_id": 9}
+
+
+@pytest.mark.parametrize("projects, message", [
+    ({"a": {"password": "x", "parent": "manca"}}, "unknown parent"),
+    ({"a": {"password": "x", "parent": "b"}, "b": {"parent": "a"}}, "circular parent"),
+    ({"a": {"password": "x", "name": "b"}, "b": {"password": "y"}}, "refers to both"),
+])
+def test_invalid_hierarchy_is_rejected(projects, message):
+    with pytest.raises(ValueError, match=message):
+        _build_project_registry(projects)
+
+
+def test_resolve_by_alias_skips_lineage(registry):
+    def lineage(project_id):
+        raise AssertionError("lineage non necessaria")
+
+    assert registry.resolve(name="Infrastruttura", project_id=10, lineage=lineage).key == "infra"
+    assert registry.resolve(identifier="infra-rete", project_id=20, lineage=lineage).key == "infra-rete"
+
+
+def test_resolve_walks_lineage_to_nearest_ancestor(registry):
+    calls = []
+
+    def lineage(project_id):
+        calls.append(project_id)
+        return HIERARCHY[project_id]
+
+    assert registry.resolve("infra-rete-core", "Core", 101, lineage=lineage).key == "infra-rete"
+    assert calls == [101]
+
+
+def test_resolve_stops_at_ancestor_without_subprojects(registry):
+    lineage = HIERARCHY.__getitem__
+
+    assert registry.resolve("infra-lab-x", "Lab X", 102, lineage=lineage) is None
+    assert registry.resolve("altro", "Altro", 103, lineage=lineage) is None
+    assert registry.resolve("infra-lab-x", "Lab X", 102) is None
@@ -0,0 +1,191 @@
+"""
+Test di `visual_crypto` con casualità fissa: output confrontato con le share
+di riferimento in `tests/data`, con lo script originale e invarianti dello
+schema 2-su-4.
+
+Le share di riferimento sono prodotte dallo script originale
+(`visual_cryptography_py3__versione2 1 1.py`) con la stessa casualità del
+motore in-process; si rigenerano con
+`PYTHONPATH=app python tests/test_visual_crypto.py --regenerate`.
+"""
+
+import hashlib
+import io
+import os
+import random
+import runpy
+import sys
+import tempfile
+
+import pytest
+from PIL import Image
+
+import crypto_utils
+from visual_crypto import PATTERNS, SHARE_FORMATS, random_pattern_indices, split_image, write_shares
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+LEGACY_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app",
+                             "visual_cryptography_py3__versione2 1 1.py")
+GOLDEN_A = os.path.join(DATA_DIR, "share_a.png")
+GOLDEN_B = os.path.join(DATA_DIR, "share_b.png")
+
+
+def fixed_randbytes(seed=b"visual-crypto"):
+    """Sorgente di byte deterministica (SHA-256 in modalità contatore)."""
+    counter = 0
+    buffer = bytearray()
+
+    def randbytes(n):
+        nonlocal counter
+        while len(buffer) < n:
+            buffer.extend(hashlib.sha256(seed + counter.to_bytes(8, "big")).digest())
+            counter += 1
+        out = bytes(buffer[:n])
+        del buffer[:n]
+        return out
+
+    return randbytes
+
+
+def source_image():
+    """Immagine sorgente 24x10 in bianco e nero, senza font (indipendente da FreeType)."""
+    img = Image.new("1", (24, 10), 1)
+    for y in range(10):
+        for x in range(24):
+            if (x * 7 + y * 3) % 5 < 2 or x == y:
+                img.putpixel((x, y), 0)
+    return img
+
+
+class _ReplayRandom:
+    """Sostituto di `SystemRandom` per lo script originale: `choice` restituisce i
+    pattern che il motore in-process estrae da `randbytes`.
+
+    Il motore consuma gli indici riga per riga, lo script colonna per colonna.
+    """
+
+    def __init__(self, size, randbytes):
+        width, height = size
+        indices = random_pattern_indices(width * height, randbytes)
+        self._order = iter([indices[y * width + x] for x in range(width) for y in range(height)])
+
+    def choice(self, patterns):
+        return patterns[next(self._order)]
+
+
+def legacy_shares(img, randbytes):
+    """Share (A, B) dello script originale come immagini 'L' 0/255."""
+    workdir = tempfile.mkdtemp(prefix="legacy_vc_")
+    infile = os.path.join(workdir, "base.png")
+    img.save(infile)
+    saved = random.SystemRandom, sys.argv, os.getcwd()
+    random.SystemRandom = lambda: _ReplayRandom(img.size, randbytes)
+    sys.argv = [LEGACY_SCRIPT, infile]
+    os.chdir(workdir)  # lo script scrive Password_A/B.png nella directory corrente
+    try:
+        runpy.run_path(LEGACY_SCRIPT, run_name="__main__")
+        shares = []
+        for name in ("Password_A.png", "Password_B.png"):
+            with Image.open(name) as share:
+                shares.append(share.convert("L"))
+        return tuple(shares)
+    finally:
+        random.SystemRandom, sys.argv = saved[:2]
+        os.chdir(saved[2])
+        for name in os.listdir(workdir):
+            os.remove(os.path.join(workdir, name))
+        os.rmdir(workdir)
+
+
+def blocks(share):
+    """Blocchi 2x2 di una share 'L' come tuple (0=nero, 1=bianco) nell'ordine dei subpixel."""
+    w, h = share.size
+    px = share.load()
+    return {
+        (x, y): tuple(int(px[2 * x + dx, 2 * y + dy] == 255) for dx, dy in ((0, 0), (1, 0), (0, 1), (1, 1)))
+        for y in range(h // 2) for x in range(w // 2)
+    }
+
+
+def test_split_image_matches_golden_shares():
+    share_a, share_b = split_image(source_image(), fixed_randbytes())
+    with Image.open(GOLDEN_A) as golden_a, Image.open(GOLDEN_B) as golden_b:
+        assert share_a.tobytes() == golden_a.convert("L").tobytes()
+        assert share_b.tobytes() == golden_b.convert("L").tobytes()
+
+
+@pytest.mark.parametrize("seed", [b"visual-crypto", b"other seed"])
+def test_split_image_matches_legacy_script(seed):
+    img = source_image()
+    expected_a, expected_b = legacy_shares(img, fixed_randbytes(seed))
+    share_a, share_b = split_image(img, fixed_randbytes(seed))
+    assert share_a.tobytes() == expected_a.tobytes()
+    assert share_b.tobytes() == expected_b.tobytes()
+
+
+def test_split_image_is_deterministic_with_fixed_randbytes():
+    first = split_image(source_image(), fixed_randbytes())
+    second = split_image(source_image(), fixed_randbytes())
+    assert [s.tobytes() for s in first] == [s.tobytes() for s in second]
+    other = split_image(source_image(), fixed_randbytes(b"other seed"))
+    assert first[0].tobytes() != other[0].tobytes()
+
+
+def test_two_of_four_pattern_and_complement():
+    src = source_image()
+    share_a, share_b = split_image(src, fixed_randbytes())
+    assert share_a.size == share_b.size == (2 * src.width, 2 * src.height)
+    assert set(share_a.tobytes()) | set(share_b.tobytes()) <= {0, 255}
+
+    patterns = {tuple(1 - bit for bit in p) for p in PATTERNS}   # nero=0 nei blocchi
+    blocks_a, blocks_b = blocks(share_a), blocks(share_b)
+    for (x, y), block_a in blocks_a.items():
+        block_b = blocks_b[(x, y)]
+        # Ogni blocco ha esattamente due subpixel neri e due bianchi
+        assert block_a in patterns and block_b in patterns
+        if src.getpixel((x, y)):
+            # Pixel bianco: stesso pattern, sovrapposte restano due subpixel neri
+            assert block_b == block_a
+        else:
+            # Pixel nero: pattern complementare, sovrapposte il blocco è tutto nero
+            assert block_b == tuple(1 - bit for bit in block_a)
+
+
+def assert_share_matches_golden(path, golden):
+    """Il PNG scritto è nero opaco dove la share di riferimento è nera, trasparente altrove."""
+    with Image.open(path) as share, Image.open(golden) as expected:
+        alpha = share.convert("RGBA").getchannel("A").point(lambda a: 255 - a)
+        assert alpha.tobytes() == expected.convert("L").tobytes()
+
+
+@pytest.mark.parametrize("fmt", SHARE_FORMATS)
+def test_written_shares_decode_to_golden(tmp_path, fmt):
+    base = tmp_path / "base.png"
+    source_image().save(base)
+    a_path, b_path = write_shares(str(base), randbytes=fixed_randbytes(), fmt=fmt)
+    assert_share_matches_golden(a_path, GOLDEN_A)
+    assert_share_matches_golden(b_path, GOLDEN_B)
+
+
+def test_run_visual_crypto_writes_shares_next_to_base(tmp_path, monkeypatch):
+    base = tmp_path / "ticket_1.png"
+    source_image().save(base)
+    monkeypatch.setattr(crypto_utils, "write_shares",
+                        lambda path, **kwargs: write_shares(path, randbytes=fixed_randbytes(), **kwargs))
+    a_path, b_path = crypto_utils.run_visual_crypto(str(base), engine="inprocess")
+    assert (a_path, b_path) == (str(tmp_path / "Password_A.png"), str(tmp_path / "Password_B.png"))
+    assert_share_matches_golden(a_path, GOLDEN_A)
+    assert_share_matches_golden(b_path, GOLDEN_B)
+
+
+def _regenerate():
+    share_a, share_b = legacy_shares(source_image(), fixed_randbytes())
+    os.makedirs(DATA_DIR, exist_ok=True)
+    share_a.save(GOLDEN_A)
+    share_b.save(GOLDEN_B)
+    print(f"Share di riferimento scritte in {DATA_DIR}")
+
+
+if __name__ == "__main__":
+    if "--regenerate" in sys.argv:
+        _regenerate()
@@ -0,0 +1,68 @@
+"""Parsing delle notifiche e autenticazione del listener webhook."""
+
+import http.client
+import json
+
+import pytest
+
+from webhook import TicketQueue, WebhookServer, parse_ticket_ids
+
+
+@pytest.mark.parametrize("body, expected", [
+    ({"ticket_id": 12}, [12]),
+    ({"ticket_ids": [3, "4", 3]}, [3, 4]),
+    ({"payload": {"issue": {"id": 7}}}, [7]),
+    ([5, 6], [5, 6]),
+])
+def test_parse_ticket_ids(body, expected):
+    assert parse_ticket_ids({}, json.dumps(body).encode()) == expected
+
+
+@pytest.mark.parametrize("body", [
+    {"payload": "x"},
+    {"payload": [1]},
+    {"ticket_ids": 5},
+    {"ticket_id": True},
+    {"ticket_id": 1.9},
+    {"ticket_id": 0},
+    "12",
+])
+def test_parse_ticket_ids_rejects_malformed_payload(body):
+    with pytest.raises(ValueError):
+        parse_ticket_ids({}, json.dumps(body).encode())
+
+
+@pytest.fixture
+def server():
+    listener = WebhookServer(TicketQueue(), "127.0.0.1", 0, token="s3cret").start()
+    yield listener
+    listener.stop()
+
+
+def _post(listener, path, body=b"", headers=None):
+    host, port = listener.server.server_address[:2]
+    connection = http.client.HTTPConnection(host, port, timeout=5)
+    connection.request("POST", path, body=body, headers=headers or {})
+    response = connection.getresponse()
+    payload = json.loads(response.read() or b"null")
+    connection.close()
+    return response.status, payload
+
+
+def test_malformed_payload_gets_400(server):
+    status, payload = _post(server, "/notify", b'{"payload": [1]}', {"X-Packer-Token": "s3cret"})
+    assert status == 400
+    assert "payload" in payload["error"]
+
+
+def test_token_only_accepted_in_header(server):
+    assert _post(server, "/notify?ticket_id=1&token=s3cret")[0] == 401
+    status, payload = _post(server, "/notify?ticket_id=1", headers={"X-Packer-Token": "s3cret"})
+    assert status == 202
+    assert payload["queued"] == [1]
+
+
+def test_refuses_network_address_without_token():
+    with pytest.raises(ValueError):
+        WebhookServer(TicketQueue(), "0.0.0.0", 0)
+    WebhookServer(TicketQueue(), "127.0.0.1", 0).server.server_close()
@@ -0,0 +1,34 @@
+"""Directory di appoggio del backend 7z in modalità memoria."""
+
+import io
+
+import pytest
+
+import zipper
+from zipper import SevenZipBackend, memory_staging_dir
+
+
+@pytest.fixture
+def no_shm(monkeypatch, tmp_path):
+    monkeypatch.setattr(zipper, "DEFAULT_MEMORY_STAGING_DIR", str(tmp_path / "shm-assente"))
+
+
+def test_default_staging_is_dev_shm(monkeypatch, tmp_path):
+    monkeypatch.setattr(zipper, "DEFAULT_MEMORY_STAGING_DIR", str(tmp_path))
+    assert memory_staging_dir() == str(tmp_path)
+    assert memory_staging_dir("/srv/staging") == "/srv/staging"
+
+
+def test_missing_dev_shm_does_not_fall_back_to_disk(no_shm, monkeypatch):
+    monkeypatch.setattr(zipper, "_run_7z", lambda *args: pytest.fail("7z avviato senza directory in RAM"))
+
+    with pytest.raises(RuntimeError, match="memory_staging_dir"):
+        SevenZipBackend().write(io.BytesIO(), {"ticket_1_password.txt": b"segreta"}, "pw")
+
+
+def test_explicit_staging_dir_is_used(no_shm, monkeypatch, tmp_path):
+    staged = []
+    monkeypatch.setattr(zipper, "_run_7z", lambda archive, files, password: staged.extend(files))
+
+    SevenZipBackend(staging_dir=str(tmp_path)).write(str(tmp_path / "a.7z"), {"a.txt": b"x"}, "pw")
+    assert staged and all(path.startswith(str(tmp_path)) for path in staged)